@@ -0,0 +1,142 @@
+# build_poi_store.py (OFFLINE POI STORE FOR /nearby-places)
+#
+# Usage: python build_poi_store.py <city.osm | city.osm.pbf> [data/poi_store]
+#
+# Extracts the amenity classes /nearby-places looks for from an OSM extract and writes
+# them as a columnar store: one .npy file per column plus a UTF-8 string table, sorted
+# by geohash so every geohash cell is one contiguous slice. main.py memory-maps the
+# files, so workers share the OS page cache instead of each holding a copy.
+
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+# Same classes as NEARBY_AMENITIES in main.py (the Overpass query); keep them in sync.
+AMENITIES = ('restaurant', 'hospital', 'school', 'university', 'bank', 'fuel', 'parking',
+             'pharmacy', 'post_office', 'police', 'fire_station')
+GEOHASH_BITS = 40  # geohash precision 8 (~38 m cells); coarser cells are prefixes of the key
+
+def bbox_center(points):
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    return (min(lats) + max(lats)) / 2, (min(lons) + max(lons)) / 2
+
+# --- Step 1: Read the OSM extract ---
+def read_osm_xml(path):
+    """Named amenity nodes and ways; ways are placed at their bbox centre like Overpass `out center`."""
+    nodes, way_refs, pois = {}, [], []
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'node':
+            lat, lon = float(elem.get('lat')), float(elem.get('lon'))
+            nodes[int(elem.get('id'))] = (lat, lon)
+            tags = {t.get('k'): t.get('v') for t in elem.findall('tag')}
+            if tags.get('amenity') in AMENITIES and tags.get('name'):
+                pois.append((lat, lon, tags['name'], tags['amenity']))
+            elem.clear()
+        elif elem.tag == 'way':
+            tags = {t.get('k'): t.get('v') for t in elem.findall('tag')}
+            if tags.get('amenity') in AMENITIES and tags.get('name'):
+                way_refs.append(([int(nd.get('ref')) for nd in elem.findall('nd')], tags))
+            elem.clear()
+        elif elem.tag == 'relation':
+            elem.clear()
+    for refs, tags in way_refs:
+        points = [nodes[r] for r in refs if r in nodes]
+        if points:
+            pois.append((*bbox_center(points), tags['name'], tags['amenity']))
+    return pois
+
+def read_osm_pbf(path):
+    try:
+        import osmium
+    except ImportError:
+        print("❌ FATAL ERROR: reading .pbf needs the 'osmium' package (pip install osmium); "
+              "or convert the extract to .osm XML first.")
+        sys.exit(1)
+
+    class PoiHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.pois = []
+
+        def node(self, n):
+            amenity, name = n.tags.get('amenity'), n.tags.get('name')
+            if amenity in AMENITIES and name:
+                self.pois.append((n.location.lat, n.location.lon, name, amenity))
+
+        def way(self, w):
+            amenity, name = w.tags.get('amenity'), w.tags.get('name')
+            if amenity in AMENITIES and name:
+                points = [(nd.location.lat, nd.location.lon) for nd in w.nodes if nd.location.valid()]
+                if points:
+                    self.pois.append((*bbox_center(points), name, amenity))
+
+    handler = PoiHandler()
+    handler.apply_file(path, locations=True)
+    return handler.pois
+
+# --- Step 2: Spatial sort ---
+def geohash_keys(lat, lon, bits=GEOHASH_BITS):
+    """Integer geohash: interleaved lon/lat bits, longitude first, as in the base32 string form."""
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    lat_q = np.clip(((lat + 90.0) / 180.0 * (1 << lat_bits)).astype(np.uint64), 0, (1 << lat_bits) - 1)
+    lon_q = np.clip(((lon + 180.0) / 360.0 * (1 << lon_bits)).astype(np.uint64), 0, (1 << lon_bits) - 1)
+    keys = np.zeros(lat.shape, dtype=np.uint64)
+    for i in range(bits):
+        if i % 2 == 0:
+            bit = (lon_q >> np.uint64(lon_bits - 1 - i // 2)) & np.uint64(1)
+        else:
+            bit = (lat_q >> np.uint64(lat_bits - 1 - i // 2)) & np.uint64(1)
+        keys |= bit << np.uint64(bits - 1 - i)
+    return keys
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python build_poi_store.py <city.osm | city.osm.pbf> [data/poi_store]")
+        sys.exit(1)
+    source = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else os.path.join('data', 'poi_store')
+    print("--- Starting POI store build ---")
+
+    started = time.time()
+    pois = read_osm_pbf(source) if source.endswith('.pbf') else read_osm_xml(source)
+    if not pois:
+        print(f"❌ FATAL ERROR: no named {', '.join(AMENITIES)} amenities found in {source}")
+        sys.exit(1)
+    print(f"✅ Step 1: Read {len(pois)} POIs from {source} ({time.time() - started:.0f}s)")
+
+    lat = np.array([p[0] for p in pois], dtype=np.float64)
+    lon = np.array([p[1] for p in pois], dtype=np.float64)
+    keys = geohash_keys(lat, lon)
+    order = np.argsort(keys, kind='stable')
+    print("✅ Step 2: Sorted POIs by geohash")
+
+    encoded = [pois[i][2].encode('utf-8') for i in order]
+    name_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=name_offsets[1:])
+    amenity_code = {a: i for i, a in enumerate(AMENITIES)}
+
+    os.makedirs(output, exist_ok=True)
+    np.save(os.path.join(output, 'geohash.npy'), keys[order])
+    np.save(os.path.join(output, 'lat.npy'), lat[order])
+    np.save(os.path.join(output, 'lon.npy'), lon[order])
+    np.save(os.path.join(output, 'amenity.npy'), np.array([amenity_code[pois[i][3]] for i in order], dtype=np.uint8))
+    np.save(os.path.join(output, 'name_offsets.npy'), name_offsets)
+    np.save(os.path.join(output, 'names.npy'), np.frombuffer(b''.join(encoded), dtype=np.uint8))
+    with open(os.path.join(output, 'meta.json'), 'w') as f:
+        json.dump({
+            'count': len(pois),
+            'geohash_bits': GEOHASH_BITS,
+            'amenities': list(AMENITIES),
+            'source': os.path.basename(source),
+            'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }, f, indent=2)
+    print(f"✅ Step 3: Saved POI store to {output}")
+    print("\n--- Script finished successfully! ---")
+
+if __name__ == '__main__':
+    main()
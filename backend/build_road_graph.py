@@ -0,0 +1,281 @@
+# build_road_graph.py (OFFLINE ROUTING GRAPH FOR ROUTING_BACKEND=local)
+#
+# Usage: python build_road_graph.py <city.osm | city.osm.pbf> [data/road_graph.npz]
+#
+# Reads the drivable ways of an OSM extract, keeps the largest connected road network,
+# and contracts it into a contraction hierarchy (CH). main.py loads the resulting .npz
+# and answers matrix / directions queries with upward searches on the hierarchy.
+# Contraction is pure Python, so a city extract takes a few minutes up to tens of minutes.
+
+import heapq
+import math
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+# Free-flow speeds (km/h) for highway types we route over; maxspeed tags override these.
+SPEEDS_KMH = {
+    'motorway': 80, 'motorway_link': 45,
+    'trunk': 60, 'trunk_link': 40,
+    'primary': 45, 'primary_link': 35,
+    'secondary': 35, 'secondary_link': 30,
+    'tertiary': 30, 'tertiary_link': 25,
+    'unclassified': 25, 'residential': 20,
+    'living_street': 10, 'service': 15, 'road': 20,
+}
+WITNESS_SETTLE_LIMIT = 200  # bounded witness searches; extra shortcuts are harmless
+
+def parse_maxspeed(value):
+    if not value:
+        return None
+    try:
+        speed = float(value.split()[0])
+    except ValueError:
+        return None
+    return speed * 1.609 if 'mph' in value else speed
+
+def haversine_km(a, b):
+    lat1, lon1 = map(math.radians, a)
+    lat2, lon2 = map(math.radians, b)
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371.0088 * 2 * math.asin(math.sqrt(h))
+
+# --- Step 1: Read the OSM extract ---
+def read_osm_xml(path):
+    nodes, ways = {}, []
+    for _, elem in ET.iterparse(path, events=('end',)):
+        if elem.tag == 'node':
+            nodes[int(elem.get('id'))] = (float(elem.get('lat')), float(elem.get('lon')))
+            elem.clear()
+        elif elem.tag == 'way':
+            tags = {t.get('k'): t.get('v') for t in elem.findall('tag')}
+            if tags.get('highway') in SPEEDS_KMH:
+                ways.append(([int(nd.get('ref')) for nd in elem.findall('nd')], tags))
+            elem.clear()
+        elif elem.tag == 'relation':
+            elem.clear()
+    return nodes, ways
+
+def read_osm_pbf(path):
+    try:
+        import osmium
+    except ImportError:
+        print("❌ FATAL ERROR: reading .pbf needs the 'osmium' package (pip install osmium); "
+              "or convert the extract to .osm XML first.")
+        sys.exit(1)
+
+    class RoadHandler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.nodes, self.ways = {}, []
+
+        def node(self, n):
+            self.nodes[n.id] = (n.location.lat, n.location.lon)
+
+        def way(self, w):
+            tags = {t.k: t.v for t in w.tags}
+            if tags.get('highway') in SPEEDS_KMH:
+                self.ways.append(([nd.ref for nd in w.nodes], tags))
+
+    handler = RoadHandler()
+    handler.apply_file(path)
+    return handler.nodes, handler.ways
+
+# --- Step 2: Directed road edges ---
+def build_edges(nodes, ways):
+    index, coords, edges = {}, [], {}
+
+    def node_index(ref):
+        if ref not in index:
+            index[ref] = len(coords)
+            coords.append(nodes[ref])
+        return index[ref]
+
+    def add(u, v, secs, km):
+        if (u, v) not in edges or secs < edges[(u, v)][0]:
+            edges[(u, v)] = (secs, km)
+
+    for refs, tags in ways:
+        speed = parse_maxspeed(tags.get('maxspeed')) or SPEEDS_KMH[tags['highway']]
+        oneway = tags.get('oneway')
+        forward = oneway != '-1'
+        backward = not (oneway in ('yes', '1', 'true', '-1')
+                        or tags.get('junction') in ('roundabout', 'circular')
+                        or tags['highway'] in ('motorway', 'motorway_link'))
+        if oneway in ('-1', 'no'):
+            backward = True
+        for a, b in zip(refs, refs[1:]):
+            if a == b or a not in nodes or b not in nodes:
+                continue
+            km = haversine_km(nodes[a], nodes[b])
+            secs = km / speed * 3600.0
+            u, v = node_index(a), node_index(b)
+            if forward:
+                add(u, v, secs, km)
+            if backward:
+                add(v, u, secs, km)
+    return coords, edges
+
+def largest_component(n, edges):
+    """Keep the largest weakly connected piece so snapped stops are not stranded on islands."""
+    parent = list(range(n))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for u, v in edges:
+        ru, rv = find(u), find(v)
+        if ru != rv:
+            parent[ru] = rv
+    roots = [find(x) for x in range(n)]
+    counts = {}
+    for r in roots:
+        counts[r] = counts.get(r, 0) + 1
+    biggest = max(counts, key=counts.get)
+    return [x for x in range(n) if roots[x] == biggest]
+
+# --- Step 3: Contraction hierarchy ---
+def contract(n, edges):
+    out_adj = [dict() for _ in range(n)]
+    in_adj = [dict() for _ in range(n)]
+    for (u, v), (secs, km) in edges.items():
+        out_adj[u][v] = (secs, km, -1)
+        in_adj[v][u] = (secs, km, -1)
+    contracted = bytearray(n)
+    deleted_neighbours = [0] * n
+
+    def witness_costs(source, excluded, limit):
+        best = {source: 0.0}
+        heap = [(0.0, source)]
+        settled = 0
+        while heap and settled < WITNESS_SETTLE_LIMIT:
+            cost, x = heapq.heappop(heap)
+            if cost > best.get(x, math.inf):
+                continue
+            if cost > limit:
+                break
+            settled += 1
+            for y, (secs, _, _) in out_adj[x].items():
+                if y == excluded:
+                    continue
+                c = cost + secs
+                if c < best.get(y, math.inf):
+                    best[y] = c
+                    heapq.heappush(heap, (c, y))
+        return best
+
+    def shortcuts_for(v):
+        needed = []
+        outs = out_adj[v]
+        for u, (tu, du, _) in in_adj[v].items():
+            others = [tw for w, (tw, _, _) in outs.items() if w != u]
+            if not others:
+                continue
+            reached = witness_costs(u, v, tu + max(others))
+            for w, (tw, dw, _) in outs.items():
+                if w != u and reached.get(w, math.inf) > tu + tw:
+                    needed.append((u, w, tu + tw, du + dw))
+        return needed
+
+    def priority(v):
+        return len(shortcuts_for(v)) - len(in_adj[v]) - len(out_adj[v]) + deleted_neighbours[v]
+
+    heap = [(priority(v), v) for v in range(n)]
+    heapq.heapify(heap)
+    up_edges, down_edges = [], []  # (lower node, higher node, secs, km, mid)
+    order = 0
+    started = time.time()
+    while heap:
+        _, v = heapq.heappop(heap)
+        if contracted[v]:
+            continue
+        current = priority(v)
+        if heap and current > heap[0][0]:
+            heapq.heappush(heap, (current, v))
+            continue
+        for u, w, secs, km in shortcuts_for(v):
+            if w not in out_adj[u] or secs < out_adj[u][w][0]:
+                out_adj[u][w] = (secs, km, v)
+                in_adj[w][u] = (secs, km, v)
+        for w, (secs, km, mid) in out_adj[v].items():
+            up_edges.append((v, w, secs, km, mid))
+            del in_adj[w][v]
+            deleted_neighbours[w] += 1
+        for u, (secs, km, mid) in in_adj[v].items():
+            down_edges.append((v, u, secs, km, mid))
+            del out_adj[u][v]
+            deleted_neighbours[u] += 1
+        out_adj[v], in_adj[v] = {}, {}
+        contracted[v] = 1
+        order += 1
+        if order % 10000 == 0:
+            print(f"   contracted {order}/{n} nodes ({time.time() - started:.0f}s)")
+    return up_edges, down_edges
+
+def to_csr(n, edge_list):
+    """CSR keyed on the lower-ranked endpoint: indptr, neighbour, secs, km."""
+    if edge_list:
+        arr = np.array([(e[0], e[1]) for e in edge_list], dtype=np.int64)
+        secs = np.array([e[2] for e in edge_list], dtype=np.float64)
+        km = np.array([e[3] for e in edge_list], dtype=np.float64)
+    else:
+        arr, secs, km = np.empty((0, 2), dtype=np.int64), np.empty(0), np.empty(0)
+    order = np.argsort(arr[:, 0], kind='stable')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(indptr, arr[:, 0] + 1, 1)
+    return np.cumsum(indptr), arr[order, 1].astype(np.int32), secs[order], km[order]
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python build_road_graph.py <city.osm | city.osm.pbf> [data/road_graph.npz]")
+        sys.exit(1)
+    source = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else os.path.join('data', 'road_graph.npz')
+    print("--- Starting road graph build ---")
+
+    nodes, ways = read_osm_pbf(source) if source.endswith('.pbf') else read_osm_xml(source)
+    print(f"✅ Step 1: Read {len(nodes)} nodes and {len(ways)} drivable ways from {source}")
+
+    coords, edges = build_edges(nodes, ways)
+    del nodes, ways
+    keep = largest_component(len(coords), edges)
+    remap = {old: new for new, old in enumerate(keep)}
+    coords = [coords[old] for old in keep]
+    edges = {(remap[u], remap[v]): cost for (u, v), cost in edges.items() if u in remap and v in remap}
+    n = len(coords)
+    print(f"✅ Step 2: Road network has {n} nodes and {len(edges)} directed edges")
+
+    print("⏳ Step 3: Contracting hierarchy...")
+    started = time.time()
+    up_edges, down_edges = contract(n, edges)
+    print(f"✅ Step 3: Contraction done in {time.time() - started:.0f}s "
+          f"({len(up_edges) + len(down_edges) - len(edges)} shortcuts added)")
+
+    up_indptr, up_to, up_secs, up_km = to_csr(n, up_edges)
+    # Down edges are stored at their lower endpoint too, pointing at the higher node they come from.
+    down_indptr, down_from, down_secs, down_km = to_csr(n, down_edges)
+    # Shortcut unpacking table keyed by the original direction (from, to).
+    keys = np.array([e[0] * n + e[1] for e in up_edges] + [e[1] * n + e[0] for e in down_edges], dtype=np.int64)
+    mids = np.array([e[4] for e in up_edges] + [e[4] for e in down_edges], dtype=np.int32)
+    order = np.argsort(keys)
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    lat_lon = np.array(coords, dtype=np.float64)
+    np.savez_compressed(
+        output,
+        lat=lat_lon[:, 0], lon=lat_lon[:, 1],
+        up_indptr=up_indptr, up_to=up_to, up_secs=up_secs, up_km=up_km,
+        down_indptr=down_indptr, down_from=down_from, down_secs=down_secs, down_km=down_km,
+        edge_key=keys[order], edge_mid=mids[order],
+    )
+    print(f"✅ Step 4: Saved road graph to {output}")
+    print("\n--- Script finished successfully! ---")
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,11 @@
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
 import joblib
 import pandas as pd
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr, constr
 from paddleocr import PaddleOCR
 import shutil
@@ -11,13 +13,27 @@ import os
 import uuid
 import cv2
 import numpy as np
+import random
+import math
+import heapq
+import time
+import queue
+import threading
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from PIL import Image
 import logging
-from typing import List, Optional, Tuple, Dict, Any
+from typing import List, Optional, Tuple, Dict, Any, Callable, Sequence
 import hashlib
+import re
+import unicodedata
 import secrets
-import requests
+import httpx
+import asyncio
 import json
+import csv
+from collections import OrderedDict, deque
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -59,15 +75,278 @@ def load_env_file():
 
 load_env_file()
 
-# --- Initialize Models ---
-try:
-    eta_model = joblib.load('/home/tejas/Projects/Delivery_route_optimize/delivery-route-app/backend/eta_prediction_model.pkl')
-    model_columns = joblib.load('/home/tejas/Projects/Delivery_route_optimize/delivery-route-app/backend/model_columns.pkl')
-    logger.info("ML models loaded successfully")
-except Exception as e:
-    logger.warning(f"Could not load ML models: {e}")
-    eta_model = None
-    model_columns = None
+# --- ETA Feature Encoder ---
+# Replaces the per-request pandas pipeline (DataFrame -> get_dummies -> reindex). Column
+# positions are resolved once from model_columns; encoding only writes into a float32 row.
+ETA_NUMERIC_FEATURES = ("ors_duration_minutes", "total_distance_km", "num_stops")
+
+def get_time_of_day(hour: int) -> str:
+    # Same buckets as train_model.py; the dummy columns are named after them
+    if 6 <= hour < 11: return 'Morning_Rush'
+    elif 11 <= hour < 17: return 'Midday'
+    elif 17 <= hour < 21: return 'Evening_Rush'
+    else: return 'Night'
+
+def _parse_start_time(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    text = str(value).strip()
+    try:
+        return datetime.fromisoformat(text[:-1] + "+00:00" if text.endswith("Z") else text)
+    except ValueError:
+        return pd.Timestamp(text).to_pydatetime()
+
+class EtaFeatureEncoder:
+    def __init__(self, columns: List[str]):
+        self.columns = list(columns)
+        index = {name: i for i, name in enumerate(self.columns)}
+        self._numeric = [(name, index[name]) for name in ETA_NUMERIC_FEATURES if name in index]
+        # hour -> column of its time_of_day dummy, weekday -> column of its day_of_week dummy (-1: absent)
+        self._hour_col = np.array([index.get(f"time_of_day_{get_time_of_day(h)}", -1) for h in range(24)])
+        self._weekday_col = np.array([index.get(f"day_of_week_{'Weekday' if d < 5 else 'Weekend'}", -1)
+                                      for d in range(7)])
+        self._local = threading.local()
+
+    def _fill(self, row: np.ndarray, record: Dict[str, Any]) -> None:
+        row.fill(0.0)
+        for name, col in self._numeric:
+            row[col] = record[name]
+        start = _parse_start_time(record["start_time"])
+        for col in (self._hour_col[start.hour], self._weekday_col[start.weekday()]):
+            if col >= 0:
+                row[col] = 1.0
+
+    def encode_one(self, record: Dict[str, Any]) -> np.ndarray:
+        """One-row matrix in a per-thread buffer, valid until the thread's next encode_one."""
+        row = getattr(self._local, "row", None)
+        if row is None:
+            row = self._local.row = np.zeros((1, len(self.columns)), dtype=np.float32)
+        self._fill(row[0], record)
+        return row
+
+    def encode(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        matrix = np.zeros((len(records), len(self.columns)), dtype=np.float32)
+        for row, record in zip(matrix, records):
+            self._fill(row, record)
+        return matrix
+
+# --- ETA Model Registry ---
+# train_model.py publishes versions as MODEL_REGISTRY_DIR/<version>/ with model.pkl,
+# model_columns.pkl and metrics.json. The newest version is served unless the ACTIVE file
+# pins one. A background poller loads and warms up a changed target, then swaps it in with
+# one reference assignment, so in-flight requests finish on the model they started with.
+# Without any registry version the legacy eta_prediction_model.pkl is served as "legacy".
+MODEL_REGISTRY_DIR = os.environ.get("MODEL_REGISTRY_DIR", "model_registry")
+MODEL_REGISTRY_POLL_SECONDS = float(os.environ.get("MODEL_REGISTRY_POLL_SECONDS", "30"))
+MODEL_ADMIN_TOKEN = os.environ.get("MODEL_ADMIN_TOKEN", "")
+LEGACY_MODEL_PATH = os.environ.get("ETA_MODEL_PATH", "eta_prediction_model.pkl")
+LEGACY_COLUMNS_PATH = os.environ.get("ETA_MODEL_COLUMNS_PATH", "model_columns.pkl")
+LEGACY_MODEL_VERSION = "legacy"
+
+class EtaModelVersion:
+    def __init__(self, version: str, model: Any, columns: List[str], metrics: Dict[str, Any]):
+        self.version = version
+        self.model = model
+        self.columns = list(columns)
+        self.metrics = metrics
+        self.encoder = EtaFeatureEncoder(self.columns)
+        self.loaded_at = datetime.now().isoformat()
+
+    def predict(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        encoder = self.encoder
+        features = encoder.encode_one(records[0]) if len(records) == 1 else encoder.encode(records)
+        return np.asarray(self.model.predict(features), dtype=float)
+
+def _registry_versions() -> List[str]:
+    try:
+        names = os.listdir(MODEL_REGISTRY_DIR)
+    except FileNotFoundError:
+        return []
+    return sorted(name for name in names if not name.startswith(".")
+                  and os.path.exists(os.path.join(MODEL_REGISTRY_DIR, name, "model.pkl"))
+                  and os.path.exists(os.path.join(MODEL_REGISTRY_DIR, name, "model_columns.pkl")))
+
+def _registry_target() -> Optional[str]:
+    """Version that should be serving: the pinned one, else the newest, else legacy."""
+    versions = _registry_versions()
+    try:
+        with open(os.path.join(MODEL_REGISTRY_DIR, "ACTIVE")) as f:
+            pinned = f.read().strip()
+    except FileNotFoundError:
+        pinned = ""
+    if pinned in versions or (pinned == LEGACY_MODEL_VERSION and os.path.exists(LEGACY_MODEL_PATH)):
+        return pinned
+    if versions:
+        return versions[-1]
+    return LEGACY_MODEL_VERSION if os.path.exists(LEGACY_MODEL_PATH) else None
+
+def _load_model_version(version: str) -> EtaModelVersion:
+    if version == LEGACY_MODEL_VERSION:
+        model_path, columns_path, metrics = LEGACY_MODEL_PATH, LEGACY_COLUMNS_PATH, {}
+    else:
+        folder = os.path.join(MODEL_REGISTRY_DIR, version)
+        model_path, columns_path = os.path.join(folder, "model.pkl"), os.path.join(folder, "model_columns.pkl")
+        try:
+            with open(os.path.join(folder, "metrics.json")) as f:
+                metrics = json.load(f)
+        except FileNotFoundError:
+            metrics = {}
+    loaded = EtaModelVersion(version, joblib.load(model_path), joblib.load(columns_path), metrics)
+    # Warm up (lazy booster setup, thread pools) before the model sees live traffic
+    warm = loaded.predict([{"ors_duration_minutes": 30.0, "total_distance_km": 10.0, "num_stops": 3,
+                            "start_time": datetime.now().isoformat()}])
+    if not np.all(np.isfinite(warm)):
+        raise ValueError(f"model {version} produced a non-finite warm-up prediction")
+    return loaded
+
+class _EtaModelRegistry:
+    def __init__(self):
+        self.active: Optional[EtaModelVersion] = None
+        self.previous: Optional[EtaModelVersion] = None
+        self.last_error: Optional[str] = None
+        self._failed_target: Optional[str] = None
+        self._swap_lock = threading.Lock()
+
+    def _swap(self, loaded: EtaModelVersion) -> None:
+        if self.active is not None and self.active.version != loaded.version:
+            self.previous = self.active
+        self.active = loaded
+        logger.info(f"🤖 ETA model {loaded.version} active")
+
+    def _pin(self, version: str) -> None:
+        os.makedirs(MODEL_REGISTRY_DIR, exist_ok=True)
+        tmp = os.path.join(MODEL_REGISTRY_DIR, f".ACTIVE.{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            f.write(version)
+        os.replace(tmp, os.path.join(MODEL_REGISTRY_DIR, "ACTIVE"))
+
+    def _needs_load(self, target: Optional[str]) -> bool:
+        if target is None or target == self._failed_target:
+            return False
+        return self.active is None or self.active.version != target
+
+    def poll_once(self) -> None:
+        if not self._needs_load(_registry_target()):
+            return
+        with self._swap_lock:
+            # activate()/rollback() may have pinned another version while we waited
+            target = _registry_target()
+            if not self._needs_load(target):
+                return
+            try:
+                loaded = _load_model_version(target)
+            except Exception as e:
+                # Keep serving the current model; retry only once the target changes
+                self._failed_target, self.last_error = target, f"{target}: {e}"
+                logger.warning(f"Could not load ETA model {target}: {e}")
+                return
+            self._failed_target, self.last_error = None, None
+            self._swap(loaded)
+
+    def activate(self, version: str) -> EtaModelVersion:
+        """Load, warm up and pin a specific version."""
+        if version != LEGACY_MODEL_VERSION and version not in _registry_versions():
+            raise KeyError(version)
+        with self._swap_lock:
+            loaded = _load_model_version(version)
+            self._pin(version)
+            self._swap(loaded)
+        return loaded
+
+    def rollback(self) -> EtaModelVersion:
+        """Swap back to the previously active (already warm) version and pin it."""
+        with self._swap_lock:
+            if self.previous is None:
+                raise LookupError("no previous model version to roll back to")
+            target = self.previous
+            self._pin(target.version)
+            self._swap(target)
+        return target
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(MODEL_REGISTRY_POLL_SECONDS)
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.warning(f"Model registry poll failed: {e}")
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="model-registry", daemon=True).start()
+
+eta_registry = _EtaModelRegistry()
+eta_registry.poll_once()
+if eta_registry.active is None:
+    logger.warning(f"Could not load ML models: {eta_registry.last_error or 'no model in registry'}")
+eta_registry.start()
+
+def predict_eta_minutes(records: List[Dict[str, Any]]) -> np.ndarray:
+    """Model ETAs (minutes) for records with ETA_NUMERIC_FEATURES and start_time."""
+    active = eta_registry.active
+    if active is None:
+        raise RuntimeError("ML models not loaded")
+    return active.predict(records)
+
+# --- ETA Micro-Batching ---
+# Single /predict-eta calls are queued to one worker thread. It waits up to
+# ETA_BATCH_WINDOW_MS after the first arrival for more requests and scores them all with
+# one vectorized model call, so the number of model invocations follows the batch count.
+ETA_BATCH_WINDOW_MS = float(os.environ.get("ETA_BATCH_WINDOW_MS", "3"))
+ETA_BATCH_MAX = int(os.environ.get("ETA_BATCH_MAX", "256"))
+
+class _EtaMicroBatcher:
+    def __init__(self):
+        self.pending: "queue.Queue[Tuple[Dict[str, Any], Future]]" = queue.Queue()
+        self.batches = 0
+        self.predictions = 0
+        threading.Thread(target=self._run, name="eta-batcher", daemon=True).start()
+
+    def submit(self, record: Dict[str, Any]) -> Future:
+        future: Future = Future()
+        self.pending.put((record, future))
+        return future
+
+    def _run(self) -> None:
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + ETA_BATCH_WINDOW_MS / 1000.0
+            while len(batch) < ETA_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                minutes = predict_eta_minutes([record for record, _ in batch]).tolist()
+            except Exception:
+                # Don't fail every caller for one bad record: score them one by one
+                self._run_singly(batch)
+                continue
+            self.batches += 1
+            self.predictions += len(batch)
+            for (_, future), value in zip(batch, minutes):
+                future.set_result(value)
+
+    def _run_singly(self, batch: List[Tuple[Dict[str, Any], Future]]) -> None:
+        for record, future in batch:
+            try:
+                future.set_result(float(predict_eta_minutes([record])[0]))
+            except Exception as e:
+                future.set_exception(e)
+
+_eta_batcher = _EtaMicroBatcher()
+
+async def predict_eta_coalesced(record: Dict[str, Any]) -> float:
+    return await asyncio.wrap_future(_eta_batcher.submit(record))
+
+def _eta_record(route: "RouteData") -> Dict[str, Any]:
+    """RouteData as an encoder record, with start_time parsed up front (422 if unreadable)."""
+    record = route.dict()
+    try:
+        record["start_time"] = _parse_start_time(record["start_time"])
+    except (ValueError, TypeError, OverflowError):
+        raise HTTPException(status_code=422, detail=f"Invalid start_time: {record['start_time']!r}")
+    return record
 
 # --- Initialize Training Data Database ---
 def init_training_db():
@@ -288,6 +567,8 @@ class PlanRouteRequest(BaseModel):
     addresses: List[str]
     start_time: Optional[str] = None  # ISO8601 string; if omitted, uses now
     vehicle_start_address: Optional[str] = None  # if omitted, uses first address as start
+    vehicle_end_address: Optional[str] = None  # if omitted, the route may finish at any stop
+    time_budget_ms: Optional[int] = None  # optimizer wall-clock budget; if omitted, runs to convergence
 
 class TrainingDataRequest(BaseModel):
     route_id: str
@@ -327,6 +608,57 @@ class PlannedRouteResponse(BaseModel):
     num_stops: int
     predicted_eta_minutes: Optional[float] = None
     route_geometry_geojson: Optional[Dict[str, Any]] = None
+    plan_id: Optional[str] = None  # pass to /replan-route to reuse this plan's matrix
+    degraded: bool = False  # some travel times were estimated because ORS was unavailable
+
+class PlanBatchRequest(BaseModel):
+    requests: List[PlanRouteRequest]
+
+class PlanBatchResponse(BaseModel):
+    plans: List[PlannedRouteResponse]  # same order as the requests
+
+class GeocodeBatchRequest(BaseModel):
+    addresses: List[str]
+
+class EtaBatchRequest(BaseModel):
+    routes: List[RouteData]
+
+class ReplanRouteRequest(BaseModel):
+    ordered_addresses: List[str]  # from the previous PlannedRouteResponse
+    ordered_coordinates: List[Tuple[float, float]]
+    plan_id: Optional[str] = None
+    add_addresses: List[str] = []
+    remove_addresses: List[str] = []
+    start_time: Optional[str] = None
+    sequential: Optional[bool] = None  # keep stops in the order added; if omitted, follows the cached plan
+
+class FleetVehicle(BaseModel):
+    vehicle_id: str
+    start_address: str  # depot the vehicle leaves from
+    capacity: Optional[float] = None  # in the same units as stop demand; None = unlimited
+    shift_minutes: Optional[float] = None  # None = unlimited
+
+class FleetStop(BaseModel):
+    address: str
+    demand: float = 1.0
+    service_minutes: float = 3.0
+    # Time window in minutes after the shift start; either bound may be omitted
+    time_window_start_minutes: Optional[float] = None
+    time_window_end_minutes: Optional[float] = None
+
+class PlanFleetRequest(BaseModel):
+    vehicles: List[FleetVehicle]
+    stops: List[FleetStop]
+    start_time: Optional[str] = None
+
+class VehicleRoutePlan(BaseModel):
+    vehicle_id: str
+    load: float
+    route: PlannedRouteResponse
+
+class PlanFleetResponse(BaseModel):
+    routes: List[VehicleRoutePlan]
+    unassigned_addresses: List[str]
 
 # --- Geocoding and ORS Utilities ---
 # Load API keys from environment variables
@@ -342,8 +674,752 @@ NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
 ORS_DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/driving-car/geojson"
 ORS_MATRIX_URL = "https://api.openrouteservice.org/v2/matrix/driving-car"
 
-def geocode_address(address: str) -> Optional[Tuple[float, float]]:
-    """Geocode address using OpenRouteService first (free), then Nominatim as fallback."""
+# Debug only: also fetch every leg in the reverse direction and log the difference
+DEBUG_REVERSE_LEG_PROBE = os.environ.get("DEBUG_REVERSE_LEG_PROBE") == "1"
+
+# --- Provider Gateway (rate limits, daily quotas, request coalescing) ---
+# Every outbound call is classified by provider. Identical requests already in flight
+# share one upstream call; the leader then waits for a token from that provider's
+# bucket and is counted against its daily quota. Counters live in memory and are flushed
+# to SQLite every few seconds (off the provider loop), so quotas survive restarts.
+PROVIDER_QUOTA_DB = os.environ.get("PROVIDER_QUOTA_DB", "db/provider_quota.db")
+PROVIDER_USAGE_FLUSH_SECONDS = float(os.environ.get("PROVIDER_USAGE_FLUSH_SECONDS", "5"))
+MATRIX_REQUESTS_PER_MINUTE = float(os.environ.get("MATRIX_REQUESTS_PER_MINUTE", "40"))
+# provider: (requests per second, burst, requests per day; 0 = unlimited)
+PROVIDER_LIMITS: Dict[str, Tuple[float, int, int]] = {
+    "ors_geocode": (100 / 60, 5, int(os.environ.get("ORS_GEOCODE_DAILY_QUOTA", "1000"))),
+    "ors_matrix": (MATRIX_REQUESTS_PER_MINUTE / 60, 4, int(os.environ.get("ORS_MATRIX_DAILY_QUOTA", "500"))),
+    "ors_directions": (40 / 60, 4, int(os.environ.get("ORS_DIRECTIONS_DAILY_QUOTA", "2000"))),
+    "nominatim": (1.0, 1, 0),  # Nominatim usage policy: at most 1 request per second
+    "overpass": (1.0, 2, 0),
+}
+
+class ProviderQuotaExceeded(Exception):
+    """Raised instead of calling a provider whose daily quota is used up."""
+
+def init_provider_quota_db():
+    os.makedirs(os.path.dirname(PROVIDER_QUOTA_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(PROVIDER_QUOTA_DB)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS provider_usage (
+            provider TEXT NOT NULL,
+            day TEXT NOT NULL,
+            used INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (provider, day)
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    logger.info("Provider quota database initialized")
+
+init_provider_quota_db()
+
+class _TokenBucket:
+    """Async token bucket; penalize() holds all callers back after a 429."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return
+            await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+    def penalize(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+def _utc_day() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+def _provider_for(url: str) -> str:
+    parsed = httpx.URL(url)
+    if "openrouteservice" in parsed.host:
+        for kind in ("geocode", "matrix", "directions"):
+            if f"/{kind}" in parsed.path:
+                return f"ors_{kind}"
+        return "ors"
+    if "nominatim" in parsed.host:
+        return "nominatim"
+    if "overpass" in parsed.host:
+        return "overpass"
+    return parsed.host
+
+class _ProviderGateway:
+    """Token buckets, daily quota accounting and single-flight; used only on the provider loop."""
+
+    def __init__(self):
+        self.buckets = {name: _TokenBucket(rate, burst) for name, (rate, burst, _) in PROVIDER_LIMITS.items()}
+        self.usage: Dict[Tuple[str, str], int] = {}
+        self.unflushed: Dict[Tuple[str, str], int] = {}
+        self.flush_scheduled = False
+        self.in_flight: Dict[Any, "asyncio.Future[httpx.Response]"] = {}
+        self._load_usage(_utc_day())
+        atexit.register(self._flush_now)
+
+    def _load_usage(self, day: str) -> None:
+        """Today's persisted counts; read once at startup, before the provider loop runs."""
+        try:
+            conn = sqlite3.connect(PROVIDER_QUOTA_DB, timeout=10)
+            for provider, used in conn.execute("SELECT provider, used FROM provider_usage WHERE day = ?", (day,)):
+                self.usage[(provider, day)] = used
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Provider quota read failed: {e}")
+
+    def _used_today(self, provider: str, day: str) -> int:
+        return self.usage.get((provider, day), 0)
+
+    def _count(self, provider: str, day: str) -> None:
+        self.usage[(provider, day)] = self._used_today(provider, day) + 1
+        self.unflushed[(provider, day)] = self.unflushed.get((provider, day), 0) + 1
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_running_loop().call_later(PROVIDER_USAGE_FLUSH_SECONDS, self._flush)
+
+    def _flush(self) -> None:
+        self.flush_scheduled = False
+        pending, self.unflushed = self.unflushed, {}
+        asyncio.get_running_loop().run_in_executor(None, self._write_usage, pending)
+
+    def _flush_now(self) -> None:
+        pending, self.unflushed = self.unflushed, {}
+        self._write_usage(pending)
+
+    @staticmethod
+    def _write_usage(pending: Dict[Tuple[str, str], int]) -> None:
+        if not pending:
+            return
+        try:
+            conn = sqlite3.connect(PROVIDER_QUOTA_DB, timeout=10)
+            conn.executemany("INSERT INTO provider_usage (provider, day, used) VALUES (?, ?, ?) "
+                             "ON CONFLICT(provider, day) DO UPDATE SET used = used + excluded.used",
+                             [(provider, day, used) for (provider, day), used in pending.items()])
+            conn.commit()
+            conn.close()
+        except Exception as e:
+            logger.warning(f"Provider quota write failed: {e}")
+
+    def usage_today(self) -> Dict[str, Dict[str, int]]:
+        day = _utc_day()
+        return {name: {"used": self._used_today(name, day), "daily_quota": quota}
+                for name, (_, _, quota) in PROVIDER_LIMITS.items() if quota}
+
+    async def call(self, send: Callable[[], Any], method: str, url: str, **kwargs: Any) -> httpx.Response:
+        # Headers are part of the key: ORS retries with a different Authorization format
+        key = (method, url, json.dumps(kwargs.get("params"), sort_keys=True, default=str),
+               json.dumps(kwargs.get("json"), sort_keys=True, default=str), kwargs.get("content"),
+               json.dumps(kwargs.get("headers"), sort_keys=True, default=str))
+        if key in self.in_flight:
+            return await asyncio.shield(self.in_flight[key])
+        future: "asyncio.Future[httpx.Response]" = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = future
+        try:
+            response = await self._send_limited(send, url)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self.in_flight[key]
+
+    async def _send_limited(self, send: Callable[[], Any], url: str) -> httpx.Response:
+        provider = _provider_for(url)
+        limits = PROVIDER_LIMITS.get(provider)
+        if limits is None:
+            return await send()
+        day = _utc_day()
+        quota = limits[2]
+        if quota and self._used_today(provider, day) >= quota:
+            raise ProviderQuotaExceeded(f"{provider} daily quota of {quota} requests used up")
+        self._count(provider, day)  # reserve before waiting so concurrent callers cannot overshoot
+        bucket = self.buckets[provider]
+        await bucket.acquire()
+        response = await send()
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.headers.get("Retry-After", "1"))
+            except ValueError:
+                retry_after = 1.0
+            logger.warning(f"⏳ {provider} rate limited; pausing for {retry_after:.0f}s")
+            bucket.penalize(retry_after)
+        return response
+
+# --- Shared Provider HTTP Client ---
+# All geocoding, routing and POI calls go through one pooled httpx.AsyncClient that
+# lives on a dedicated event-loop thread, so connections (and TLS sessions) are reused
+# across requests and threads. Async code awaits provider_request from any loop;
+# blocking code (worker threads, the optimizer pipeline) uses provider_request_blocking.
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", "20"))
+PROVIDER_HOST_CONCURRENCY = int(os.environ.get("PROVIDER_HOST_CONCURRENCY", "8"))
+try:
+    import h2  # noqa: F401 -- httpx negotiates HTTP/2 only when h2 is installed
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+
+class _ProviderIO:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.client: Optional[httpx.AsyncClient] = None
+        self.host_limits: Dict[str, asyncio.Semaphore] = {}
+        self.gateway = _ProviderGateway()
+        threading.Thread(target=self.loop.run_forever, name="provider-io", daemon=True).start()
+
+    async def _request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                http2=HTTP2_ENABLED,
+                limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                                    max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+                timeout=30.0,
+            )
+        host = httpx.URL(url).host
+        limit = self.host_limits.setdefault(host, asyncio.Semaphore(PROVIDER_HOST_CONCURRENCY))
+        client = self.client
+
+        async def send() -> httpx.Response:
+            async with limit:
+                return await client.request(method, url, **kwargs)
+        return await self.gateway.call(send, method, url, **kwargs)
+
+    def submit(self, coro: Any) -> "asyncio.Future[Any]":
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+_provider_io = _ProviderIO()
+
+async def provider_request(method: str, url: str, **kwargs: Any) -> httpx.Response:
+    """Send a request on the shared client (per-host concurrency limited)."""
+    return await asyncio.wrap_future(_provider_io.submit(_provider_io._request(method, url, **kwargs)))
+
+def provider_request_blocking(method: str, url: str, **kwargs: Any) -> httpx.Response:
+    return _provider_io.submit(_provider_io._request(method, url, **kwargs)).result()
+
+def run_provider_coroutine(coro: Any) -> Any:
+    """Run a provider coroutine to completion from blocking code."""
+    return _provider_io.submit(coro).result()
+
+async def _provider_usage_today() -> Dict[str, Dict[str, int]]:
+    return _provider_io.gateway.usage_today()
+
+# --- Geocode Cache ---
+# Geocodes are cached under a normalized address in an in-process LRU backed by SQLite.
+# "Not found" answers are cached too, with a shorter TTL; provider failures are not.
+GEOCODE_CACHE_DB = os.environ.get("GEOCODE_CACHE_DB", "db/geocode_cache.db")
+GEOCODE_CACHE_MAX_ENTRIES = int(os.environ.get("GEOCODE_CACHE_MAX_ENTRIES", "20000"))
+GEOCODE_CACHE_TTL_SECONDS = int(os.environ.get("GEOCODE_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+GEOCODE_NEGATIVE_TTL_SECONDS = int(os.environ.get("GEOCODE_NEGATIVE_TTL_SECONDS", str(24 * 3600)))
+# Common spellings and abbreviations in Indian addresses, mapped to one canonical token
+ADDRESS_ABBREVIATIONS = {
+    "rd": "road", "st": "street", "ln": "lane", "ave": "avenue", "av": "avenue",
+    "mg": "mahatma gandhi", "ngr": "nagar", "nagr": "nagar", "clny": "colony", "col": "colony",
+    "apt": "apartment", "apts": "apartments", "bldg": "building", "soc": "society",
+    "sec": "sector", "sect": "sector", "ph": "phase", "extn": "extension", "ext": "extension",
+    "mkt": "market", "stn": "station", "jn": "junction", "jnc": "junction", "opp": "opposite",
+    "nr": "near", "hsg": "housing", "indl": "industrial", "blk": "block", "flr": "floor",
+    "blr": "bangalore", "bengaluru": "bangalore", "bangaluru": "bangalore",
+    "bombay": "mumbai", "bom": "mumbai", "calcutta": "kolkata", "madras": "chennai",
+    "gurgaon": "gurugram", "ggn": "gurugram", "hyd": "hyderabad",
+}
+_geocode_lru: "OrderedDict[str, Tuple[Optional[Tuple[float, float]], float]]" = OrderedDict()
+_geocode_lru_lock = threading.Lock()
+geocode_cache_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+def init_geocode_cache_db():
+    os.makedirs(os.path.dirname(GEOCODE_CACHE_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(GEOCODE_CACHE_DB)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            address_key TEXT PRIMARY KEY,
+            address TEXT,
+            lat REAL,
+            lon REAL,
+            stored_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    # Caches created before autocomplete kept the original address text
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(geocode_cache)")]
+    if "address" not in columns:
+        cursor.execute("ALTER TABLE geocode_cache ADD COLUMN address TEXT")
+    # Provider autocomplete results, kept for the local suggestion index
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS place_suggestions (
+            name_key TEXT PRIMARY KEY,
+            display_name TEXT NOT NULL,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            popularity REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    logger.info("Geocode cache database initialized")
+
+init_geocode_cache_db()
+
+def _address_tokens(address: str) -> List[str]:
+    text = unicodedata.normalize("NFKC", address).lower()
+    text = re.sub(r"\b(\w)\.(?=\w\b)", r"\1", text)  # dotted initials: "m.g." -> "mg"
+    return re.sub(r"[^\w]+", " ", text).split()
+
+def _expand_tokens(tokens: List[str]) -> List[str]:
+    return " ".join(ADDRESS_ABBREVIATIONS.get(t, t) for t in tokens).split()
+
+def normalize_address(address: str) -> str:
+    """Canonical cache key: lower case, punctuation dropped, abbreviations expanded."""
+    return " ".join(_expand_tokens(_address_tokens(address)))
+
+def _geocode_fresh(coords: Optional[Tuple[float, float]], stored_at: float) -> bool:
+    ttl = GEOCODE_CACHE_TTL_SECONDS if coords is not None else GEOCODE_NEGATIVE_TTL_SECONDS
+    return time.time() - stored_at <= ttl
+
+def _geocode_lru_put(key: str, coords: Optional[Tuple[float, float]], stored_at: float) -> None:
+    with _geocode_lru_lock:
+        _geocode_lru[key] = (coords, stored_at)
+        _geocode_lru.move_to_end(key)
+        while len(_geocode_lru) > GEOCODE_CACHE_MAX_ENTRIES:
+            _geocode_lru.popitem(last=False)
+
+def _geocode_lru_get(key: str) -> Tuple[bool, Optional[Tuple[float, float]]]:
+    with _geocode_lru_lock:
+        entry = _geocode_lru.get(key)
+        if entry is not None and _geocode_fresh(*entry):
+            _geocode_lru.move_to_end(key)
+            geocode_cache_stats["memory_hits"] += 1
+            return True, entry[0]
+    return False, None
+
+def _geocode_disk_get(key: str, count_miss: bool = True) -> Tuple[bool, Optional[Tuple[float, float]]]:
+    try:
+        conn = sqlite3.connect(GEOCODE_CACHE_DB, timeout=10)
+        row = conn.execute("SELECT lat, lon, stored_at FROM geocode_cache WHERE address_key = ?",
+                           (key,)).fetchone()
+        coords = (row[0], row[1]) if row and row[0] is not None else None
+        if row and _geocode_fresh(coords, row[2]):
+            conn.execute("UPDATE geocode_cache SET hits = hits + 1 WHERE address_key = ?", (key,))
+            conn.commit()
+            conn.close()
+            _geocode_lru_put(key, coords, row[2])
+            with _geocode_lru_lock:
+                geocode_cache_stats["disk_hits"] += 1
+            return True, coords
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Geocode cache read failed: {e}")
+    if count_miss:
+        with _geocode_lru_lock:
+            geocode_cache_stats["misses"] += 1
+    return False, None
+
+def _geocode_cache_get(key: str, count_miss: bool = True) -> Tuple[bool, Optional[Tuple[float, float]]]:
+    """(found, coordinates); found with None coordinates is a cached "not found"."""
+    found, coords = _geocode_lru_get(key)
+    if found:
+        return found, coords
+    return _geocode_disk_get(key, count_miss)
+
+def _geocode_disk_put(key: str, coords: Optional[Tuple[float, float]], address: str, now: float) -> None:
+    try:
+        conn = sqlite3.connect(GEOCODE_CACHE_DB, timeout=10)
+        conn.execute(
+            "INSERT OR REPLACE INTO geocode_cache (address_key, address, lat, lon, stored_at, hits) "
+            "VALUES (?, ?, ?, ?, ?, 0)",
+            (key, address, coords[0] if coords else None, coords[1] if coords else None, now))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Geocode cache write failed: {e}")
+
+async def _geocode_cache_put(key: str, coords: Optional[Tuple[float, float]], address: str) -> None:
+    """Update the LRU and index on the loop; the SQLite write runs in a worker thread."""
+    now = time.time()
+    _geocode_lru_put(key, coords, now)
+    if coords is not None:
+        autocomplete_index.add(address, coords[0], coords[1])
+    await run_in_threadpool(_geocode_disk_put, key, coords, address, now)
+
+# --- Local Autocomplete Index ---
+# /search-suggestions answers from an in-memory token-prefix index over addresses we
+# have geocoded, places providers suggested before and an optional gazetteer CSV
+# (name,lat,lon[,popularity]); providers are only asked when it has too few matches.
+AUTOCOMPLETE_LIMIT = 5
+AUTOCOMPLETE_MIN_LOCAL_RESULTS = int(os.environ.get("AUTOCOMPLETE_MIN_LOCAL_RESULTS", "3"))
+AUTOCOMPLETE_MAX_PREFIX = 12
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", os.path.join("data", "gazetteer.csv"))
+
+class AutocompleteIndex:
+    """Token-prefix inverted index over known places, ranked by popularity."""
+
+    def __init__(self):
+        self.entries: List[Dict[str, Any]] = []
+        self.by_key: Dict[str, int] = {}
+        self.postings: Dict[str, set] = {}
+        self.lock = threading.Lock()
+
+    def add(self, display_name: str, lat: float, lon: float, popularity: float = 1.0) -> None:
+        key = normalize_address(display_name)
+        if not key:
+            return
+        with self.lock:
+            i = self.by_key.get(key)
+            if i is not None:
+                self.entries[i]["popularity"] += popularity
+                return
+            i = len(self.entries)
+            tokens = key.split()
+            self.entries.append({"display_name": display_name, "lat": lat, "lon": lon,
+                                 "popularity": popularity, "tokens": tokens})
+            self.by_key[key] = i
+            for token in set(tokens):
+                for n in range(1, min(len(token), AUTOCOMPLETE_MAX_PREFIX) + 1):
+                    self.postings.setdefault(token[:n], set()).add(i)
+
+    def _matching(self, tokens: List[str]) -> set:
+        postings = sorted((self.postings.get(t[:AUTOCOMPLETE_MAX_PREFIX], set()) for t in tokens), key=len)
+        hits = postings[0].intersection(*postings[1:])
+        long_tokens = [t for t in tokens if len(t) > AUTOCOMPLETE_MAX_PREFIX]
+        if long_tokens:
+            hits = {i for i in hits
+                    if all(any(w.startswith(t) for w in self.entries[i]["tokens"]) for t in long_tokens)}
+        return hits
+
+    def search(self, query: str, limit: int = AUTOCOMPLETE_LIMIT) -> List[Dict[str, Any]]:
+        """Places whose tokens start with every query token, most popular first."""
+        raw = _address_tokens(query)
+        if not raw:
+            return []
+        # The last token may still be half-typed ("sec" of "secunderabad"), so it is matched
+        # as typed and, if it is also an abbreviation, in its expanded form ("sector").
+        head, last = _expand_tokens(raw[:-1]), raw[-1]
+        variants = [head + [last]]
+        expanded = _expand_tokens([last])
+        if expanded != [last]:
+            variants.append(head + expanded)
+        with self.lock:
+            hits = set().union(*(self._matching(v) for v in variants))
+            ranked = heapq.nlargest(limit, hits, key=lambda i: (self.entries[i]["popularity"],
+                                                                -len(self.entries[i]["display_name"])))
+            return [{"display_name": self.entries[i]["display_name"],
+                     "lat": self.entries[i]["lat"], "lon": self.entries[i]["lon"]} for i in ranked]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+autocomplete_index = AutocompleteIndex()
+
+def load_autocomplete_index():
+    try:
+        conn = sqlite3.connect(GEOCODE_CACHE_DB, timeout=10)
+        for address, lat, lon, hits in conn.execute(
+                "SELECT address, lat, lon, hits FROM geocode_cache WHERE lat IS NOT NULL AND address IS NOT NULL"):
+            autocomplete_index.add(address, lat, lon, 1.0 + hits)
+        for display_name, lat, lon, popularity in conn.execute(
+                "SELECT display_name, lat, lon, popularity FROM place_suggestions"):
+            autocomplete_index.add(display_name, lat, lon, popularity)
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Could not load autocomplete entries from the geocode cache: {e}")
+    if os.path.exists(GAZETTEER_PATH):
+        try:
+            with open(GAZETTEER_PATH, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    autocomplete_index.add(row["name"], float(row["lat"]), float(row["lon"]),
+                                           float(row.get("popularity") or 0.1))
+        except Exception as e:
+            logger.warning(f"Could not load gazetteer {GAZETTEER_PATH}: {e}")
+    logger.info(f"Autocomplete index loaded ({len(autocomplete_index)} places)")
+
+load_autocomplete_index()
+
+def remember_suggestions(suggestions: List[Dict[str, Any]]) -> None:
+    """Write provider suggestions back into the local index and its table.
+
+    Opens SQLite, so async callers run it through run_in_threadpool.
+    """
+    rows = []
+    for s in suggestions:
+        key = normalize_address(s["display_name"])
+        if key:
+            autocomplete_index.add(s["display_name"], s["lat"], s["lon"], 0.5)
+            rows.append((key, s["display_name"], s["lat"], s["lon"]))
+    if not rows:
+        return
+    try:
+        conn = sqlite3.connect(GEOCODE_CACHE_DB, timeout=10)
+        conn.executemany(
+            "INSERT INTO place_suggestions (name_key, display_name, lat, lon, popularity) VALUES (?, ?, ?, ?, 0.5) "
+            "ON CONFLICT(name_key) DO UPDATE SET popularity = popularity + 0.5", rows)
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Could not store suggestions: {e}")
+
+# --- Geocoding Provider Selection ---
+# ORS is the primary geocoder and Nominatim the secondary. Each has a circuit breaker
+# (skipped after repeated failures, retried after a cool-down) and a latency history:
+# if the primary has not answered by its p95 latency, the secondary is asked as well
+# and the first provider to return coordinates wins.
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.environ.get("CIRCUIT_RESET_SECONDS", "30"))
+GEOCODE_HEDGE_DEFAULT_SECONDS = float(os.environ.get("GEOCODE_HEDGE_DEFAULT_SECONDS", "1.5"))
+GEOCODE_HEDGE_MIN_SAMPLES = 20
+
+class _ProviderHealth:
+    """Circuit breaker and recent successful-call latencies for one provider."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.latencies: "deque[float]" = deque(maxlen=200)
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= CIRCUIT_RESET_SECONDS:
+                self.opened_at = time.monotonic()  # half-open: one trial call per cool-down
+                return True
+            return False
+
+    def record_success(self, seconds: float) -> None:
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info(f"🔌 {self.name} circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self.latencies.append(seconds)
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= CIRCUIT_FAILURE_THRESHOLD:
+                if self.opened_at is None:
+                    logger.warning(f"🔌 {self.name} circuit open after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+    def hedge_delay(self) -> float:
+        with self.lock:
+            if len(self.latencies) < GEOCODE_HEDGE_MIN_SAMPLES:
+                return GEOCODE_HEDGE_DEFAULT_SECONDS
+            return float(np.percentile(self.latencies, 95))
+
+_ors_geocode_health = _ProviderHealth("ORS geocoding")
+_nominatim_health = _ProviderHealth("Nominatim")
+_ors_auth_style = "bearer"  # whichever Authorization format ORS last accepted
+
+async def _geocode_ors(address: str) -> Optional[Tuple[float, float]]:
+    """ORS geocoding; None means no match, provider errors raise."""
+    global _ors_auth_style
+    url = "https://api.openrouteservice.org/geocode/search"
+    params = {
+        "text": address,
+        "boundary.country": "IN",  # Focus on India
+        "size": 5,  # Reduce size to avoid potential issues
+        "layers": "address,poi,street",  # Simplified layers
+        "sources": "osm"  # Single source to avoid conflicts
+    }
+    logger.info(f"🔍 ORS geocoding request for '{address}' with key: {ORS_API_KEY[:20]}...")
+    styles = [_ors_auth_style] + [s for s in ("bearer", "plain") if s != _ors_auth_style]
+    for style in styles:
+        headers = {"Authorization": f"Bearer {ORS_API_KEY}" if style == "bearer" else ORS_API_KEY}
+        resp = await provider_request("GET", url, params=params, headers=headers, timeout=10)
+        if resp.status_code not in (400, 401):
+            break
+        logger.warning(f"🔄 ORS rejected {style} auth format, trying the other one...")
+    if resp.status_code != 200:
+        raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+    if style != _ors_auth_style:
+        logger.info(f"🔑 Remembering ORS {style} auth format")
+        _ors_auth_style = style
+
+    data = resp.json()
+    if not data.get("features"):
+        logger.warning(f"❌ ORS geocoding failed for '{address}': No features found")
+        return None
+    # Try to find the most specific match with better scoring
+    best_feature = None
+    best_score = 0
+
+    for feature in data["features"]:
+        props = feature.get("properties", {})
+        confidence = props.get("confidence", 0)
+        layer = props.get("layer", "")
+        name = props.get("name", "").lower()
+        label = props.get("label", "").lower()
+
+        # Calculate score based on multiple factors
+        score = confidence
+
+        # Boost score for exact name matches
+        if address.lower() in name or address.lower() in label:
+            score += 0.3
+
+        # Boost score for specific layers
+        if layer == "address":
+            score += 0.2
+        elif layer == "poi":
+            score += 0.15
+        elif layer == "street":
+            score += 0.1
+
+        # Boost score for higher confidence
+        if confidence > 0.8:
+            score += 0.2
+        elif confidence > 0.6:
+            score += 0.1
+
+        if score > best_score:
+            best_score = score
+            best_feature = feature
+
+    if not best_feature:
+        best_feature = data["features"][0]  # Fallback to first result
+
+    coordinates = best_feature["geometry"]["coordinates"]
+    lon, lat = coordinates[0], coordinates[1]
+    props = best_feature.get("properties", {})
+    logger.info(f"✅ ORS geocoded '{address}' -> [{lat}, {lon}] (confidence: {props.get('confidence', 'N/A')}, layer: {props.get('layer', 'N/A')})")
+    return (lat, lon)
+
+async def _geocode_nominatim(address: str) -> Optional[Tuple[float, float]]:
+    """Nominatim geocoding; None means no match, provider errors raise."""
+    logger.info(f"🔄 Trying Nominatim for '{address}'")
+    headers = {"User-Agent": "delivery-route-app/1.0 (contact: dev@example.com)"}
+    params = {
+        "q": address, 
+        "format": "json", 
+        "limit": 5,  # Get more results
+        "addressdetails": 1,  # Get detailed address info
+        "countrycodes": "in",  # Focus on India
+        "extratags": 1  # Get extra tags for better matching
+    }
+    resp = await provider_request("GET", NOMINATIM_URL, params=params, headers=headers, timeout=15)
+    if resp.status_code != 200:
+        raise RuntimeError(f"HTTP {resp.status_code}")
+    data = resp.json()
+    if not data:
+        logger.warning(f"❌ No Nominatim results for '{address}'")
+        return None
+
+    # Try to find the best match from Nominatim results
+    best_result = None
+    for result in data:
+        importance = result.get("importance", 0)
+        osm_type = result.get("osm_type", "")
+
+        # Prefer house/building results for specific addresses
+        if osm_type in ["way", "node"] and importance > 0.5:
+            best_result = result
+            break
+        elif not best_result and importance > 0.3:
+            best_result = result
+
+    if not best_result:
+        best_result = data[0]  # Fallback to first result
+
+    lat = float(best_result["lat"])  # type: ignore
+    lon = float(best_result["lon"])  # type: ignore
+    display_name = best_result.get("display_name", "Unknown")
+    logger.info(f"✅ Nominatim geocoded '{address}' -> [{lat}, {lon}] (importance: {best_result.get('importance', 'N/A')}, type: {best_result.get('osm_type', 'N/A')})")
+    logger.info(f"   Found: {display_name[:100]}...")
+    return (lat, lon)
+
+async def _timed_geocode(health: _ProviderHealth, fetch: Callable[[str], Any],
+                         address: str) -> Tuple[Optional[Tuple[float, float]], bool]:
+    """(coordinates, provider answered) -- the flag is False when the call failed."""
+    started = time.monotonic()
+    try:
+        result = await fetch(address)
+    except Exception as e:
+        health.record_failure()
+        logger.error(f"❌ {health.name} error for '{address}': {e}")
+        return None, False
+    health.record_success(time.monotonic() - started)
+    return result, True
+
+# City centres used when no provider matched an address that names the city. They are
+# approximate, so they are returned but never cached.
+CITY_CENTRE_FALLBACKS = [
+    (("bangalore", "bengaluru"), "Bangalore", (12.9716, 77.5946)),
+    (("mumbai", "bombay"), "Mumbai", (19.0760, 72.8777)),
+    (("delhi",), "Delhi", (28.6139, 77.2090)),
+]
+
+def _city_centre_fallback(address: str) -> Optional[Tuple[float, float]]:
+    address_lower = address.lower()
+    for names, city, coords in CITY_CENTRE_FALLBACKS:
+        if any(name in address_lower for name in names):
+            logger.info(f"🔄 Using {city} fallback coordinates")
+            return coords
+    return None
+
+async def _geocode_from_providers(address: str) -> Tuple[Optional[Tuple[float, float]], bool]:
+    """Race the providers. The flag is True when the answer is definitive: coordinates were
+    found, or every configured provider was asked and answered "no match"."""
+    providers: List[Tuple[_ProviderHealth, Callable[[str], Any]]] = []
+    if ORS_API_KEY:
+        providers.append((_ors_geocode_health, _geocode_ors))
+    providers.append((_nominatim_health, _geocode_nominatim))
+    all_asked = True
+
+    def start_next() -> Optional["asyncio.Task[Tuple[Optional[Tuple[float, float]], bool]]"]:
+        nonlocal all_asked
+        while providers:
+            health, fetch = providers.pop(0)
+            if health.allow():
+                return asyncio.ensure_future(_timed_geocode(health, fetch, address))
+            all_asked = False
+            logger.info(f"🔌 Skipping {health.name} (circuit open)")
+        return None
+
+    first = start_next()
+    pending = {first} if first else set()
+    hedge_after = _ors_geocode_health.hedge_delay() if ORS_API_KEY else None
+    all_answered = True
+    while pending:
+        done, pending = await asyncio.wait(pending, timeout=hedge_after if providers else None,
+                                           return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            result, ok = task.result()
+            all_answered = all_answered and ok
+            if result is not None:
+                return result, True  # a slower hedge keeps running; its answer is dropped
+        if providers:
+            if not done:
+                logger.info(f"⏱️ No geocode for '{address}' within p95 ({hedge_after:.2f}s); hedging")
+            backup = start_next()
+            if backup:
+                pending.add(backup)
+    logger.warning(f"❌ No geocoding results for '{address}' from any service")
+    return None, all_asked and all_answered
+
+async def geocode_address_checked(address: str) -> Tuple[Optional[Tuple[float, float]], bool]:
+    """Geocode address using OpenRouteService first (free), hedged with Nominatim.
+
+    Returns (coordinates, definitive); definitive is False when the address could not be
+    resolved because providers failed or were skipped, rather than because it has no match.
+    Results and confirmed "not found" answers are cached under the normalized address.
+    """
     
     # Check if address is already coordinates (lat,lon format)
     if ',' in address and address.count(',') == 1:
@@ -354,242 +1430,1178 @@ def geocode_address(address: str) -> Optional[Tuple[float, float]]:
             # Validate coordinate ranges
             if -90 <= lat <= 90 and -180 <= lon <= 180:
                 logger.info(f"✅ Using provided coordinates '{address}' -> [{lat}, {lon}]")
-                return (lat, lon)
+                return (lat, lon), True
         except ValueError:
             pass  # Not valid coordinates, continue with geocoding
-    
-    # Try OpenRouteService Geocoding API first (FREE: 1,000 requests/day)
-    if ORS_API_KEY:
-        try:
-            url = "https://api.openrouteservice.org/geocode/search"
-            # Try different header formats for ORS API
-            headers = {"Authorization": f"Bearer {ORS_API_KEY}"}
-            params = {
-                "text": address,
-                "boundary.country": "IN",  # Focus on India
-                "size": 5,  # Reduce size to avoid potential issues
-                "layers": "address,poi,street",  # Simplified layers
-                "sources": "osm"  # Single source to avoid conflicts
-            }
-            logger.info(f"🔍 ORS geocoding request for '{address}' with key: {ORS_API_KEY[:20]}...")
-            resp = requests.get(url, params=params, headers=headers, timeout=10)
-            
-            # If Bearer format fails, try without Bearer
-            if resp.status_code == 401 or resp.status_code == 400:
-                logger.warning(f"🔄 Retrying ORS with different auth format...")
-                headers = {"Authorization": ORS_API_KEY}
-                resp = requests.get(url, params=params, headers=headers, timeout=10)
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                if data.get("features"):
-                    # Try to find the most specific match with better scoring
-                    best_feature = None
-                    best_score = 0
-                    
-                    for feature in data["features"]:
-                        props = feature.get("properties", {})
-                        confidence = props.get("confidence", 0)
-                        layer = props.get("layer", "")
-                        name = props.get("name", "").lower()
-                        label = props.get("label", "").lower()
-                        
-                        # Calculate score based on multiple factors
-                        score = confidence
-                        
-                        # Boost score for exact name matches
-                        if address.lower() in name or address.lower() in label:
-                            score += 0.3
-                        
-                        # Boost score for specific layers
-                        if layer == "address":
-                            score += 0.2
-                        elif layer == "poi":
-                            score += 0.15
-                        elif layer == "street":
-                            score += 0.1
-                        
-                        # Boost score for higher confidence
-                        if confidence > 0.8:
-                            score += 0.2
-                        elif confidence > 0.6:
-                            score += 0.1
-                        
-                        if score > best_score:
-                            best_score = score
-                            best_feature = feature
-                    
-                    if not best_feature:
-                        best_feature = data["features"][0]  # Fallback to first result
-                    
-                    coordinates = best_feature["geometry"]["coordinates"]
-                    lon, lat = coordinates[0], coordinates[1]
-                    props = best_feature.get("properties", {})
-                    logger.info(f"✅ ORS geocoded '{address}' -> [{lat}, {lon}] (confidence: {props.get('confidence', 'N/A')}, layer: {props.get('layer', 'N/A')})")
-                    return (lat, lon)
-                else:
-                    logger.warning(f"❌ ORS geocoding failed for '{address}': No features found")
+
+    key = normalize_address(address)
+    found, coords = _geocode_lru_get(key)
+    if not found:
+        found, coords = await run_in_threadpool(_geocode_disk_get, key)
+    if found:
+        return coords, True
+    coords, definitive = await _geocode_from_providers(address)
+    if coords is None and definitive:
+        fallback = _city_centre_fallback(address)
+        if fallback is not None:
+            return fallback, True
+    if definitive:
+        await _geocode_cache_put(key, coords, address)
+    return coords, definitive
+
+async def geocode_address_async(address: str) -> Optional[Tuple[float, float]]:
+    coords, _ = await geocode_address_checked(address)
+    return coords
+
+def geocode_address(address: str) -> Optional[Tuple[float, float]]:
+    """Blocking form of geocode_address_async for worker threads."""
+    found, coords = _geocode_cache_get(normalize_address(address), count_miss=False)
+    if found:
+        return coords
+    return run_provider_coroutine(geocode_address_async(address))
+
+async def geocode_addresses(addresses: Sequence[str]) -> Dict[str, Optional[Tuple[float, float]]]:
+    """Geocode every distinct address concurrently; returns coordinates by address."""
+    unique = list(dict.fromkeys(addresses))
+    results = await asyncio.gather(*(geocode_address_async(a) for a in unique))
+    return dict(zip(unique, results))
+
+# --- Local Road Graph (offline routing) ---
+# ROUTING_BACKEND=local answers ors_matrix / ors_directions in-process from the
+# contraction hierarchy written by build_road_graph.py; anything else uses ORS.
+ROUTING_BACKEND = os.environ.get("ROUTING_BACKEND", "ors").lower()
+ROAD_GRAPH_PATH = os.environ.get("ROAD_GRAPH_PATH", os.path.join("data", "road_graph.npz"))
+
+class RoadGraph:
+    """Contraction-hierarchy road graph: CSR upward/downward edges plus a shortcut
+    table for unpacking leg geometry. Costs are seconds and kilometres."""
+
+    SNAP_CELL_DEG = 0.01  # ~1 km grid for nearest-node lookup
+
+    def __init__(self, path: str):
+        data = np.load(path)
+        self.lat = data["lat"]
+        self.lon = data["lon"]
+        self.n = len(self.lat)
+        # Plain lists: the searches below index single elements, which lists do much faster.
+        self.up = tuple(data[k].tolist() for k in ("up_indptr", "up_to", "up_secs", "up_km"))
+        self.down = tuple(data[k].tolist() for k in ("down_indptr", "down_from", "down_secs", "down_km"))
+        self.edge_key = data["edge_key"]
+        self.edge_mid = data["edge_mid"]
+        cell_y = np.floor(self.lat / self.SNAP_CELL_DEG).astype(np.int64)
+        cell_x = np.floor(self.lon / self.SNAP_CELL_DEG).astype(np.int64)
+        order = np.lexsort((cell_x, cell_y))
+        self._cell_order = order
+        keys = list(zip(cell_y[order].tolist(), cell_x[order].tolist()))
+        self._cells: Dict[Tuple[int, int], Tuple[int, int]] = {}
+        for pos, key in enumerate(keys):
+            first, _ = self._cells.get(key, (pos, pos))
+            self._cells[key] = (first, pos + 1)
+
+    def snap(self, coords_latlon: Sequence[Tuple[float, float]]) -> List[int]:
+        """Nearest graph node for each coordinate, searching outward over grid cells."""
+        snapped = []
+        for lat, lon in coords_latlon:
+            cy = int(math.floor(lat / self.SNAP_CELL_DEG))
+            cx = int(math.floor(lon / self.SNAP_CELL_DEG))
+            candidates = np.empty(0, dtype=np.int64)
+            for ring in range(1, 6):
+                spans = [self._cells.get((cy + dy, cx + dx))
+                         for dy in range(-ring, ring + 1) for dx in range(-ring, ring + 1)]
+                parts = [self._cell_order[a:b] for (a, b) in (s for s in spans if s)]
+                if parts:
+                    candidates = np.concatenate(parts)
+                    break
+            if candidates.size == 0:
+                candidates = np.arange(self.n)
+            dy = self.lat[candidates] - lat
+            dx = (self.lon[candidates] - lon) * math.cos(math.radians(lat))
+            snapped.append(int(candidates[np.argmin(dy * dy + dx * dx)]))
+        return snapped
+
+    @staticmethod
+    def _upward(source: int, csr: Tuple[List, List, List, List]):
+        """Dijkstra over one direction of the hierarchy (only towards higher ranks)."""
+        indptr, neighbour, secs, km = csr
+        best = {source: 0.0}
+        dist = {source: 0.0}
+        pred = {source: -1}
+        settled: Dict[int, float] = {}
+        heap = [(0.0, source)]
+        while heap:
+            t, v = heapq.heappop(heap)
+            if v in settled:
+                continue
+            settled[v] = t
+            for e in range(indptr[v], indptr[v + 1]):
+                w = neighbour[e]
+                nt = t + secs[e]
+                if nt < best.get(w, math.inf):
+                    best[w] = nt
+                    dist[w] = dist[v] + km[e]
+                    pred[w] = v
+                    heapq.heappush(heap, (nt, w))
+        return settled, dist, pred
+
+    def matrix(self, coords_latlon: List[Tuple[float, float]],
+               sources: Optional[List[int]] = None,
+               destinations: Optional[List[int]] = None) -> Dict[str, np.ndarray]:
+        """Many-to-many durations (s) and distances (km); unreachable pairs are NaN."""
+        nodes = self.snap(coords_latlon)
+        src_nodes = [nodes[i] for i in (range(len(nodes)) if sources is None else sources)]
+        dst_nodes = [nodes[j] for j in (range(len(nodes)) if destinations is None else destinations)]
+        k = len(dst_nodes)
+        backward = {t: self._upward(t, self.down) for t in set(dst_nodes)}
+        meeting = sorted(set().union(*(b[0].keys() for b in backward.values()))) if backward else []
+        position = {v: i for i, v in enumerate(meeting)}
+        back_secs = np.full((len(meeting), k), np.inf)
+        back_km = np.full((len(meeting), k), np.inf)
+        for col, t in enumerate(dst_nodes):
+            settled, dist, _ = backward[t]
+            idx = [position[v] for v in settled]
+            back_secs[idx, col] = list(settled.values())
+            back_km[idx, col] = [dist[v] for v in settled]
+
+        durations = np.full((len(src_nodes), k), np.nan)
+        distances = np.full((len(src_nodes), k), np.nan)
+        cols = np.arange(k)
+        forward_cache: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        for row, s in enumerate(src_nodes):
+            if s not in forward_cache:
+                settled, dist, _ = self._upward(s, self.up)
+                hits = [(position[v], t, dist[v]) for v, t in settled.items() if v in position]
+                forward_cache[s] = np.array(hits, dtype=float).reshape(-1, 3)
+            hits = forward_cache[s]
+            if hits.size == 0:
+                continue
+            idx = hits[:, 0].astype(np.intp)
+            total = hits[:, 1:2] + back_secs[idx]
+            best = np.argmin(total, axis=0)
+            reachable = np.isfinite(total[best, cols])
+            durations[row, reachable] = total[best, cols][reachable]
+            distances[row, reachable] = (hits[best, 2] + back_km[idx[best], cols])[reachable]
+        return {"distances": distances, "durations": durations}
+
+    def _unpack(self, a: int, b: int) -> List[int]:
+        """Original node sequence for hierarchy edge a -> b, without the leading a."""
+        path: List[int] = []
+        stack = [(a, b)]
+        while stack:
+            u, w = stack.pop()
+            i = int(np.searchsorted(self.edge_key, u * self.n + w))
+            mid = int(self.edge_mid[i])
+            if mid < 0:
+                path.append(w)
             else:
-                logger.warning(f"❌ ORS API error for '{address}': HTTP {resp.status_code}")
-                logger.warning(f"   Response: {resp.text[:200]}...")
-                # Don't fail completely, continue to Nominatim fallback
-        except Exception as e:
-            logger.error(f"❌ ORS geocoding error for '{address}': {e}")
-            # Continue to Nominatim fallback
-    
-    # Fallback to Nominatim with better parameters
-    logger.info(f"🔄 Trying Nominatim fallback for '{address}'")
-    headers = {"User-Agent": "delivery-route-app/1.0 (contact: dev@example.com)"}
-    params = {
-        "q": address, 
-        "format": "json", 
-        "limit": 5,  # Get more results
-        "addressdetails": 1,  # Get detailed address info
-        "countrycodes": "in",  # Focus on India
-        "extratags": 1  # Get extra tags for better matching
-    }
+                stack.append((mid, w))
+                stack.append((u, mid))
+        return path
+
+    def _shortest_path(self, s: int, t: int) -> Optional[Tuple[List[int], float, float]]:
+        if s == t:
+            return [s], 0.0, 0.0
+        f_settled, f_dist, f_pred = self._upward(s, self.up)
+        b_settled, b_dist, b_pred = self._upward(t, self.down)
+        common = f_settled.keys() & b_settled.keys()
+        if not common:
+            return None
+        meet = min(common, key=lambda v: f_settled[v] + b_settled[v])
+        chain = [meet]
+        while f_pred[chain[-1]] != -1:
+            chain.append(f_pred[chain[-1]])
+        chain.reverse()
+        v = meet
+        while b_pred[v] != -1:
+            v = b_pred[v]
+            chain.append(v)
+        path = [s]
+        for a, b in zip(chain, chain[1:]):
+            path.extend(self._unpack(a, b))
+        return path, f_settled[meet] + b_settled[meet], f_dist[meet] + b_dist[meet]
+
+    def directions(self, coords_latlon_ordered: List[Tuple[float, float]]) -> Optional[Dict[str, Any]]:
+        """ORS-shaped GeoJSON FeatureCollection with one segment per leg."""
+        nodes = self.snap(coords_latlon_ordered)
+        line: List[List[float]] = []
+        segments = []
+        for s, t in zip(nodes, nodes[1:]):
+            leg = self._shortest_path(s, t)
+            if leg is None:
+                return None
+            path, secs, km = leg
+            points = [[float(self.lon[v]), float(self.lat[v])] for v in path]
+            line.extend(points if not line else points[1:])
+            segments.append({"distance": km, "duration": secs})
+        return {
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": line},
+                "properties": {
+                    "summary": {"distance": sum(s["distance"] for s in segments),
+                                "duration": sum(s["duration"] for s in segments)},
+                    "segments": segments,
+                },
+            }],
+        }
+
+road_graph: Optional[RoadGraph] = None
+if ROUTING_BACKEND == "local":
     try:
-        resp = requests.get(NOMINATIM_URL, params=params, headers=headers, timeout=15)
-        if resp.status_code != 200:
-            logger.warning(f"❌ Nominatim non-200 for '{address}': {resp.status_code}")
+        road_graph = RoadGraph(ROAD_GRAPH_PATH)
+        logger.info(f"🛣️ Local road graph loaded from {ROAD_GRAPH_PATH} ({road_graph.n} nodes)")
+    except Exception as e:
+        logger.warning(f"Could not load road graph from {ROAD_GRAPH_PATH}, using ORS: {e}")
+
+def _matrix_json(values: np.ndarray) -> List[List[Optional[float]]]:
+    """ORS matrix JSON shape: nested lists with null for unroutable cells."""
+    return [[None if v != v else v for v in row] for row in values.tolist()]
+
+# --- Matrix Cell Cache ---
+# Road distances between two points barely change, and depots and repeat customers
+# appear in most plans, so matrix cells are cached per (source, destination) pair of
+# snapped coordinates: a hot in-process LRU in front of a SQLite table, both with TTL.
+MATRIX_CACHE_DB = os.environ.get("MATRIX_CACHE_DB", "db/matrix_cache.db")
+MATRIX_CACHE_TTL_SECONDS = int(os.environ.get("MATRIX_CACHE_TTL_SECONDS", str(14 * 24 * 3600)))
+MATRIX_CACHE_HOT_CELLS = int(os.environ.get("MATRIX_CACHE_HOT_CELLS", "200000"))
+MATRIX_CACHE_SNAP_DECIMALS = int(os.environ.get("MATRIX_CACHE_SNAP_DECIMALS", "5"))  # ~1 m
+MATRIX_CACHE_SQL_CHUNK = 400  # stays under SQLite's bound-parameter limit
+# Expired rows are deleted at startup and then by a write at most this often
+MATRIX_CACHE_PURGE_SECONDS = int(os.environ.get("MATRIX_CACHE_PURGE_SECONDS", "3600"))
+_matrix_hot: "OrderedDict[Tuple[str, str], Tuple[Optional[float], Optional[float], float]]" = OrderedDict()
+_matrix_hot_lock = threading.Lock()
+_matrix_purged_at = time.time()
+_matrix_purge_lock = threading.Lock()
+
+def init_matrix_cache_db():
+    os.makedirs(os.path.dirname(MATRIX_CACHE_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(MATRIX_CACHE_DB)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS matrix_cells (
+            src TEXT NOT NULL,
+            dst TEXT NOT NULL,
+            distance_km REAL,
+            duration_s REAL,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (src, dst)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('DELETE FROM matrix_cells WHERE fetched_at < ?',
+                   (time.time() - MATRIX_CACHE_TTL_SECONDS,))
+    conn.commit()
+    conn.close()
+    logger.info("Matrix cache database initialized")
+
+init_matrix_cache_db()
+
+def _snap_key(coord: Tuple[float, float]) -> str:
+    return f"{coord[0]:.{MATRIX_CACHE_SNAP_DECIMALS}f},{coord[1]:.{MATRIX_CACHE_SNAP_DECIMALS}f}"
+
+def _matrix_cache_lookup(src_keys: List[str], dst_keys: List[str]
+                         ) -> Dict[Tuple[str, str], Tuple[Optional[float], Optional[float]]]:
+    """Cached (distance_km, duration_s) for every fresh src x dst pair; None values
+    mean ORS reported the pair unroutable."""
+    now = time.time()
+    found: Dict[Tuple[str, str], Tuple[Optional[float], Optional[float]]] = {}
+    wanted = {(s, d) for s in set(src_keys) for d in set(dst_keys)}
+    with _matrix_hot_lock:
+        for pair in wanted:
+            cell = _matrix_hot.get(pair)
+            if cell is None:
+                continue
+            if now - cell[2] > MATRIX_CACHE_TTL_SECONDS:
+                del _matrix_hot[pair]
+                continue
+            _matrix_hot.move_to_end(pair)
+            found[pair] = (cell[0], cell[1])
+    if len(found) == len(wanted):
+        return found
+
+    cold_src = sorted({s for (s, d) in wanted - found.keys()})
+    cold_dst = sorted({d for (s, d) in wanted - found.keys()})
+    promoted = []
+    try:
+        conn = sqlite3.connect(MATRIX_CACHE_DB, timeout=10)
+        cursor = conn.cursor()
+        for a in range(0, len(cold_src), MATRIX_CACHE_SQL_CHUNK):
+            srcs = cold_src[a:a + MATRIX_CACHE_SQL_CHUNK]
+            for b in range(0, len(cold_dst), MATRIX_CACHE_SQL_CHUNK):
+                dsts = cold_dst[b:b + MATRIX_CACHE_SQL_CHUNK]
+                cursor.execute(
+                    f"SELECT src, dst, distance_km, duration_s, fetched_at FROM matrix_cells "
+                    f"WHERE src IN ({','.join('?' * len(srcs))}) AND dst IN ({','.join('?' * len(dsts))}) "
+                    f"AND fetched_at >= ?",
+                    (*srcs, *dsts, now - MATRIX_CACHE_TTL_SECONDS))
+                for src, dst, distance_km, duration_s, fetched_at in cursor.fetchall():
+                    if (src, dst) in wanted:
+                        found[(src, dst)] = (distance_km, duration_s)
+                        promoted.append(((src, dst), (distance_km, duration_s, fetched_at)))
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Matrix cache read failed: {e}")
+    _matrix_hot_put(promoted)
+    return found
+
+def _matrix_hot_put(cells: List[Tuple[Tuple[str, str], Tuple[Optional[float], Optional[float], float]]]) -> None:
+    with _matrix_hot_lock:
+        for pair, cell in cells:
+            _matrix_hot[pair] = cell
+            _matrix_hot.move_to_end(pair)
+        while len(_matrix_hot) > MATRIX_CACHE_HOT_CELLS:
+            _matrix_hot.popitem(last=False)
+
+def _matrix_cache_store(cells: List[Tuple[str, str, Optional[float], Optional[float]]]) -> None:
+    if not cells:
+        return
+    now = time.time()
+    _matrix_hot_put([((s, d), (dist, dur, now)) for (s, d, dist, dur) in cells])
+    try:
+        conn = sqlite3.connect(MATRIX_CACHE_DB, timeout=10)
+        conn.executemany(
+            "INSERT OR REPLACE INTO matrix_cells (src, dst, distance_km, duration_s, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(s, d, dist, dur, now) for (s, d, dist, dur) in cells])
+        if _matrix_purge_due(now):
+            purged = conn.execute('DELETE FROM matrix_cells WHERE fetched_at < ?',
+                                  (now - MATRIX_CACHE_TTL_SECONDS,)).rowcount
+            if purged:
+                logger.info(f"🗄️ Matrix cache: purged {purged} expired cells")
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Matrix cache write failed: {e}")
+
+def _matrix_purge_due(now: float) -> bool:
+    """True for one caller every MATRIX_CACHE_PURGE_SECONDS."""
+    global _matrix_purged_at
+    with _matrix_purge_lock:
+        if now - _matrix_purged_at < MATRIX_CACHE_PURGE_SECONDS:
+            return False
+        _matrix_purged_at = now
+        return True
+
+# --- Tiled Matrix Fetching ---
+# ORS caps how many cells one matrix request may cover, so anything larger is split
+# into source x destination tiles that are fetched concurrently under the account's
+# request rate and stitched back together.
+MATRIX_TILE_SIZE = int(os.environ.get("MATRIX_TILE_SIZE", "50"))
+MATRIX_TILE_WORKERS = int(os.environ.get("MATRIX_TILE_WORKERS", "4"))
+MATRIX_TILE_RETRIES = int(os.environ.get("MATRIX_TILE_RETRIES", "3"))
+# Opened by repeated failed tile attempts; while open, matrices go straight to the fallback
+_ors_matrix_health = _ProviderHealth("ORS matrix")
+
+async def _fetch_ors_matrix_tile(api_key: str, coords_latlon: List[Tuple[float, float]],
+                           sources: List[int], destinations: List[int]
+                           ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """One ORS matrix request for a sources x destinations tile, retried with backoff on
+    rate limiting, server errors and timeouts. Only the tile's own locations are sent."""
+    used = sorted(set(sources) | set(destinations))
+    position = {i: k for k, i in enumerate(used)}
+    body = {
+        "locations": [[coords_latlon[i][1], coords_latlon[i][0]] for i in used],  # ORS expects [lon, lat]
+        "sources": [position[i] for i in sources],
+        "destinations": [position[j] for j in destinations],
+        "metrics": ["distance", "duration"],
+        "units": "km",
+    }
+    headers = {"Authorization": api_key, "Content-Type": "application/json"}
+    for attempt in range(MATRIX_TILE_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(min(2 ** (attempt - 1), 8))
+        if not _ors_matrix_health.allow():
+            logger.info("🔌 Skipping ORS matrix tile (circuit open)")
             return None
-        data = resp.json()
-        if not data:
-            logger.warning(f"❌ No geocoding results for '{address}' from any service")
-            # Try a simple fallback for common Indian cities
-            address_lower = address.lower()
-            if 'bangalore' in address_lower or 'bengaluru' in address_lower:
-                logger.info(f"🔄 Using Bangalore fallback coordinates")
-                return (12.9716, 77.5946)  # Bangalore center
-            elif 'mumbai' in address_lower or 'bombay' in address_lower:
-                logger.info(f"🔄 Using Mumbai fallback coordinates")
-                return (19.0760, 72.8777)  # Mumbai center
-            elif 'delhi' in address_lower or 'new delhi' in address_lower:
-                logger.info(f"🔄 Using Delhi fallback coordinates")
-                return (28.6139, 77.2090)  # Delhi center
+        started = time.monotonic()
+        try:
+            resp = await provider_request("POST", ORS_MATRIX_URL, json=body, headers=headers, timeout=30)
+        except ProviderQuotaExceeded as e:
+            logger.warning(f"ORS matrix tile skipped: {e}")
             return None
-        
-        # Try to find the best match from Nominatim results
-        best_result = None
-        for result in data:
-            importance = result.get("importance", 0)
-            osm_type = result.get("osm_type", "")
-            
-            # Prefer house/building results for specific addresses
-            if osm_type in ["way", "node"] and importance > 0.5:
-                best_result = result
-                break
-            elif not best_result and importance > 0.3:
-                best_result = result
-        
-        if not best_result:
-            best_result = data[0]  # Fallback to first result
-        
-        lat = float(best_result["lat"])  # type: ignore
-        lon = float(best_result["lon"])  # type: ignore
-        display_name = best_result.get("display_name", "Unknown")
-        logger.info(f"✅ Nominatim geocoded '{address}' -> [{lat}, {lon}] (importance: {best_result.get('importance', 'N/A')}, type: {best_result.get('osm_type', 'N/A')})")
-        logger.info(f"   Found: {display_name[:100]}...")
-        return (lat, lon)
+        except Exception as e:
+            _ors_matrix_health.record_failure()
+            logger.warning(f"ORS matrix tile error (attempt {attempt + 1}): {e}")
+            continue
+        if resp.status_code == 200:
+            try:
+                data = resp.json()
+                distances = np.array(data["distances"], dtype=float)
+                durations = np.array(data["durations"], dtype=float) if data.get("durations") is not None \
+                    else np.full(distances.shape, np.nan)
+                if distances.shape != (len(sources), len(destinations)) or durations.shape != distances.shape:
+                    raise ValueError(f"unexpected matrix shape {distances.shape}")
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                # Truncated or malformed body: treat like a failed attempt
+                _ors_matrix_health.record_failure()
+                logger.warning(f"ORS matrix tile unreadable (attempt {attempt + 1}): {e}")
+                continue
+            _ors_matrix_health.record_success(time.monotonic() - started)
+            return distances, durations
+        if resp.status_code >= 500:
+            _ors_matrix_health.record_failure()
+        logger.warning(f"ORS matrix non-200: {resp.status_code} {resp.text[:200]}")
+        if resp.status_code != 429 and resp.status_code < 500:
+            return None
+    return None
+
+def _fetch_ors_matrix(api_key: str, coords_latlon: List[Tuple[float, float]],
+                      sources: Optional[List[int]] = None,
+                      destinations: Optional[List[int]] = None) -> Optional[Dict[str, np.ndarray]]:
+    """ORS distance/duration matrix as NumPy arrays; sources/destinations (indices into
+    coords_latlon) restrict it to a block. Blocks over MATRIX_TILE_SIZE on either side
+    are fetched as concurrent tiles; any tile that still fails fails the whole fetch."""
+    src_idx = list(range(len(coords_latlon))) if sources is None else list(sources)
+    dst_idx = list(range(len(coords_latlon))) if destinations is None else list(destinations)
+    tiles = [(a, b)
+             for a in range(0, len(src_idx), MATRIX_TILE_SIZE)
+             for b in range(0, len(dst_idx), MATRIX_TILE_SIZE)]
+
+    async def fetch_all():
+        slots = asyncio.Semaphore(MATRIX_TILE_WORKERS)
+
+        async def fetch(a: int, b: int):
+            async with slots:
+                return await _fetch_ors_matrix_tile(api_key, coords_latlon, src_idx[a:a + MATRIX_TILE_SIZE],
+                                                    dst_idx[b:b + MATRIX_TILE_SIZE])
+        return await asyncio.gather(*(fetch(a, b) for a, b in tiles))
+
+    if len(tiles) > 1:
+        logger.info(f"🧩 Fetching {len(src_idx)}x{len(dst_idx)} matrix as {len(tiles)} tiles")
+    results = run_provider_coroutine(fetch_all())
+
+    distances = np.empty((len(src_idx), len(dst_idx)))
+    durations = np.empty((len(src_idx), len(dst_idx)))
+    for (a, b), result in zip(tiles, results):
+        if result is None:
+            logger.error(f"ORS matrix tile at ({a}, {b}) unavailable")
+            return None
+        tile_dist, tile_dur = result
+        distances[a:a + tile_dist.shape[0], b:b + tile_dist.shape[1]] = tile_dist
+        durations[a:a + tile_dur.shape[0], b:b + tile_dur.shape[1]] = tile_dur
+    return {"distances": distances, "durations": durations}
+
+# --- Haversine Fallback Matrix ---
+# Great-circle distance times a road detour factor, driven at a typical road speed,
+# both learned per region from the ORS cells already in the matrix cache. Used as an
+# instant degraded-mode matrix when ORS is unavailable, and nearest_candidates() uses the
+# plain great-circle distances to pick which stop pairs are worth a provider matrix cell.
+EARTH_RADIUS_KM = 6371.0088
+DETOUR_REGION_DEG = float(os.environ.get("DETOUR_REGION_DEG", "0.25"))
+DEFAULT_DETOUR_FACTOR = float(os.environ.get("DEFAULT_DETOUR_FACTOR", "1.35"))
+DEFAULT_ROAD_SPEED_KMH = float(os.environ.get("DEFAULT_ROAD_SPEED_KMH", "22"))
+DETOUR_CALIBRATION_MIN_SAMPLES = 50
+DETOUR_CALIBRATION_MIN_KM = 0.3  # shorter cells are dominated by snapping noise
+DETOUR_CALIBRATION_MAX_CELLS = 200000
+DETOUR_RECALIBRATE_SECONDS = int(os.environ.get("DETOUR_RECALIBRATE_SECONDS", "3600"))
+_detour_table: Dict[Any, Tuple[float, float]] = {}
+_detour_calibrated_at = 0.0
+_detour_lock = threading.Lock()
+_detour_calibration_lock = threading.Lock()  # held while a recalibration runs
+
+def _haversine_km(src_rad: np.ndarray, dst_rad: np.ndarray) -> np.ndarray:
+    """Great-circle kilometres between broadcastable [..., (lat, lon)] arrays in radians."""
+    dlat = dst_rad[..., 0] - src_rad[..., 0]
+    dlon = dst_rad[..., 1] - src_rad[..., 1]
+    h = np.sin(dlat / 2) ** 2 + np.cos(src_rad[..., 0]) * np.cos(dst_rad[..., 0]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+def haversine_km_matrix(src_latlon: Any, dst_latlon: Any) -> np.ndarray:
+    """Great-circle kilometres between every source and destination (vectorized)."""
+    src = np.radians(np.asarray(src_latlon, dtype=float).reshape(-1, 2))
+    dst = np.radians(np.asarray(dst_latlon, dtype=float).reshape(-1, 2))
+    return _haversine_km(src[:, None, :], dst[None, :, :])
+
+def _detour_regions(latlon: np.ndarray) -> List[Tuple[int, int]]:
+    cells = np.floor(latlon / DETOUR_REGION_DEG).astype(np.int64)
+    return [tuple(c) for c in cells.tolist()]
+
+def nearest_candidates(coords_latlon: Any, targets_latlon: Any, k: int) -> np.ndarray:
+    """Indices of the k coordinates closest (great-circle) to each target, nearest first."""
+    km = haversine_km_matrix(targets_latlon, coords_latlon)
+    k = min(k, km.shape[1])
+    nearest = np.argpartition(km, k - 1, axis=1)[:, :k]
+    by_distance = np.take_along_axis(km, nearest, axis=1).argsort(axis=1, kind="stable")
+    return np.take_along_axis(nearest, by_distance, axis=1)
+
+def calibrate_detour_factors() -> None:
+    """Median road/great-circle ratio and median road speed per region from cached ORS cells."""
+    if not _detour_calibration_lock.acquire(blocking=False):
+        return  # another thread is already recalibrating
+    try:
+        _calibrate_detour_factors()
+    finally:
+        _detour_calibration_lock.release()
+
+def _calibrate_detour_factors() -> None:
+    global _detour_table, _detour_calibrated_at
+    try:
+        conn = sqlite3.connect(MATRIX_CACHE_DB, timeout=10)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT src, dst, distance_km, duration_s FROM matrix_cells "
+            "WHERE distance_km IS NOT NULL AND duration_s > 0 ORDER BY fetched_at DESC LIMIT ?",
+            (DETOUR_CALIBRATION_MAX_CELLS,))
+        rows = cursor.fetchall()
+        conn.close()
     except Exception as e:
-        logger.error(f"❌ Nominatim error for '{address}': {e}")
+        logger.warning(f"Detour calibration skipped: {e}")
+        rows = []
+    table: Dict[Any, Tuple[float, float]] = {}
+    if rows:
+        src = np.array([[float(x) for x in r[0].split(",")] for r in rows])
+        dst = np.array([[float(x) for x in r[1].split(",")] for r in rows])
+        road_km = np.array([r[2] for r in rows], dtype=float)
+        hours = np.array([r[3] for r in rows], dtype=float) / 3600.0
+        straight = _haversine_km(np.radians(src), np.radians(dst))
+        usable = straight >= DETOUR_CALIBRATION_MIN_KM
+        ratio = np.clip(road_km[usable] / straight[usable], 1.0, 3.0)
+        speed = np.clip(road_km[usable] / hours[usable], 5.0, 90.0)
+        regions = np.array(_detour_regions(src[usable]), dtype=np.int64).reshape(-1, 2)
+        if ratio.size >= DETOUR_CALIBRATION_MIN_SAMPLES:
+            table["*"] = (float(np.median(ratio)), float(np.median(speed)))
+            keys, inverse = np.unique(regions, axis=0, return_inverse=True)
+            for r, key in enumerate(keys.tolist()):
+                members = inverse.ravel() == r
+                if members.sum() >= DETOUR_CALIBRATION_MIN_SAMPLES:
+                    table[tuple(key)] = (float(np.median(ratio[members])), float(np.median(speed[members])))
+    with _detour_lock:
+        _detour_table = table
+        _detour_calibrated_at = time.time()
+    if table:
+        logger.info(f"📐 Detour factors calibrated for {len(table) - 1} regions "
+                    f"(overall ×{table['*'][0]:.2f} at {table['*'][1]:.1f} km/h)")
+
+def _detour_and_speed(latlon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    if time.time() - _detour_calibrated_at > DETOUR_RECALIBRATE_SECONDS and not _detour_calibration_lock.locked():
+        # Reading the cache can take a while; serve the current table (or the defaults) meanwhile
+        threading.Thread(target=calibrate_detour_factors, name="detour-calibration", daemon=True).start()
+    with _detour_lock:
+        table = _detour_table
+    default = table.get("*", (DEFAULT_DETOUR_FACTOR, DEFAULT_ROAD_SPEED_KMH))
+    factors = np.array([table.get(region, default) for region in _detour_regions(latlon)], dtype=float)
+    return factors[:, 0], factors[:, 1]
+
+def fallback_matrix(coords_latlon: List[Tuple[float, float]],
+                    sources: Optional[List[int]] = None,
+                    destinations: Optional[List[int]] = None) -> Dict[str, np.ndarray]:
+    """Estimated road distances (km) and durations (s) without any provider call."""
+    coords = np.asarray(coords_latlon, dtype=float)
+    src = coords if sources is None else coords[list(sources)]
+    dst = coords if destinations is None else coords[list(destinations)]
+    detour, speed = _detour_and_speed(src)
+    distances = haversine_km_matrix(src, dst) * detour[:, None]
+    return {"distances": distances, "durations": distances / speed[:, None] * 3600.0}
+
+def ors_matrix(api_key: str, coords_latlon: List[Tuple[float, float]],
+               sources: Optional[List[int]] = None,
+               destinations: Optional[List[int]] = None) -> Optional[Dict[str, Any]]:
+    """Same contract as the ORS matrix endpoint, served from the cell cache where
+    possible; only the sources/destinations with missing cells go to ORS."""
+    if road_graph is not None:
+        local = road_graph.matrix(coords_latlon, sources, destinations)
+        return {"distances": _matrix_json(local["distances"]), "durations": _matrix_json(local["durations"])}
+    src_idx = list(range(len(coords_latlon))) if sources is None else list(sources)
+    dst_idx = list(range(len(coords_latlon))) if destinations is None else list(destinations)
+    keys = [_snap_key(c) for c in coords_latlon]
+    src_keys = [keys[i] for i in src_idx]
+    dst_keys = [keys[j] for j in dst_idx]
+    cells = _matrix_cache_lookup(src_keys, dst_keys)
+
+    distances = np.full((len(src_idx), len(dst_idx)), np.nan)
+    durations = np.full((len(src_idx), len(dst_idx)), np.nan)
+    have = np.zeros((len(src_idx), len(dst_idx)), dtype=bool)
+    for r, s in enumerate(src_keys):
+        for c, d in enumerate(dst_keys):
+            if s == d:
+                distances[r, c] = durations[r, c] = 0.0
+                have[r, c] = True
+                continue
+            cell = cells.get((s, d))
+            if cell is not None:
+                distances[r, c] = np.nan if cell[0] is None else cell[0]
+                durations[r, c] = np.nan if cell[1] is None else cell[1]
+                have[r, c] = True
+
+    hits = int(have.sum())
+    degraded = False
+    if hits < have.size:
+        # Cover the missing cells with at most two blocks: full rows for sources that are
+        # mostly unknown (new stops), then the remaining missing rows x columns.
+        mostly_new = np.flatnonzero((~have).sum(axis=1) * 2 > len(dst_idx))
+        for first_pass in (True, False):
+            if first_pass:
+                if mostly_new.size == 0:
+                    continue
+                rows, cols = mostly_new, np.arange(len(dst_idx))
+            else:
+                rest = ~have
+                rows, cols = np.flatnonzero(rest.any(axis=1)), np.flatnonzero(rest.any(axis=0))
+                if rows.size == 0:
+                    break
+            block = _fetch_ors_matrix(api_key, coords_latlon,
+                                      sources=[src_idx[r] for r in rows],
+                                      destinations=[dst_idx[c] for c in cols])
+            if block is None:
+                logger.warning("⚠️ ORS matrix unavailable; estimating missing cells from detour-scaled "
+                               "great-circle distances (degraded mode)")
+                estimate = fallback_matrix(coords_latlon, src_idx, dst_idx)
+                distances[~have] = estimate["distances"][~have]
+                durations[~have] = estimate["durations"][~have]
+                degraded = True
+                break
+            block_dist, block_dur = block["distances"], block["durations"]
+            distances[np.ix_(rows, cols)] = block_dist
+            durations[np.ix_(rows, cols)] = block_dur
+            have[np.ix_(rows, cols)] = True
+            _matrix_cache_store([
+                (src_keys[r], dst_keys[c],
+                 None if np.isnan(block_dist[a, b]) else float(block_dist[a, b]),
+                 None if np.isnan(block_dur[a, b]) else float(block_dur[a, b]))
+                for a, r in enumerate(rows) for b, c in enumerate(cols)
+                if src_keys[r] != dst_keys[c]])
+    logger.info(f"🗄️ Matrix cache: {hits}/{have.size} cells reused")
+
+    result = {"distances": _matrix_json(distances), "durations": _matrix_json(durations)}
+    if degraded:
+        result["degraded"] = True
+    return result
+
+def _metric_matrix(matrix: Dict[str, Any]) -> Any:
+    """Durations when ORS returned them, distances otherwise."""
+    durations = matrix.get("durations")
+    return durations if durations is not None else matrix.get("distances")
+
+def nearest_neighbor_order(matrix_dist: List[List[float]], start_index: int = 0) -> List[int]:
+    n = len(matrix_dist)
+    visited = [False] * n
+    order = [start_index]
+    visited[start_index] = True
+    current = start_index
+    for _ in range(n - 1):
+        next_idx = None
+        next_cost = float("inf")
+        for j in range(n):
+            if not visited[j] and matrix_dist[current][j] is not None:
+                if matrix_dist[current][j] < next_cost:
+                    next_cost = matrix_dist[current][j]
+                    next_idx = j
+        if next_idx is None:
+            # Fallback: pick any unvisited
+            for j in range(n):
+                if not visited[j]:
+                    next_idx = j
+                    break
+        order.append(next_idx)  # type: ignore
+        visited[next_idx] = True  # type: ignore
+        current = next_idx  # type: ignore
+    return order
+
+# The optimizer core lives in route_optimizer.py so its pool workers can start
+# without importing this server; imported after load_env_file() for its settings.
+from route_optimizer import (
+    HELD_KARP_MAX_STOPS, IMPROVEMENT_EPSILON, MULTISTART_WORKERS, _as_cost_matrix,
+    _get_optimizer_pool, _greedy_nearest_neighbor, _repair_around, _reset_optimizer_pool,
+    _route_cost, _solve_cluster_path, _with_open_end, held_karp_order, local_search,
+    solve_open_path,
+)
+
+def _nearest_neighbor_with_start(matrix: List[List[float]], start_index: int) -> List[int]:
+    return nearest_neighbor_order(matrix, start_index)
+
+def build_best_order_multistart(matrix: List[List[float]], prefer_start: int = 0,
+                                end_index: Optional[int] = None) -> List[int]:
+    """Always start from the preferred start point and optimize from there.
+
+    Routes of up to HELD_KARP_MAX_STOPS stops are solved exactly; larger ones
+    use the multistart heuristic. end_index, if given, pins the final stop.
+    """
+    n = len(matrix)
+    if n <= 1:
+        return list(range(n))
+    if end_index == prefer_start:
+        end_index = None
+    
+    # For delivery routes, use simple sequential order starting from current location
+    # This ensures we visit all stops in the order they were added
+    if prefer_start == 0:
+        # If starting from current location (index 0), use sequential order
+        order = list(range(n))
+        if end_index is not None:
+            order.remove(end_index)
+            order.append(end_index)
+        logger.info(f"📍 Using sequential delivery order: {order}")
+    else:
+        # For other cases, solve exactly or improve several starting tours and keep the best
+        order = solve_open_path(matrix, prefer_start, end_index)
+        logger.info(f"📍 Using optimized order: {order}")
+    
+    return order
+
+# --- Anytime Optimization ---
+ANYTIME_DEFAULT_BUDGET_MS = int(os.environ.get("ANYTIME_DEFAULT_BUDGET_MS", "2000"))
+
+def _segment_exchange_kick(tour: np.ndarray, rng: random.Random) -> np.ndarray:
+    """Perturbation for iterated local search: swap two random adjacent inner segments.
+
+    This is the open-path analogue of the double-bridge kick; first and last
+    nodes stay put and no segment is reversed.
+    """
+    i, j, k = sorted(rng.sample(range(1, len(tour) - 1), 3))
+    return np.concatenate((tour[:i], tour[j:k + 1], tour[i:j], tour[k + 1:]))
+
+def anytime_optimize(matrix: Any, start_index: int = 0, end_index: Optional[int] = None,
+                     budget_ms: int = ANYTIME_DEFAULT_BUDGET_MS,
+                     on_improvement: Optional[Callable[[List[int], float], None]] = None,
+                     seed: int = 0) -> List[int]:
+    """Best order found within a wall-clock budget.
+
+    Reports a nearest-neighbour order straight away, then improves it with
+    local search followed by iterated local search (kick + descent) until the
+    budget runs out. on_improvement(order, cost) is called for every new best.
+    The deadline is checked inside every local-search pass, so even large
+    routes overrun it by at most one row of candidate moves. Small routes are
+    simply solved exactly.
+    """
+    deadline = time.perf_counter() + budget_ms / 1000.0
+    m = matrix if isinstance(matrix, np.ndarray) else _as_cost_matrix(matrix)
+    n = len(m)
+    if n <= HELD_KARP_MAX_STOPS:
+        order = held_karp_order(m, start_index, end_index)
+        if on_improvement:
+            on_improvement(order, _route_cost(m, order))
+        return order
+
+    open_end = end_index is None or end_index == start_index
+    if open_end:
+        m = _with_open_end(m)
+        end_index = n
+
+    def strip(tour: List[int]) -> List[int]:
+        return tour[:-1] if open_end else tour
+
+    best = _greedy_nearest_neighbor(m, start_index, end_index)
+    best_cost = _route_cost(m, best)
+    if on_improvement:
+        on_improvement(strip(best), best_cost)
+
+    rng = random.Random(seed)
+    candidate = best
+    while time.perf_counter() < deadline:
+        candidate = local_search(m, candidate, deadline=deadline)
+        cost = _route_cost(m, candidate)
+        if cost + IMPROVEMENT_EPSILON < best_cost:
+            best, best_cost = candidate, cost
+            if on_improvement:
+                on_improvement(strip(best), best_cost)
+        if len(best) < 5:
+            break
+        candidate = _segment_exchange_kick(np.array(best, dtype=np.intp), rng).tolist()
+
+    logger.info(f"⏱️ Anytime optimizer: best cost {best_cost:.2f} within {budget_ms} ms")
+    return strip(best)
+
+# --- Cluster-First, Route-Second Decomposition ---
+# Stop lists at least this long are split into geographic clusters
+CLUSTER_DECOMPOSITION_MIN_STOPS = int(os.environ.get("CLUSTER_DECOMPOSITION_MIN_STOPS", "250"))
+CLUSTER_TARGET_SIZE = int(os.environ.get("CLUSTER_TARGET_SIZE", "120"))
+# Stops per side considered when connecting two neighbouring clusters
+CLUSTER_BOUNDARY_CANDIDATES = 5
+CLUSTER_FETCH_WORKERS = int(os.environ.get("CLUSTER_FETCH_WORKERS", "4"))
+
+def _project_km(coords_latlon: Any) -> np.ndarray:
+    """Equirectangular projection to kilometres; accurate enough within a city."""
+    c = np.asarray(coords_latlon, dtype=float)
+    lat0 = np.radians(c[:, 0].mean())
+    return np.column_stack((c[:, 1] * 111.32 * np.cos(lat0), c[:, 0] * 110.57))
+
+def kmeans_clusters(points: np.ndarray, k: int, iterations: int = 25, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means with k-means++ seeding; returns a cluster label per point.
+
+    Each iteration is O(n * k), so with k ~ n / CLUSTER_TARGET_SIZE the whole
+    partition stays close to linear in the number of stops.
+    """
+    n = len(points)
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+    centers = np.empty((k, points.shape[1]))
+    centers[0] = points[rng.integers(n)]
+    closest = np.full(n, np.inf)
+    for c in range(1, k):
+        closest = np.minimum(closest, ((points - centers[c - 1]) ** 2).sum(axis=1))
+        total = closest.sum()
+        pick = rng.choice(n, p=closest / total) if total > 0 else rng.integers(n)
+        centers[c] = points[pick]
+    labels = np.zeros(n, dtype=np.intp)
+    for iteration in range(iterations):
+        dist = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = dist.argmin(axis=1)
+        if iteration and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for c in range(k):
+            members = points[labels == c]
+            if len(members):
+                centers[c] = members.mean(axis=0)
+    # Drop empty clusters and renumber 0..k'-1
+    _, labels = np.unique(labels, return_inverse=True)
+    return labels
+
+def _closest_members(latlon: np.ndarray, members: np.ndarray, target: np.ndarray, k: int) -> np.ndarray:
+    """The k members nearest to target; only these pairs get boundary matrix cells."""
+    return members[nearest_candidates(latlon[members], target, k)[0]]
+
+def cluster_first_order(api_key: str, coords: List[Tuple[float, float]], start_index: int = 0,
+                        end_index: Optional[int] = None) -> Optional[Tuple[List[int], bool]]:
+    """Cluster-first, route-second ordering for very large stop lists.
+
+    Stops are partitioned with k-means, the cluster visiting order is solved on
+    centroid distances, neighbouring clusters are joined at their cheapest
+    boundary pair (from a small ORS block of candidate stops) and each cluster
+    is then routed from its entry to its exit stop in parallel. Only the
+    intra-cluster and boundary matrices are requested, so fetched cells and
+    memory grow with n * CLUSTER_TARGET_SIZE instead of n^2.
+
+    Returns (order, degraded); degraded is True when any cluster or boundary
+    block was estimated rather than fetched from ORS.
+    """
+    n = len(coords)
+    points = _project_km(coords)
+    labels = kmeans_clusters(points, -(-n // CLUSTER_TARGET_SIZE))
+    if end_index is not None and end_index != start_index and labels[end_index] == labels[start_index]:
+        # The cluster order needs distinct first and last clusters; give the end stop its own
+        labels = labels.copy()
+        labels[end_index] = labels.max() + 1
+    k = int(labels.max()) + 1
+    members = [np.flatnonzero(labels == c) for c in range(k)]
+    centroids = np.array([points[mem].mean(axis=0) for mem in members])
+    latlon = np.asarray(coords, dtype=float)
+    centroids_latlon = np.array([latlon[mem].mean(axis=0) for mem in members])
+    logger.info(f"🧩 Cluster decomposition: {n} stops into {k} clusters")
+
+    # 1) Cluster visiting order on straight-line centroid distances
+    first = int(labels[start_index])
+    last = int(labels[end_index]) if end_index is not None and end_index != start_index else None
+    centroid_dist = np.sqrt(((centroids[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2))
+    cluster_order = solve_open_path(centroid_dist, first, last) if k > 1 else [first]
+
+    # 2) Boundary stops between consecutive clusters, fetched concurrently
+    def boundary(pair: int) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], bool]:
+        a, b = cluster_order[pair], cluster_order[pair + 1]
+        exits = _closest_members(latlon, members[a], centroids_latlon[b], CLUSTER_BOUNDARY_CANDIDATES)
+        entries = _closest_members(latlon, members[b], centroids_latlon[a], CLUSTER_BOUNDARY_CANDIDATES)
+        block = ors_matrix(api_key, [coords[i] for i in np.concatenate((exits, entries))],
+                           sources=list(range(len(exits))),
+                           destinations=list(range(len(exits), len(exits) + len(entries))))
+        if not block or "distances" not in block:
+            return exits, entries, None, True
+        return exits, entries, _as_cost_matrix(_metric_matrix(block)), bool(block.get("degraded"))
+
+    with ThreadPoolExecutor(max_workers=CLUSTER_FETCH_WORKERS) as io_pool:
+        blocks = list(io_pool.map(boundary, range(k - 1)))
+
+    entry = {first: start_index}
+    exit_of: Dict[int, Optional[int]] = {cluster_order[-1]: end_index if last is not None else None}
+    degraded = any(block[3] for block in blocks)
+    for pair, (exits, entries, costs, _) in enumerate(blocks):
+        a, b = cluster_order[pair], cluster_order[pair + 1]
+        if costs is None:
+            # Provider failed for this block: fall back to straight-line distance
+            costs = np.sqrt(((points[exits][:, None, :] - points[entries][None, :, :]) ** 2).sum(axis=2))
+        costs = costs.copy()
+        if len(members[a]) > 1:
+            costs[exits == entry[a], :] = np.inf
+        if b == last and len(members[b]) > 1:
+            costs[:, entries == end_index] = np.inf
+        r, c = np.unravel_index(int(np.argmin(costs)), costs.shape)
+        exit_of[a] = int(exits[r])
+        entry[b] = int(entries[c])
+
+    # 3) Route every cluster from entry to exit; matrices fetched concurrently, solves in parallel
+    def cluster_matrix(c: int) -> Tuple[Optional[np.ndarray], bool]:
+        if len(members[c]) == 1:
+            return np.zeros((1, 1)), False
+        result = ors_matrix(api_key, [coords[i] for i in members[c]])
+        if not result or "distances" not in result:
+            return None, True
+        return _as_cost_matrix(_metric_matrix(result)), bool(result.get("degraded"))
+
+    with ThreadPoolExecutor(max_workers=CLUSTER_FETCH_WORKERS) as io_pool:
+        fetched = list(io_pool.map(cluster_matrix, cluster_order))
+    matrices = [m for m, _ in fetched]
+    degraded = degraded or any(d for _, d in fetched)
+    if any(m is None for m in matrices):
+        logger.warning("Cluster matrix fetch failed; cannot build decomposed route")
         return None
 
-def ors_matrix(api_key: str, coords_latlon: List[Tuple[float, float]]) -> Optional[Dict[str, Any]]:
-    # ORS expects [lon, lat]
-    locations = [[lon, lat] for (lat, lon) in coords_latlon]
-    headers = {"Authorization": api_key, "Content-Type": "application/json"}
-    body = {"locations": locations, "metrics": ["distance", "duration"], "units": "km"}
-    try:
-        resp = requests.post(ORS_MATRIX_URL, json=body, headers=headers, timeout=30)
-        if resp.status_code != 200:
-            logger.warning(f"ORS matrix non-200: {resp.status_code} {resp.text[:200]}")
+    tasks = []
+    for c, m in zip(cluster_order, matrices):
+        local = {int(g): i for i, g in enumerate(members[c])}
+        exit_index = exit_of.get(c)
+        tasks.append((m, local[entry[c]], local[exit_index] if exit_index is not None else None))
+    paths = None
+    if MULTISTART_WORKERS > 1 and k > 1:
+        try:
+            pool = _get_optimizer_pool()
+            paths = [f.result() for f in [pool.submit(_solve_cluster_path, *task) for task in tasks]]
+        except BrokenProcessPool as e:
+            logger.warning(f"Optimizer pool broke ({e}); solving clusters in-process")
+            _reset_optimizer_pool()
+    if paths is None:
+        paths = [_solve_cluster_path(*task) for task in tasks]
+
+    order: List[int] = []
+    for c, path in zip(cluster_order, paths):
+        order.extend(int(members[c][i]) for i in path)
+    if degraded:
+        logger.warning("Cluster decomposition used estimated travel times for some blocks")
+    return order, degraded
+
+# --- Fleet Routing (VRP) ---
+FLEET_LOCAL_SEARCH_ROUNDS = int(os.environ.get("FLEET_LOCAL_SEARCH_ROUNDS", "50"))
+
+def _fleet_schedule(T: np.ndarray, depot: int, route: List[int], stops: Dict[int, Any],
+                    capacity: Optional[float], shift_minutes: Optional[float]) -> Optional[float]:
+    """Finish time (minutes after shift start) of an open route, or None if it breaks
+    capacity, shift length or a stop's time window. Early arrivals wait."""
+    t = 0.0
+    load = 0.0
+    prev = depot
+    for s in route:
+        stop = stops[s]
+        load += stop.demand
+        t += T[prev, s]
+        if stop.time_window_start_minutes is not None and t < stop.time_window_start_minutes:
+            t = stop.time_window_start_minutes
+        if stop.time_window_end_minutes is not None and t > stop.time_window_end_minutes + 1e-9:
             return None
-        return resp.json()
-    except Exception as e:
-        logger.error(f"ORS matrix error: {e}")
+        t += stop.service_minutes
+        prev = s
+    if capacity is not None and load > capacity + 1e-9:
+        return None
+    if shift_minutes is not None and t > shift_minutes + 1e-9:
+        return None
+    return t
+
+def _fleet_slack(T: np.ndarray, depot: int, route: List[int], stops: Dict[int, Any],
+                 capacity: Optional[float], shift_minutes: Optional[float]) -> Optional[Tuple[List[float], List[float], List[float], float]]:
+    """Schedule of a feasible route prepared for O(1) insertion and removal checks, or None.
+
+    Returns (dep, arr, slack, load): dep[i] is the departure from the i-th node
+    counting the depot as node 0, arr[i] the arrival at route[i] and slack[i]
+    how much later route[i] may be reached without breaking its own or a later
+    time window or the shift; slack[len(route)] is the shift's spare time.
+    Waiting for a window to open absorbs part of any delay.
+    """
+    dep = [0.0]
+    arr: List[float] = []
+    starts: List[float] = []
+    load = 0.0
+    prev = depot
+    for s in route:
+        stop = stops[s]
+        load += stop.demand
+        a = dep[-1] + T[prev, s]
+        start = a
+        if stop.time_window_start_minutes is not None and start < stop.time_window_start_minutes:
+            start = stop.time_window_start_minutes
+        if stop.time_window_end_minutes is not None and start > stop.time_window_end_minutes + 1e-9:
+            return None
+        arr.append(a)
+        starts.append(start)
+        dep.append(start + stop.service_minutes)
+        prev = s
+    if capacity is not None and load > capacity + 1e-9:
+        return None
+    if shift_minutes is not None and dep[-1] > shift_minutes + 1e-9:
         return None
+    slack = [float("inf")] * (len(route) + 1)
+    if shift_minutes is not None:
+        slack[-1] = shift_minutes - dep[-1]
+    for i in range(len(route) - 1, -1, -1):
+        end = stops[route[i]].time_window_end_minutes
+        own = float("inf") if end is None else end - starts[i]
+        slack[i] = (starts[i] - arr[i]) + min(own, slack[i + 1])
+    return dep, arr, slack, load
+
+def _can_insert(T: np.ndarray, depot: int, route: List[int], sched: Tuple[List[float], List[float], List[float], float],
+                pos: int, s: int, stops: Dict[int, Any], capacity: Optional[float]) -> bool:
+    """Whether inserting s before route[pos] keeps the route feasible, given _fleet_slack(route)."""
+    dep, arr, slack, load = sched
+    stop = stops[s]
+    if capacity is not None and load + stop.demand > capacity + 1e-9:
+        return False
+    prev = route[pos - 1] if pos > 0 else depot
+    start = dep[pos] + T[prev, s]
+    if stop.time_window_start_minutes is not None and start < stop.time_window_start_minutes:
+        start = stop.time_window_start_minutes
+    if stop.time_window_end_minutes is not None and start > stop.time_window_end_minutes + 1e-9:
+        return False
+    leave = start + stop.service_minutes
+    delay = leave + T[s, route[pos]] - arr[pos] if pos < len(route) else leave - dep[pos]
+    return delay <= slack[pos] + 1e-9
+
+def _can_remove(T: np.ndarray, depot: int, route: List[int],
+                sched: Tuple[List[float], List[float], List[float], float], pos: int) -> bool:
+    """Whether dropping route[pos] keeps the route feasible (only a non-metric matrix can break it)."""
+    dep, arr, slack, _ = sched
+    if pos + 1 == len(route):
+        return True
+    prev = route[pos - 1] if pos > 0 else depot
+    return dep[pos] + T[prev, route[pos + 1]] - arr[pos + 1] <= slack[pos + 1] + 1e-9
+
+def _insertion_deltas(T: np.ndarray, depot: int, route: List[int], s: int) -> np.ndarray:
+    """Added drive time of inserting s before route[pos], for every pos 0..len(route)."""
+    prev = np.array([depot] + route, dtype=np.intp)
+    deltas = T[prev, s].copy()
+    if route:
+        nxt = np.array(route, dtype=np.intp)
+        deltas[:-1] += T[s, nxt] - T[prev[:-1], nxt]
+    return deltas
+
+def _removal_delta(T: np.ndarray, depot: int, route: List[int], pos: int) -> float:
+    s = route[pos]
+    prev = route[pos - 1] if pos > 0 else depot
+    if pos + 1 < len(route):
+        nxt = route[pos + 1]
+        return T[prev, nxt] - T[prev, s] - T[s, nxt]
+    return -T[prev, s]
+
+def _savings_routes(T: np.ndarray, depot: int, group: List[int], stops: Dict[int, Any],
+                    capacity: Optional[float], shift_minutes: Optional[float]) -> List[List[int]]:
+    """Clarke-Wright savings for open routes from one depot.
+
+    Joining a route ending at i to a route starting at j saves T[depot, j] - T[i, j];
+    joins are taken in order of saving while the merged route stays feasible.
+    """
+    routes: Dict[int, List[int]] = {s: [s] for s in group}
+    route_of = {s: s for s in group}
+    savings = sorted(((T[depot, j] - T[i, j], i, j) for i in group for j in group if i != j), reverse=True)
+    for saving, i, j in savings:
+        if saving <= 0:
+            break
+        ri, rj = route_of[i], route_of[j]
+        if ri == rj or routes[ri][-1] != i or routes[rj][0] != j:
+            continue
+        merged = routes[ri] + routes[rj]
+        if _fleet_schedule(T, depot, merged, stops, capacity, shift_minutes) is None:
+            continue
+        routes[ri] = merged
+        del routes[rj]
+        for s in merged:
+            route_of[s] = ri
+    return list(routes.values())
+
+def solve_fleet(T: np.ndarray, vehicle_depots: List[int], vehicles: List[Any],
+                stops: Dict[int, Any]) -> Tuple[List[List[int]], List[int]]:
+    """Assign and sequence stops over a fleet sharing one duration matrix (minutes).
 
-def nearest_neighbor_order(matrix_dist: List[List[float]], start_index: int = 0) -> List[int]:
-    n = len(matrix_dist)
-    visited = [False] * n
-    order = [start_index]
-    visited[start_index] = True
-    current = start_index
-    for _ in range(n - 1):
-        next_idx = None
-        next_cost = float("inf")
-        for j in range(n):
-            if not visited[j] and matrix_dist[current][j] is not None:
-                if matrix_dist[current][j] < next_cost:
-                    next_cost = matrix_dist[current][j]
-                    next_idx = j
-        if next_idx is None:
-            # Fallback: pick any unvisited
-            for j in range(n):
-                if not visited[j]:
-                    next_idx = j
+    Stops are grouped by nearest depot and built into routes with the savings
+    heuristic, routes are handed to that depot's vehicles (largest first) and an
+    inter-route relocate search then moves single stops between (or within)
+    routes while it lowers total drive time. Every route keeps a slack schedule
+    (_fleet_slack), so each relocate candidate is checked in O(1) and only the
+    routes a move changes are rescheduled. Stops no vehicle can take are
+    returned as unassigned.
+    """
+    depots = sorted(set(vehicle_depots))
+    stop_nodes = list(stops)
+    routes: List[List[int]] = [[] for _ in vehicles]
+    pool: List[int] = []
+    nearest_depot = {s: min(depots, key=lambda d: T[d, s]) for s in stop_nodes}
+    for depot in depots:
+        group = [s for s in stop_nodes if nearest_depot[s] == depot]
+        fleet = sorted((v for v in range(len(vehicles)) if vehicle_depots[v] == depot),
+                       key=lambda v: vehicles[v].capacity if vehicles[v].capacity is not None else float("inf"),
+                       reverse=True)
+        if not group:
+            continue
+        capacity = None if any(vehicles[v].capacity is None for v in fleet) else max(vehicles[v].capacity for v in fleet)
+        shift = None if any(vehicles[v].shift_minutes is None for v in fleet) else max(vehicles[v].shift_minutes for v in fleet)
+        candidates = _savings_routes(T, depot, group, stops, capacity, shift)
+        candidates.sort(key=lambda r: sum(stops[s].demand for s in r), reverse=True)
+        free = list(fleet)
+        for route in candidates:
+            for v in free:
+                if _fleet_schedule(T, depot, route, stops, vehicles[v].capacity, vehicles[v].shift_minutes) is not None:
+                    routes[v] = route
+                    free.remove(v)
                     break
-        order.append(next_idx)  # type: ignore
-        visited[next_idx] = True  # type: ignore
-        current = next_idx  # type: ignore
-    return order
+            else:
+                pool.extend(route)
 
-def _route_cost(matrix_dist: List[List[float]], order: List[int]) -> float:
-    total = 0.0
-    for i in range(len(order) - 1):
-        total += float(matrix_dist[order[i]][order[i + 1]])
-    return total
+    def schedule(v: int, route: List[int]) -> Optional[Tuple[List[float], List[float], List[float], float]]:
+        return _fleet_slack(T, vehicle_depots[v], route, stops, vehicles[v].capacity, vehicles[v].shift_minutes)
 
-def two_opt_improvement(matrix_dist: List[List[float]], order: List[int], max_iterations: int = 200) -> List[int]:
-    """Simple 2-opt local search to improve a given route order.
-    Keeps first and last nodes fixed; improves internal sequence for lower total distance.
-    """
-    if len(order) <= 3:
-        return order
-    best = order[:]
-    best_cost = _route_cost(matrix_dist, best)
-    n = len(order)
-    iterations = 0
-    improved = True
-    while improved and iterations < max_iterations:
-        improved = False
-        iterations += 1
-        # Do not swap the very first index to preserve start
-        for i in range(1, n - 2):
-            for k in range(i + 1, n - 1):
-                # Create new order by reversing the segment [i:k]
-                new_order = best[:i] + list(reversed(best[i:k + 1])) + best[k + 1:]
-                new_cost = _route_cost(matrix_dist, new_order)
-                if new_cost + 1e-9 < best_cost:
-                    best = new_order
-                    best_cost = new_cost
-                    improved = True
-        # loop again if improved
-    return best
+    def can_insert(v: int, route: List[int], sched: Any, pos: int, s: int) -> bool:
+        return _can_insert(T, vehicle_depots[v], route, sched, pos, s, stops, vehicles[v].capacity)
 
-def _nearest_neighbor_with_start(matrix: List[List[float]], start_index: int) -> List[int]:
-    return nearest_neighbor_order(matrix, start_index)
+    scheds = [schedule(v, route) for v, route in enumerate(routes)]
 
-def build_best_order_multistart(matrix: List[List[float]], prefer_start: int = 0) -> List[int]:
-    """Always start from the preferred start point and optimize from there."""
-    n = len(matrix)
-    if n <= 1:
-        return list(range(n))
-    
-    # For delivery routes, use simple sequential order starting from current location
-    # This ensures we visit all stops in the order they were added
-    if prefer_start == 0:
-        # If starting from current location (index 0), use sequential order
-        order = list(range(n))
-        logger.info(f"📍 Using sequential delivery order: {order}")
-    else:
-        # For other cases, use nearest neighbor with 2-opt
-        order = _nearest_neighbor_with_start(matrix, prefer_start)
-        order = two_opt_improvement(matrix, order)
-        logger.info(f"📍 Using optimized order: {order}")
-    
-    return order
+    def insert_pool() -> None:
+        for s in sorted(pool, key=lambda s: stops[s].demand, reverse=True):
+            best = None
+            for v, route in enumerate(routes):
+                deltas = _insertion_deltas(T, vehicle_depots[v], route, s)
+                for pos in np.argsort(deltas, kind="stable"):
+                    if best is not None and deltas[pos] >= best[0]:
+                        break
+                    if can_insert(v, route, scheds[v], int(pos), s):
+                        best = (float(deltas[pos]), v, int(pos))
+                        break
+            if best is not None:
+                _, v, pos = best
+                routes[v].insert(pos, s)
+                scheds[v] = schedule(v, routes[v])
+                pool.remove(s)
+
+    insert_pool()
+    for _ in range(FLEET_LOCAL_SEARCH_ROUNDS):
+        improved = False
+        for a in range(len(routes)):
+            pos = 0
+            while pos < len(routes[a]):
+                s = routes[a][pos]
+                removal = _removal_delta(T, vehicle_depots[a], routes[a], pos)
+                shortened = routes[a][:pos] + routes[a][pos + 1:]
+                removable = _can_remove(T, vehicle_depots[a], routes[a], scheds[a], pos)
+                shortened_sched = schedule(a, shortened) if removable else None
+                best = None
+                for b in range(len(routes)):
+                    if b != a and not removable:
+                        continue
+                    target = shortened if b == a else routes[b]
+                    deltas = removal + _insertion_deltas(T, vehicle_depots[b], target, s)
+                    if b == a:
+                        deltas[pos] = np.inf  # putting s back where it was
+                    improving = np.flatnonzero(deltas < -IMPROVEMENT_EPSILON)
+                    # Cheapest first: the first feasible candidate is this route's best move
+                    for q in improving[np.argsort(deltas[improving], kind="stable")]:
+                        q = int(q)
+                        if best is not None and deltas[q] >= best[0]:
+                            break
+                        if b == a and shortened_sched is None:
+                            ok = schedule(a, target[:q] + [s] + target[q:]) is not None
+                        else:
+                            ok = can_insert(b, target, shortened_sched if b == a else scheds[b], q, s)
+                        if ok:
+                            best = (float(deltas[q]), b, q)
+                            break
+                if best is None:
+                    pos += 1
+                    continue
+                _, b, q = best
+                target = shortened if b == a else routes[b]
+                if b != a:
+                    routes[a] = shortened
+                    scheds[a] = shortened_sched
+                routes[b] = target[:q] + [s] + target[q:]
+                scheds[b] = schedule(b, routes[b])
+                improved = True
+        if pool:
+            insert_pool()
+        if not improved:
+            break
+    return routes, pool
 
 def get_traffic_multiplier(lat: float, lon: float, time_of_day: str = None) -> float:
     """Get traffic multiplier based on location and time."""
@@ -649,11 +2661,13 @@ def get_real_time_traffic_data(lat: float, lon: float) -> Optional[Dict[str, Any
         return None
 
 def ors_directions(api_key: str, coords_latlon_ordered: List[Tuple[float, float]]) -> Optional[Dict[str, Any]]:
+    if road_graph is not None:
+        return road_graph.directions(coords_latlon_ordered)
     coordinates = [[lon, lat] for (lat, lon) in coords_latlon_ordered]
     headers = {"Authorization": api_key, "Content-Type": "application/json"}
     body = {"coordinates": coordinates, "units": "km"}
     try:
-        resp = requests.post(ORS_DIRECTIONS_URL, json=body, headers=headers, timeout=45)
+        resp = provider_request_blocking("POST", ORS_DIRECTIONS_URL, json=body, headers=headers, timeout=45)
         if resp.status_code != 200:
             logger.warning(f"ORS directions non-200: {resp.status_code} {resp.text[:200]}")
             return None
@@ -726,10 +2740,14 @@ def read_root():
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
+    active_model = eta_registry.active
     return {
         "status": "healthy",
         "ocr_model_loaded": ocr_model is not None,
-        "ml_models_loaded": eta_model is not None and model_columns is not None
+        "ml_models_loaded": active_model is not None,
+        "eta_model_version": active_model.version if active_model else None,
+        "provider_usage": run_provider_coroutine(_provider_usage_today()),
+        "geocode_cache": dict(geocode_cache_stats),
     }
 
 @app.post("/ocr/extract-text")
@@ -896,30 +2914,69 @@ async def minimal_ocr_test(image: UploadFile = File(...)):
             os.remove(temp_file)
 
 @app.post("/predict-eta")
-def predict_eta(data: RouteData):
-    if eta_model is None or model_columns is None:
+async def predict_eta(data: RouteData):
+    if eta_registry.active is None:
         return {"error": "ML models not loaded"}
     
-    input_df = pd.DataFrame([data.dict()])
-    input_df['start_time'] = pd.to_datetime(input_df['start_time'])
-    hour = input_df['start_time'].dt.hour
+    output = await predict_eta_coalesced(_eta_record(data))
+
+    return {"predicted_eta_minutes": round(output, 2)}
 
-    def get_time_of_day(hour):
-        if 6 <= hour < 11: return 'Morning'
-        elif 11 <= hour < 17: return 'Afternoon'
-        elif 17 <= hour < 21: return 'Evening_Rush'
-        else: return 'Night'
+@app.post("/predict-eta/batch")
+async def predict_eta_batch(req: EtaBatchRequest):
+    """ETAs for many routes in one vectorized model call, in request order."""
+    if eta_registry.active is None:
+        return {"error": "ML models not loaded"}
+    if not req.routes:
+        return {"predicted_eta_minutes": []}
 
-    input_df['time_of_day'] = hour.apply(get_time_of_day)
-    input_df['day_of_week'] = input_df['start_time'].dt.dayofweek.apply(lambda x: 'Weekday' if x < 5 else 'Weekend')
-    input_df = input_df.drop('start_time', axis=1)
-    input_df = pd.get_dummies(input_df)
-    input_df = input_df.reindex(columns=model_columns, fill_value=0)
+    minutes = await run_in_threadpool(predict_eta_minutes, [_eta_record(route) for route in req.routes])
+    return {"predicted_eta_minutes": [round(m, 2) for m in minutes.tolist()]}
 
-    prediction = eta_model.predict(input_df)
-    output = float(prediction[0])
+def _require_model_admin(token: Optional[str]) -> None:
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model administration is disabled (MODEL_ADMIN_TOKEN not set)")
+    if not token or not secrets.compare_digest(token, MODEL_ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
 
-    return {"predicted_eta_minutes": round(output, 2)}
+@app.get("/models")
+def list_models():
+    """Registry versions with their metrics, and which one is serving."""
+    active, previous = eta_registry.active, eta_registry.previous
+    versions = []
+    for version in _registry_versions():
+        try:
+            with open(os.path.join(MODEL_REGISTRY_DIR, version, "metrics.json")) as f:
+                metrics = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            metrics = {}
+        versions.append({"version": version, "metrics": metrics})
+    return {
+        "active": {"version": active.version, "loaded_at": active.loaded_at, "metrics": active.metrics} if active else None,
+        "previous": previous.version if previous else None,
+        "versions": versions,
+        "last_error": eta_registry.last_error,
+    }
+
+@app.post("/models/{version}/activate")
+async def activate_model(version: str, x_admin_token: Optional[str] = Header(None)):
+    _require_model_admin(x_admin_token)
+    try:
+        loaded = await run_in_threadpool(eta_registry.activate, version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model version: {version}")
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Model {version} failed to load: {e}")
+    return {"active": loaded.version}
+
+@app.post("/models/rollback")
+def rollback_model(x_admin_token: Optional[str] = Header(None)):
+    _require_model_admin(x_admin_token)
+    try:
+        restored = eta_registry.rollback()
+    except LookupError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"active": restored.version}
 
 @app.post("/log-completed-route")
 def log_route(route: CompletedRoute):
@@ -940,76 +2997,325 @@ def log_route(route: CompletedRoute):
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+# --- Nearby Places Tile Cache ---
+# Overpass results are cached per geohash tile (memory LRU + SQLite, with TTL). A lookup
+# scans the tiles covering its radius; tiles not cached yet are filled by one Overpass
+# bounding-box query, so each /nearby-places call costs at most one upstream request.
+OVERPASS_URL = "http://overpass-api.de/api/interpreter"
+NEARBY_AMENITIES = ("restaurant", "hospital", "school", "university", "bank", "fuel", "parking",
+                    "pharmacy", "post_office", "police", "fire_station")
+NEARBY_TILE_PRECISION = int(os.environ.get("NEARBY_TILE_PRECISION", "5"))  # ~4.9 km x 4.9 km
+NEARBY_TILE_TTL_SECONDS = int(os.environ.get("NEARBY_TILE_TTL_SECONDS", str(7 * 24 * 3600)))
+NEARBY_TILE_CACHE_MAX = int(os.environ.get("NEARBY_TILE_CACHE_MAX", "2000"))
+NEARBY_MAX_RADIUS_M = int(os.environ.get("NEARBY_MAX_RADIUS_M", "10000"))
+NEARBY_RESULT_LIMIT = 10
+NEARBY_TILE_DB = os.environ.get("NEARBY_TILE_DB", "db/nearby_tiles.db")
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_nearby_tiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_nearby_tiles_lock = threading.Lock()
+
+def init_nearby_tile_db():
+    os.makedirs(os.path.dirname(NEARBY_TILE_DB) or '.', exist_ok=True)
+    conn = sqlite3.connect(NEARBY_TILE_DB)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS overpass_tiles (
+            geohash TEXT PRIMARY KEY,
+            fetched_at REAL NOT NULL,
+            places TEXT NOT NULL
+        )
+    ''')
+    conn.commit()
+    conn.close()
+    logger.info("Nearby tile cache database initialized")
+
+init_nearby_tile_db()
+
+def geohash_encode(lat: float, lon: float, precision: int) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+def geohash_bbox(geohash: str) -> Tuple[float, float, float, float]:
+    """(south, west, north, east) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for ch in geohash:
+        value = _GEOHASH_BASE32.index(ch)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+def _covering_geohashes(lat: float, lon: float, radius_m: float, precision: int) -> List[str]:
+    south, west, north, east = geohash_bbox(geohash_encode(lat, lon, precision))
+    cell_h, cell_w = north - south, east - west
+    dlat = radius_m / 1000.0 / 110.57
+    dlon = radius_m / 1000.0 / (111.32 * max(math.cos(math.radians(lat)), 1e-6))
+    lats = np.arange(lat - dlat, lat + dlat + cell_h, cell_h)
+    lons = np.arange(lon - dlon, lon + dlon + cell_w, cell_w)
+    return sorted({geohash_encode(float(min(a, lat + dlat)), float(min(b, lon + dlon)), precision)
+                   for a in lats for b in lons})
+
+def _tile_entry(places: List[Dict[str, Any]], fetched_at: float) -> Dict[str, Any]:
+    return {
+        "fetched_at": fetched_at,
+        "lat": np.array([p["lat"] for p in places], dtype=float),
+        "lon": np.array([p["lon"] for p in places], dtype=float),
+        "places": places,
+    }
+
+def _remember_tile(geohash: str, entry: Dict[str, Any]) -> None:
+    with _nearby_tiles_lock:
+        _nearby_tiles[geohash] = entry
+        _nearby_tiles.move_to_end(geohash)
+        while len(_nearby_tiles) > NEARBY_TILE_CACHE_MAX:
+            _nearby_tiles.popitem(last=False)
+
+def _cached_tiles(geohashes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Fresh tiles from memory, then SQLite (promoted to memory)."""
+    now = time.time()
+    found: Dict[str, Dict[str, Any]] = {}
+    with _nearby_tiles_lock:
+        for gh in geohashes:
+            entry = _nearby_tiles.get(gh)
+            if entry is not None and now - entry["fetched_at"] <= NEARBY_TILE_TTL_SECONDS:
+                _nearby_tiles.move_to_end(gh)
+                found[gh] = entry
+    missing = [gh for gh in geohashes if gh not in found]
+    if missing:
+        try:
+            conn = sqlite3.connect(NEARBY_TILE_DB, timeout=10)
+            rows = conn.execute(
+                f"SELECT geohash, fetched_at, places FROM overpass_tiles WHERE geohash IN ({','.join('?' * len(missing))}) "
+                f"AND fetched_at >= ?", (*missing, now - NEARBY_TILE_TTL_SECONDS)).fetchall()
+            conn.close()
+            for gh, fetched_at, places in rows:
+                found[gh] = _tile_entry(json.loads(places), fetched_at)
+                _remember_tile(gh, found[gh])
+        except Exception as e:
+            logger.warning(f"Nearby tile cache read failed: {e}")
+    return found
+
+def _overpass_places(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    places = []
+    for element in data.get("elements", []):
+        tags = element.get("tags", {})
+        name = tags.get("name", "Unknown")
+        amenity = tags.get("amenity", "")
+
+        # Get coordinates
+        if element["type"] == "node":
+            place_lat = element["lat"]
+            place_lon = element["lon"]
+        else:
+            # For ways and relations, use center
+            center = element.get("center", {})
+            place_lat = center.get("lat")
+            place_lon = center.get("lon")
+
+        if place_lat and place_lon and name != "Unknown":
+            places.append({
+                "name": name,
+                "amenity": amenity,
+                "lat": place_lat,
+                "lon": place_lon,
+                "display_name": f"{name} ({amenity.replace('_', ' ').title()})"
+            })
+    return places
+
+def _persist_tiles(by_tile: Dict[str, List[Dict[str, Any]]], fetched_at: float) -> None:
+    try:
+        conn = sqlite3.connect(NEARBY_TILE_DB, timeout=10)
+        conn.executemany("INSERT OR REPLACE INTO overpass_tiles (geohash, fetched_at, places) VALUES (?, ?, ?)",
+                         [(gh, fetched_at, json.dumps(places)) for gh, places in by_tile.items()])
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        logger.warning(f"Nearby tile cache write failed: {e}")
+
+async def _fetch_tiles(geohashes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """One Overpass query over the bounding box of the given tiles, split back per tile.
+
+    The tiles are remembered in memory on the loop; the SQLite write runs in a worker thread.
+    """
+    boxes = [geohash_bbox(gh) for gh in geohashes]
+    south, west = min(b[0] for b in boxes), min(b[1] for b in boxes)
+    north, east = max(b[2] for b in boxes), max(b[3] for b in boxes)
+    amenity = f'["amenity"~"^({"|".join(NEARBY_AMENITIES)})$"]({south},{west},{north},{east})'
+    query = f"""
+    [out:json][timeout:25];
+    (
+      node{amenity};
+      way{amenity};
+      relation{amenity};
+    );
+    out center;
+    """
+    response = await provider_request("POST", OVERPASS_URL, content=query, timeout=30)
+    if response.status_code != 200:
+        raise RuntimeError(f"Overpass API error: {response.status_code}")
+    by_tile: Dict[str, List[Dict[str, Any]]] = {gh: [] for gh in geohashes}
+    for place in _overpass_places(response.json()):
+        gh = geohash_encode(place["lat"], place["lon"], NEARBY_TILE_PRECISION)
+        if gh in by_tile:
+            by_tile[gh].append(place)
+    now = time.time()
+    tiles = {gh: _tile_entry(places, now) for gh, places in by_tile.items()}
+    for gh, entry in tiles.items():
+        _remember_tile(gh, entry)
+    await run_in_threadpool(_persist_tiles, by_tile, now)
+    logger.info(f"🗺️ Overpass filled {len(geohashes)} tiles ({sum(len(p) for p in by_tile.values())} places)")
+    return tiles
+
+def nearest_places(tiles: List[Dict[str, Any]], lat: float, lon: float, radius_m: float,
+                   limit: int = NEARBY_RESULT_LIMIT) -> List[Dict[str, Any]]:
+    """Top-k places within radius across tiles: vectorized haversine + argpartition."""
+    tiles = [t for t in tiles if len(t["places"])]
+    if not tiles:
+        return []
+    lats = np.concatenate([t["lat"] for t in tiles])
+    lons = np.concatenate([t["lon"] for t in tiles])
+    km = haversine_km_matrix([(lat, lon)], np.column_stack((lats, lons)))[0]
+    inside = np.flatnonzero(km <= radius_m / 1000.0)
+    if inside.size > limit:
+        inside = inside[np.argpartition(km[inside], limit)[:limit]]
+    inside = inside[np.argsort(km[inside], kind="stable")]
+    offsets = np.cumsum([0] + [len(t["places"]) for t in tiles])
+    results = []
+    for i in inside.tolist():
+        t = int(np.searchsorted(offsets, i, side="right")) - 1
+        place = dict(tiles[t]["places"][i - offsets[t]])
+        place["distance_km"] = round(float(km[i]), 3)
+        results.append(place)
+    return results
+
+# --- Local POI Store ---
+# Built offline by build_poi_store.py from an OSM extract. Columns are memory-mapped .npy
+# files sorted by integer geohash, so each covering tile is a searchsorted slice and the
+# pages are shared between workers. When present it replaces Overpass entirely.
+POI_STORE_PATH = os.environ.get("POI_STORE_PATH", os.path.join("data", "poi_store"))
+
+def _geohash_int(geohash: str) -> int:
+    value = 0
+    for ch in geohash:
+        value = (value << 5) | _GEOHASH_BASE32.index(ch)
+    return value
+
+class PoiStore:
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.bits = int(meta["geohash_bits"])
+        self.amenities = list(meta["amenities"])
+        column = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+        self.geohash = column("geohash")
+        self.lat = column("lat")
+        self.lon = column("lon")
+        self.amenity = column("amenity")
+        self.name_offsets = column("name_offsets")
+        self.names = column("names")
+
+    def __len__(self) -> int:
+        return int(self.geohash.shape[0])
+
+    def _place(self, i: int) -> Dict[str, Any]:
+        start, end = int(self.name_offsets[i]), int(self.name_offsets[i + 1])
+        name = bytes(self.names[start:end]).decode("utf-8")
+        amenity = self.amenities[int(self.amenity[i])]
+        return {
+            "name": name,
+            "amenity": amenity,
+            "lat": float(self.lat[i]),
+            "lon": float(self.lon[i]),
+            "display_name": f"{name} ({amenity.replace('_', ' ').title()})"
+        }
+
+    def nearby(self, lat: float, lon: float, radius_m: float, limit: int = NEARBY_RESULT_LIMIT) -> List[Dict[str, Any]]:
+        geohashes = _covering_geohashes(lat, lon, radius_m, NEARBY_TILE_PRECISION)
+        shift = self.bits - 5 * NEARBY_TILE_PRECISION
+        cells = np.array([_geohash_int(gh) for gh in geohashes], dtype=np.uint64)
+        starts = np.searchsorted(self.geohash, cells << np.uint64(shift), side="left")
+        ends = np.searchsorted(self.geohash, (cells + np.uint64(1)) << np.uint64(shift), side="left")
+        rows = np.concatenate([np.arange(s, e) for s, e in zip(starts.tolist(), ends.tolist())])
+        if rows.size == 0:
+            return []
+        km = haversine_km_matrix([(lat, lon)], np.column_stack((self.lat[rows], self.lon[rows])))[0]
+        inside = np.flatnonzero(km <= radius_m / 1000.0)
+        if inside.size > limit:
+            inside = inside[np.argpartition(km[inside], limit)[:limit]]
+        inside = inside[np.argsort(km[inside], kind="stable")]
+        results = []
+        for i in inside.tolist():
+            place = self._place(int(rows[i]))
+            place["distance_km"] = round(float(km[i]), 3)
+            results.append(place)
+        return results
+
+poi_store: Optional[PoiStore] = None
+if os.path.exists(os.path.join(POI_STORE_PATH, "meta.json")):
+    try:
+        poi_store = PoiStore(POI_STORE_PATH)
+        logger.info(f"📍 POI store loaded from {POI_STORE_PATH} ({len(poi_store)} places)")
+    except Exception as e:
+        logger.warning(f"Could not load POI store from {POI_STORE_PATH}, using Overpass: {e}")
+
 @app.get("/nearby-places")
-def get_nearby_places(lat: float, lon: float, radius: int = 5000):
+async def get_nearby_places(lat: float, lon: float, radius: int = 5000):
     """Get nearby famous places and landmarks."""
     try:
-        # Use Overpass API (OpenStreetMap) to get nearby places
-        overpass_url = "http://overpass-api.de/api/interpreter"
-        
-        # Query for nearby places of interest
-        query = f"""
-        [out:json][timeout:25];
-        (
-          node["amenity"~"^(restaurant|hospital|school|university|bank|fuel|parking|pharmacy|post_office|police|fire_station)$"](around:{radius},{lat},{lon});
-          way["amenity"~"^(restaurant|hospital|school|university|bank|fuel|parking|pharmacy|post_office|police|fire_station)$"](around:{radius},{lat},{lon});
-          relation["amenity"~"^(restaurant|hospital|school|university|bank|fuel|parking|pharmacy|post_office|police|fire_station)$"](around:{radius},{lat},{lon});
-        );
-        out center;
-        """
-        
-        response = requests.post(overpass_url, data=query, timeout=30)
-        if response.status_code == 200:
-            data = response.json()
-            places = []
-            
-            for element in data.get("elements", []):
-                tags = element.get("tags", {})
-                name = tags.get("name", "Unknown")
-                amenity = tags.get("amenity", "")
-                
-                # Get coordinates
-                if element["type"] == "node":
-                    place_lat = element["lat"]
-                    place_lon = element["lon"]
-                else:
-                    # For ways and relations, use center
-                    center = element.get("center", {})
-                    place_lat = center.get("lat")
-                    place_lon = center.get("lon")
-                
-                if place_lat and place_lon and name != "Unknown":
-                    places.append({
-                        "name": name,
-                        "amenity": amenity,
-                        "lat": place_lat,
-                        "lon": place_lon,
-                        "display_name": f"{name} ({amenity.replace('_', ' ').title()})"
-                    })
-            
-            # Sort by distance and limit results
-            places = sorted(places, key=lambda x: ((x["lat"] - lat)**2 + (x["lon"] - lon)**2)**0.5)[:10]
-            
-            logger.info(f"Found {len(places)} nearby places")
-            return {"places": places}
-        else:
-            logger.warning(f"Overpass API error: {response.status_code}")
-            return {"places": []}
+        radius = min(radius, NEARBY_MAX_RADIUS_M)
+        if poi_store is not None:
+            return {"places": poi_store.nearby(lat, lon, radius)}
+        geohashes = _covering_geohashes(lat, lon, radius, NEARBY_TILE_PRECISION)
+        tiles = await run_in_threadpool(_cached_tiles, geohashes)
+        missing = [gh for gh in geohashes if gh not in tiles]
+        if missing:
+            try:
+                tiles.update(await _fetch_tiles(missing))
+            except Exception as e:
+                # Serve whatever is cached; the missing tiles are retried on the next call
+                logger.warning(f"Could not fill {len(missing)} nearby tiles: {e}")
+        places = nearest_places(list(tiles.values()), lat, lon, radius)
+        logger.info(f"Found {len(places)} nearby places ({len(geohashes) - len(missing)}/{len(geohashes)} tiles cached)")
+        return {"places": places}
             
     except Exception as e:
         logger.error(f"❌ Error getting nearby places: {e}")
         return {"places": []}
 
 @app.get("/search-suggestions")
-def search_suggestions(q: str):
-    """Get search suggestions using ORS geocoding API."""
+async def search_suggestions(q: str):
+    """Get search suggestions from the local index, topped up from the ORS geocoding API."""
     if not q or len(q.strip()) < 2:
         return {"suggestions": []}
     
+    local = autocomplete_index.search(q)
+    if len(local) >= AUTOCOMPLETE_MIN_LOCAL_RESULTS:
+        return {"suggestions": local}
     suggestions = []
     
-    # Try ORS Geocoding API first
-    if ORS_API_KEY:
+    # Try ORS Geocoding API first (unless its circuit is open)
+    if ORS_API_KEY and _ors_geocode_health.allow():
         try:
             url = "https://api.openrouteservice.org/geocode/search"
             headers = {"Authorization": ORS_API_KEY}
@@ -1019,9 +3325,13 @@ def search_suggestions(q: str):
                 "boundary.country": "IN",  # Focus on India
                 "size": 5
             }
-            resp = requests.get(url, params=params, headers=headers, timeout=10)
-            if resp.status_code == 200:
+            started = time.monotonic()
+            resp = await provider_request("GET", url, params=params, headers=headers, timeout=10)
+            if resp.status_code != 200:
+                _ors_geocode_health.record_failure()
+            else:
                 data = resp.json()
+                _ors_geocode_health.record_success(time.monotonic() - started)
                 if data.get("features"):
                     for feature in data["features"]:
                         props = feature.get("properties", {})
@@ -1032,8 +3342,10 @@ def search_suggestions(q: str):
                             "lon": coords[0]
                         })
                     logger.info(f"✅ ORS found {len(suggestions)} suggestions for '{q}'")
-                    return {"suggestions": suggestions}
+                    await run_in_threadpool(remember_suggestions, suggestions)
+                    return {"suggestions": _merge_suggestions(local, suggestions)}
         except Exception as e:
+            _ors_geocode_health.record_failure()
             logger.warning(f"❌ ORS search error for '{q}': {e}")
     
     # Fallback to Nominatim
@@ -1045,7 +3357,7 @@ def search_suggestions(q: str):
             "addressdetails": "1",
             "limit": 5
         }
-        resp = requests.get(NOMINATIM_URL, params=params, headers=headers, timeout=10)
+        resp = await provider_request("GET", NOMINATIM_URL, params=params, headers=headers, timeout=10)
         if resp.status_code == 200:
             data = resp.json()
             for item in data:
@@ -1055,39 +3367,103 @@ def search_suggestions(q: str):
                     "lon": float(item.get("lon", 0))
                 })
             logger.info(f"✅ Nominatim found {len(suggestions)} suggestions for '{q}'")
+            await run_in_threadpool(remember_suggestions, suggestions)
     except Exception as e:
         logger.error(f"❌ Nominatim search error for '{q}': {e}")
     
-    return {"suggestions": suggestions}
+    return {"suggestions": _merge_suggestions(local, suggestions)}
 
-@app.post("/plan-full-route", response_model=PlannedRouteResponse)
-def plan_full_route(req: PlanRouteRequest):
+def _merge_suggestions(local: List[Dict[str, Any]], remote: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Local matches first, then provider results not already listed."""
+    seen = {normalize_address(s["display_name"]) for s in local}
+    merged = list(local)
+    for s in remote:
+        key = normalize_address(s["display_name"])
+        if key not in seen:
+            seen.add(key)
+            merged.append(s)
+    return merged[:AUTOCOMPLETE_LIMIT]
+
+@app.post("/geocode/batch")
+async def geocode_batch(req: GeocodeBatchRequest):
+    """Geocode a list of addresses, streaming one NDJSON line per distinct address.
+
+    Cache hits are written first; misses are resolved concurrently (within the
+    provider gateway's limits) and written as each one finishes. Every line has
+    the address, its positions in the request, a status (ok / not_found / error),
+    lat/lon when found and whether it came from the cache.
+    """
+    positions: Dict[str, List[int]] = {}
+    for i, addr in enumerate(req.addresses):
+        positions.setdefault(addr, []).append(i)
+
+    def line(addr: str, coords: Optional[Tuple[float, float]], cached: bool, error: Optional[str] = None) -> str:
+        item: Dict[str, Any] = {"address": addr, "indices": positions[addr],
+                                "status": "error" if error else ("ok" if coords else "not_found"),
+                                "cached": cached}
+        if coords:
+            item["lat"], item["lon"] = coords
+        if error:
+            item["error"] = error
+        return json.dumps(item) + "\n"
+
+    async def lines():
+        misses = []
+        for addr in positions:
+            key = normalize_address(addr)
+            found, coords = _geocode_lru_get(key)
+            if not found:
+                found, coords = await run_in_threadpool(_geocode_disk_get, key, False)
+            if found:
+                yield line(addr, coords, cached=True)
+            else:
+                misses.append(addr)
+        logger.info(f"📍 Batch geocode: {len(positions)} distinct addresses, {len(misses)} to resolve")
+
+        async def resolve(addr: str):
+            try:
+                coords, definitive = await geocode_address_checked(addr)
+                # No provider could answer (outage, open circuit, quota): not the address's fault
+                return addr, coords, None if definitive else "geocoding providers unavailable"
+            except Exception as e:
+                logger.error(f"❌ Batch geocode failed for '{addr}': {e}")
+                return addr, None, str(e)
+
+        for next_done in asyncio.as_completed([resolve(a) for a in misses]):
+            addr, coords, error = await next_done
+            yield line(addr, coords, cached=False, error=error)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def _empty_plan() -> Dict[str, Any]:
+    return {
+        "ordered_addresses": [],
+        "ordered_coordinates": [],
+        "ors_duration_minutes": 0.0,
+        "total_distance_km": 0.0,
+        "num_stops": 0,
+        "predicted_eta_minutes": None,
+        "route_geometry_geojson": None
+    }
+
+def _prepare_route(req: PlanRouteRequest,
+                   geocoded: Optional[Dict[str, Optional[Tuple[float, float]]]] = None) -> Optional[Dict[str, Any]]:
+    """Geocode the request's addresses, resolve start/end stops and fetch the ORS matrix.
+
+    geocoded, if given, holds already resolved coordinates by address (as built
+    by /plan-batch). Returns None when the plan cannot be built (no addresses,
+    failed geocode, missing key or matrix).
+    """
     # 1) Geocode all addresses
     addresses = req.addresses
     if not addresses or len(addresses) < 1:
-        return {
-            "ordered_addresses": [],
-            "ordered_coordinates": [],
-            "ors_duration_minutes": 0.0,
-            "total_distance_km": 0.0,
-            "num_stops": 0,
-            "predicted_eta_minutes": None,
-            "route_geometry_geojson": None
-        }
+        return None
 
     coords: List[Tuple[float, float]] = []
     for addr in addresses:
-        c = geocode_address(addr)
+        c = geocoded[addr] if geocoded is not None and addr in geocoded else geocode_address(addr)
         if c is None:
-            return {
-                "ordered_addresses": [],
-                "ordered_coordinates": [],
-                "ors_duration_minutes": 0.0,
-                "total_distance_km": 0.0,
-                "num_stops": 0,
-                "predicted_eta_minutes": None,
-                "route_geometry_geojson": None
-            }
+            return None
         coords.append(c)
 
     # Find the start index (current location should be first)
@@ -1098,55 +3474,89 @@ def plan_full_route(req: PlanRouteRequest):
     else:
         logger.info("Using first address as start point")
 
+    end_index = None
+    if req.vehicle_end_address and req.vehicle_end_address in addresses:
+        end_index = addresses.index(req.vehicle_end_address)
+        logger.info(f"Found vehicle end address at index {end_index}")
+
     # 2) Build ordering using ORS matrix (nearest neighbor heuristic)
     # Prefer in-code key; fallback to environment
     ors_key = ORS_API_KEY or os.environ.get("ORS_API_KEY", "")
     if not ors_key:
         logger.warning("ORS_API_KEY not set; route planning will fail")
-        return {
-            "ordered_addresses": [],
-            "ordered_coordinates": [],
-            "ors_duration_minutes": 0.0,
-            "total_distance_km": 0.0,
-            "num_stops": 0,
-            "predicted_eta_minutes": None,
-            "route_geometry_geojson": None
-        }
+        return None
 
-    matrix = ors_matrix(ors_key, coords)
-    if matrix is None or "distances" not in matrix:
-        return {
-            "ordered_addresses": [],
-            "ordered_coordinates": [],
-            "ors_duration_minutes": 0.0,
-            "total_distance_km": 0.0,
-            "num_stops": 0,
-            "predicted_eta_minutes": None,
-            "route_geometry_geojson": None
-        }
+    if len(coords) >= CLUSTER_DECOMPOSITION_MIN_STOPS:
+        # Decomposed plans fetch per-cluster matrices instead of one N x N matrix
+        matrix = None
+    else:
+        matrix = ors_matrix(ors_key, coords)
+        if matrix is None or "distances" not in matrix:
+            return None
+
+    return {
+        "addresses": addresses,
+        "coords": coords,
+        "start_index": start_index,
+        "end_index": end_index,
+        "matrix": matrix,
+        "ors_key": ors_key,
+    }
+
+def _order_stops(prepared: Dict[str, Any], time_budget_ms: Optional[int] = None,
+                 on_improvement: Optional[Callable[[List[int], float], None]] = None) -> Optional[List[int]]:
+    """Visiting order for a prepared route; with a time budget the anytime optimizer is used.
+
+    Very large routes (no full matrix prepared) use the cluster decomposition.
+    """
+    addresses = prepared["addresses"]
+    start_index = prepared["start_index"]
+    end_index = prepared["end_index"]
+    matrix = prepared["matrix"]
 
     # For delivery routes, use original order (no optimization)
     # This ensures we visit stops in the order they were added
     if start_index == 0:
         # Sequential delivery order: Current → Stop 1 → Stop 2 → Stop 3
         order_idx = list(range(len(addresses)))
-        ordered_addresses = addresses.copy()
-        ordered_coords = coords.copy()
+        if end_index is not None and end_index != start_index:
+            order_idx.remove(end_index)
+            order_idx.append(end_index)
         logger.info(f"📍 Using sequential delivery order (no optimization):")
         logger.info(f"  Order: {order_idx}")
-        logger.info(f"  Addresses: {ordered_addresses}")
-        logger.info(f"  Coordinates: {ordered_coords}")
+        if on_improvement and matrix is not None:
+            on_improvement(order_idx, _route_cost(_metric_matrix(matrix), order_idx))
+    elif matrix is None:
+        decomposed = cluster_first_order(prepared["ors_key"], prepared["coords"], start_index, end_index)
+        if decomposed is None:
+            return None
+        order_idx, prepared["degraded"] = decomposed
+        logger.info(f"📍 Using cluster-first decomposition over {len(addresses)} stops")
     else:
         # Use matrix-based optimization for other cases
-        matrix_dist = matrix.get("durations") or matrix.get("distances")
-        order_idx = build_best_order_multistart(matrix_dist, start_index)
-        ordered_addresses = [addresses[i] for i in order_idx]
-        ordered_coords = [coords[i] for i in order_idx]
+        matrix_dist = _metric_matrix(matrix)
+        if time_budget_ms:
+            order_idx = anytime_optimize(matrix_dist, start_index, end_index, time_budget_ms, on_improvement)
+        else:
+            order_idx = build_best_order_multistart(matrix_dist, start_index, end_index)
+            if on_improvement:
+                on_improvement(order_idx, _route_cost(matrix_dist, order_idx))
         logger.info(f"📍 Using matrix-based optimization:")
         logger.info(f"  Original order: {list(range(len(addresses)))}")
         logger.info(f"  Optimized order: {order_idx}")
-        logger.info(f"  Addresses: {ordered_addresses}")
-        logger.info(f"  Coordinates: {ordered_coords}")
+    return order_idx
+
+def _finalize_plan(start_time: Optional[str], ordered_addresses: List[str],
+                   ordered_coords: List[Tuple[float, float]], ors_key: str,
+                   leg_metrics: Optional[List[Tuple[float, float]]] = None) -> Dict[str, Any]:
+    """Leg durations, route geometry and ML ETA for an ordered list of stops.
+
+    Needs a single ORS directions call: per-leg distance/duration come from its
+    segments, or from leg_metrics ((km, seconds) per leg, e.g. from the
+    matrix) when the directions request fails.
+    """
+    logger.info(f"  Addresses: {ordered_addresses}")
+    logger.info(f"  Coordinates: {ordered_coords}")
 
     # 3) Calculate proper multi-stop route duration
     num_stops = len(ordered_addresses)
@@ -1165,65 +3575,74 @@ def plan_full_route(req: PlanRouteRequest):
         total_segment_duration = 0.0
         total_segment_distance = 0.0
         
-        for i in range(num_stops - 1):
+        # Get the full route geometry for display (from start to end). Its
+        # per-leg segments give each leg's distance/duration in the same call.
+        directions = ors_directions(ors_key, ordered_coords)
+        segments: List[Dict[str, Any]] = []
+        if directions and "features" in directions and len(directions["features"]) > 0:
+            route_geojson = directions["features"][0]
+            segments = route_geojson.get("properties", {}).get("segments", [])
+        if len(segments) == num_stops - 1:
+            legs = [(float(s.get("distance", 0.0)), float(s.get("duration", 0.0))) for s in segments]
+        elif leg_metrics is not None:
+            logger.info("  Directions segments unavailable; using matrix leg metrics")
+            legs = leg_metrics
+        else:
+            logger.warning("  Failed to get per-leg metrics for route")
+            legs = []
+        
+        for i, (segment_distance, segment_seconds) in enumerate(legs):
             start_coord = ordered_coords[i]
             end_coord = ordered_coords[i + 1]
+            segment_duration = segment_seconds / 60.0  # Convert to minutes
             
-            # Get directions for this segment
-            segment_directions = ors_directions(ors_key, [start_coord, end_coord])
+            # Apply more accurate traffic multiplier based on location and time
+            # Get the midpoint of the segment for traffic calculation
+            mid_lat = (start_coord[0] + end_coord[0]) / 2
+            mid_lon = (start_coord[1] + end_coord[1]) / 2
             
-            if segment_directions and "features" in segment_directions and len(segment_directions["features"]) > 0:
-                feat = segment_directions["features"][0]
-                summary = feat.get("properties", {}).get("summary", {})
-                segment_distance = float(summary.get("distance", 0.0))
-                segment_duration = float(summary.get("duration", 0.0)) / 60.0  # Convert to minutes
-                
-                # Apply more accurate traffic multiplier based on location and time
-                # Get the midpoint of the segment for traffic calculation
-                mid_lat = (start_coord[0] + end_coord[0]) / 2
-                mid_lon = (start_coord[1] + end_coord[1]) / 2
-                
-                # Try to get real-time traffic data first
-                real_time_traffic = get_real_time_traffic_data(mid_lat, mid_lon)
-                if real_time_traffic:
-                    # Use real-time traffic data if available
-                    traffic_multiplier = real_time_traffic.get('multiplier', 1.8)
-                    logger.info(f"    Using real-time traffic multiplier: {traffic_multiplier:.2f}")
-                else:
-                    # Use improved traffic calculation
-                    traffic_multiplier = get_traffic_multiplier(mid_lat, mid_lon)
-                    
-                    # Additional adjustment based on distance (longer routes have more variability)
-                    if segment_distance > 10:  # Long distance
-                        traffic_multiplier *= 1.1
-                    elif segment_distance < 2:  # Short distance
-                        traffic_multiplier *= 0.9
-                
-                # Apply traffic multiplier with some smoothing
-                segment_duration *= traffic_multiplier
-                
-                # Add small buffer for real-world conditions (parking, traffic lights, etc.)
-                segment_duration += 1.0  # 1 minute buffer per segment
-                
-                total_segment_duration += segment_duration
-                total_segment_distance += segment_distance
-                
-                raw_duration = segment_duration / traffic_multiplier
-                logger.info(f"  Segment {i+1}: {ordered_addresses[i]} → {ordered_addresses[i+1]}")
-                logger.info(f"    Coordinates: {start_coord} → {end_coord}")
-                logger.info(f"    Distance: {segment_distance:.2f} km")
-                logger.info(f"    Raw ORS duration: {raw_duration:.2f} min")
-                logger.info(f"    Adjusted duration: {segment_duration:.2f} min (×{traffic_multiplier})")
+            # Try to get real-time traffic data first
+            real_time_traffic = get_real_time_traffic_data(mid_lat, mid_lon)
+            if real_time_traffic:
+                # Use real-time traffic data if available
+                traffic_multiplier = real_time_traffic.get('multiplier', 1.8)
+                logger.info(f"    Using real-time traffic multiplier: {traffic_multiplier:.2f}")
+            else:
+                # Use improved traffic calculation
+                traffic_multiplier = get_traffic_multiplier(mid_lat, mid_lon)
                 
-                # Debug: Also test the reverse direction to see if there's a difference
+                # Additional adjustment based on distance (longer routes have more variability)
+                if segment_distance > 10:  # Long distance
+                    traffic_multiplier *= 1.1
+                elif segment_distance < 2:  # Short distance
+                    traffic_multiplier *= 0.9
+            
+            # Apply traffic multiplier with some smoothing
+            segment_duration *= traffic_multiplier
+            
+            # Add small buffer for real-world conditions (parking, traffic lights, etc.)
+            segment_duration += 1.0  # 1 minute buffer per segment
+            
+            total_segment_duration += segment_duration
+            total_segment_distance += segment_distance
+            
+            raw_duration = segment_seconds / 60.0
+            logger.info(f"  Segment {i+1}: {ordered_addresses[i]} → {ordered_addresses[i+1]}")
+            logger.info(f"    Coordinates: {start_coord} → {end_coord}")
+            logger.info(f"    Distance: {segment_distance:.2f} km")
+            logger.info(f"    Raw ORS duration: {raw_duration:.2f} min")
+            logger.info(f"    Adjusted duration: {segment_duration:.2f} min (×{traffic_multiplier})")
+            
+            # Debug: Also test the reverse direction to see if there's a difference
+            if DEBUG_REVERSE_LEG_PROBE:
                 reverse_directions = ors_directions(ors_key, [end_coord, start_coord])
                 if reverse_directions and "features" in reverse_directions and len(reverse_directions["features"]) > 0:
                     reverse_feat = reverse_directions["features"][0]
                     reverse_summary = reverse_feat.get("properties", {}).get("summary", {})
                     reverse_duration = float(reverse_summary.get("duration", 0.0)) / 60.0
-                    logger.info(f"    Reverse duration: {reverse_duration:.2f} min (difference: {abs(segment_duration - reverse_duration):.2f} min)")
-            else:
-                logger.warning(f"  Failed to get directions for segment {i+1}")
+                    logger.info(f"    Reverse duration: {reverse_duration:.2f} min (difference: {abs(raw_duration - reverse_duration):.2f} min)")
+        
+        total_distance_km = total_segment_distance
         
         # Add delivery time at each stop (except the last one)
         delivery_time_per_stop = 3.0  # 3 minutes per stop for delivery (more realistic)
@@ -1245,39 +3664,20 @@ def plan_full_route(req: PlanRouteRequest):
         logger.info(f"  Expected Google Maps: Current→GAT (8min) + GAT→BMS (24min) = 32min")
         logger.info(f"  Our calculation: {ors_duration_minutes:.2f} min")
         logger.info(f"  Difference: {ors_duration_minutes - 32:.2f} min")
-        
-        # Get the full route geometry for display (from start to end)
-        directions = ors_directions(ors_key, ordered_coords)
-        if directions and "features" in directions and len(directions["features"]) > 0:
-            route_geojson = directions["features"][0]
     else:
         logger.warning("Need at least 2 stops for route calculation")
 
     # 4) Predict ETA using our ML model (if loaded)
     predicted_eta = None
     try:
-        use_start_time = req.start_time or datetime.now().isoformat()
-        if eta_model is not None and model_columns is not None:
-            input_df = pd.DataFrame([{
+        use_start_time = start_time or datetime.now().isoformat()
+        if eta_registry.active is not None:
+            predicted_eta = float(predict_eta_minutes([{
                 "ors_duration_minutes": ors_duration_minutes,
                 "total_distance_km": total_distance_km,
                 "num_stops": num_stops,
                 "start_time": use_start_time,
-            }])
-            input_df['start_time'] = pd.to_datetime(input_df['start_time'])
-            hour = input_df['start_time'].dt.hour
-            def get_time_of_day(hour):
-                if 6 <= hour < 11: return 'Morning'
-                elif 11 <= hour < 17: return 'Afternoon'
-                elif 17 <= hour < 21: return 'Evening_Rush'
-                else: return 'Night'
-            input_df['time_of_day'] = hour.apply(get_time_of_day)
-            input_df['day_of_week'] = input_df['start_time'].dt.dayofweek.apply(lambda x: 'Weekday' if x < 5 else 'Weekend')
-            input_df = input_df.drop('start_time', axis=1)
-            input_df = pd.get_dummies(input_df)
-            input_df = input_df.reindex(columns=model_columns, fill_value=0)
-            pred = eta_model.predict(input_df)
-            predicted_eta = float(pred[0])
+            }])[0])
             
             # Check if ML prediction is reasonable (not more than 2x ORS duration)
             if predicted_eta > ors_duration_minutes * 2:
@@ -1307,6 +3707,319 @@ def plan_full_route(req: PlanRouteRequest):
         "route_geometry_geojson": route_geojson,
     }
 
+# --- Plan Cache (incremental re-planning) ---
+PLAN_CACHE_TTL_SECONDS = int(os.environ.get("PLAN_CACHE_TTL_SECONDS", str(12 * 3600)))
+# Matrices grow with the square of the stop count, so the cache is bounded by their bytes
+PLAN_CACHE_MAX_BYTES = int(os.environ.get("PLAN_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+_plan_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_plan_cache_bytes = 0
+_plan_cache_lock = threading.Lock()
+
+def _remember_plan(ordered_addresses: List[str], ordered_coords: List[Tuple[float, float]],
+                   matrix: np.ndarray, sequential: bool) -> str:
+    """Keep a plan's stops, its cost matrix (in visiting order) and its mode for later re-plans."""
+    global _plan_cache_bytes
+    plan_id = uuid.uuid4().hex
+    with _plan_cache_lock:
+        _plan_cache[plan_id] = {
+            "addresses": list(ordered_addresses),
+            "coords": [tuple(c) for c in ordered_coords],
+            "matrix": matrix,
+            "sequential": sequential,
+            "stored_at": time.time(),
+        }
+        _plan_cache_bytes += matrix.nbytes
+        while _plan_cache and _plan_cache_bytes > PLAN_CACHE_MAX_BYTES:
+            _, evicted = _plan_cache.popitem(last=False)
+            _plan_cache_bytes -= evicted["matrix"].nbytes
+    return plan_id
+
+def _recall_plan(plan_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    global _plan_cache_bytes
+    if not plan_id:
+        return None
+    with _plan_cache_lock:
+        entry = _plan_cache.get(plan_id)
+        if entry is None:
+            return None
+        if time.time() - entry["stored_at"] > PLAN_CACHE_TTL_SECONDS:
+            del _plan_cache[plan_id]
+            _plan_cache_bytes -= entry["matrix"].nbytes
+            return None
+        _plan_cache.move_to_end(plan_id)
+        return entry
+
+def _matrix_leg_metrics(matrix: Optional[Dict[str, Any]], order_idx: List[int]) -> Optional[List[Tuple[float, float]]]:
+    """(km, seconds) for every leg of the order, read from an already fetched matrix."""
+    if matrix is None or matrix.get("distances") is None or matrix.get("durations") is None:
+        return None
+    distances = _as_cost_matrix(matrix["distances"])
+    durations = _as_cost_matrix(matrix["durations"])
+    return [(float(distances[a, b]), float(durations[a, b])) for a, b in zip(order_idx, order_idx[1:])]
+
+def _finalize_and_remember(prepared: Dict[str, Any], order_idx: List[int], start_time: Optional[str]) -> Dict[str, Any]:
+    ordered_addresses = [prepared["addresses"][i] for i in order_idx]
+    ordered_coords = [prepared["coords"][i] for i in order_idx]
+    plan = _finalize_plan(start_time, ordered_addresses, ordered_coords, prepared["ors_key"],
+                          _matrix_leg_metrics(prepared["matrix"], order_idx))
+    # Decomposed plans have no prepared matrix; _order_stops records their flag instead
+    plan["degraded"] = bool(prepared.get("degraded") or (prepared["matrix"] and prepared["matrix"].get("degraded")))
+    if prepared["matrix"] is not None:
+        m = _as_cost_matrix(_metric_matrix(prepared["matrix"]))
+        sequential = prepared.get("sequential", prepared.get("start_index") == 0)
+        plan["plan_id"] = _remember_plan(ordered_addresses, ordered_coords, m[np.ix_(order_idx, order_idx)],
+                                         sequential)
+    return plan
+
+def _cheapest_insertion_position(m: np.ndarray, tour: np.ndarray, node: int) -> int:
+    """Index in tour at which inserting node adds the least cost (tour[0] stays first)."""
+    u, v = tour[:-1], tour[1:]
+    deltas = m[u, node] + m[node, v] - m[u, v]
+    return int(np.argmin(deltas)) + 1
+
+def _plan_route(req: PlanRouteRequest,
+                geocoded: Optional[Dict[str, Optional[Tuple[float, float]]]] = None) -> Dict[str, Any]:
+    prepared = _prepare_route(req, geocoded)
+    if prepared is None:
+        return _empty_plan()
+    order_idx = _order_stops(prepared, req.time_budget_ms)
+    if order_idx is None:
+        return _empty_plan()
+    return _finalize_and_remember(prepared, order_idx, req.start_time)
+
+@app.post("/plan-full-route", response_model=PlannedRouteResponse)
+async def plan_full_route(req: PlanRouteRequest):
+    geocoded = await geocode_addresses(req.addresses)
+    return await run_in_threadpool(_plan_route, req, geocoded)
+
+BATCH_PLAN_WORKERS = int(os.environ.get("BATCH_PLAN_WORKERS", "4"))
+
+@app.post("/plan-batch", response_model=PlanBatchResponse)
+async def plan_batch(req: PlanBatchRequest):
+    """Plan many independent routes in one request; plans come back in request order.
+
+    Every distinct address in the batch is geocoded once (concurrently), then
+    the per-route matrix fetch and optimization run concurrently. A route that
+    cannot be planned yields an empty plan in its slot.
+    """
+    geocoded = await geocode_addresses([a for r in req.requests for a in r.addresses])
+    total = sum(len(r.addresses) for r in req.requests)
+    logger.info(f"📦 Batch: {len(req.requests)} routes, {total} addresses, {len(geocoded)} unique geocodes")
+
+    def plan_one(route_req: PlanRouteRequest) -> Dict[str, Any]:
+        try:
+            return _plan_route(route_req, geocoded)
+        except Exception as e:
+            logger.error(f"❌ Batch route failed: {e}")
+            return _empty_plan()
+
+    def plan_all() -> List[Dict[str, Any]]:
+        with ThreadPoolExecutor(max_workers=BATCH_PLAN_WORKERS) as pool:
+            return list(pool.map(plan_one, req.requests))
+
+    return {"plans": await run_in_threadpool(plan_all)}
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/plan-full-route/stream")
+async def plan_full_route_stream(req: PlanRouteRequest):
+    """Server-sent events version of /plan-full-route.
+
+    Emits an `improvement` event for every better order the optimizer finds
+    (within time_budget_ms, default ANYTIME_DEFAULT_BUDGET_MS) and a final
+    `plan` event carrying the full PlannedRouteResponse.
+    """
+    geocoded = await geocode_addresses(req.addresses)
+
+    def events():
+        prepared = _prepare_route(req, geocoded)
+        if prepared is None:
+            yield _sse_event("plan", _empty_plan())
+            return
+        addresses = prepared["addresses"]
+        coords = prepared["coords"]
+        updates: "queue.Queue[Optional[Tuple[List[int], float]]]" = queue.Queue()
+        result: Dict[str, Any] = {}
+
+        def optimize():
+            try:
+                result["order"] = _order_stops(prepared, req.time_budget_ms or ANYTIME_DEFAULT_BUDGET_MS,
+                                               lambda order, cost: updates.put((order, cost)))
+            except Exception as e:
+                logger.error(f"❌ Streaming optimization failed: {e}")
+            finally:
+                updates.put(None)
+
+        threading.Thread(target=optimize, daemon=True).start()
+        best_order = None
+        while True:
+            update = updates.get()
+            if update is None:
+                break
+            best_order, cost = update
+            yield _sse_event("improvement", {
+                "order": best_order,
+                "ordered_addresses": [addresses[i] for i in best_order],
+                "ordered_coordinates": [coords[i] for i in best_order],
+                "cost": round(cost, 2),
+            })
+        order_idx = result.get("order") or best_order
+        if order_idx is None:
+            yield _sse_event("plan", _empty_plan())
+            return
+        yield _sse_event("plan", _finalize_and_remember(prepared, order_idx, req.start_time))
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.post("/replan-route", response_model=PlannedRouteResponse)
+async def replan_route(req: ReplanRouteRequest):
+    """Apply added/cancelled stops to a previously returned plan.
+
+    Kept stops keep their coordinates and relative order. New stops are
+    geocoded and placed by cheapest insertion, then a local Or-opt repair runs
+    around every touched position. Sequential plans (stops kept in the order
+    they were added) instead get the new stops appended in the order given.
+    If the plan is still cached (plan_id), only the matrix rows and columns of
+    the new stops are fetched (two block requests); otherwise one matrix for
+    the updated stop list is requested.
+    """
+    existing = set(req.ordered_addresses) - set(req.remove_addresses)
+    geocoded = await geocode_addresses([a for a in req.add_addresses if a not in existing])
+    return await run_in_threadpool(_replan_route, req, geocoded)
+
+def _replan_route(req: ReplanRouteRequest, geocoded: Dict[str, Optional[Tuple[float, float]]]) -> Dict[str, Any]:
+    if len(req.ordered_addresses) != len(req.ordered_coordinates) or not req.ordered_addresses:
+        raise HTTPException(status_code=400, detail="ordered_addresses and ordered_coordinates must be non-empty and aligned")
+    ors_key = ORS_API_KEY or os.environ.get("ORS_API_KEY", "")
+    if not ors_key:
+        logger.warning("ORS_API_KEY not set; route planning will fail")
+        return _empty_plan()
+
+    removed = set(req.remove_addresses)
+    if req.ordered_addresses[0] in removed:
+        logger.warning("Ignoring removal of the route's start stop")
+        removed.discard(req.ordered_addresses[0])
+    keep = [i for i, a in enumerate(req.ordered_addresses) if a not in removed]
+    # Neighbours of removed stops are worth re-checking after the gap closes; a kept stop
+    # followed by a removed tail counts too, since it is now the last stop
+    following = keep[1:] + [len(req.ordered_addresses)]
+    touched_old = {i for i, nxt in zip(keep, following) if nxt != i + 1}
+
+    existing = set(req.ordered_addresses) - removed
+    new_addresses = []
+    for addr in req.add_addresses:
+        if addr not in existing and addr not in new_addresses:
+            new_addresses.append(addr)
+    new_coords: List[Tuple[float, float]] = []
+    for addr in new_addresses:
+        c = geocoded.get(addr)
+        if c is None:
+            logger.warning(f"❌ Could not geocode added stop '{addr}'")
+            return _empty_plan()
+        new_coords.append(c)
+
+    addresses = [req.ordered_addresses[i] for i in keep] + new_addresses
+    coords = [tuple(req.ordered_coordinates[i]) for i in keep] + new_coords
+    n_old, k = len(keep), len(new_coords)
+
+    cached = _recall_plan(req.plan_id)
+    if cached is not None and cached["addresses"] != list(req.ordered_addresses):
+        cached = None
+    sequential = req.sequential if req.sequential is not None else bool(cached and cached["sequential"])
+    if cached is not None:
+        m = np.empty((n_old + k, n_old + k))
+        m[:n_old, :n_old] = cached["matrix"][np.ix_(keep, keep)]
+        degraded = False
+        if k:
+            new_idx = list(range(n_old, n_old + k))
+            rows = ors_matrix(ors_key, coords, sources=new_idx)
+            cols = ors_matrix(ors_key, coords, sources=list(range(n_old)), destinations=new_idx)
+            if not rows or "distances" not in rows or not cols or "distances" not in cols:
+                return _empty_plan()
+            m[n_old:, :] = _as_cost_matrix(_metric_matrix(rows))
+            m[:n_old, n_old:] = _as_cost_matrix(_metric_matrix(cols))
+            degraded = bool(rows.get("degraded") or cols.get("degraded"))
+        logger.info(f"♻️ Re-plan from cached plan {req.plan_id}: kept {n_old}, added {k}")
+    else:
+        full = ors_matrix(ors_key, coords)
+        if full is None or "distances" not in full:
+            return _empty_plan()
+        m = _as_cost_matrix(_metric_matrix(full))
+        degraded = bool(full.get("degraded"))
+        logger.info(f"♻️ Re-plan without cached matrix: kept {n_old}, added {k}")
+
+    if sequential:
+        # Sequential plans visit stops in the order they were added, so new stops go last
+        order_idx = list(range(n_old + k))
+    else:
+        # Open-ended path: the zero-cost sink lets new stops go after the current last stop
+        ms = _with_open_end(m)
+        tour = np.append(np.arange(n_old, dtype=np.intp), len(m))
+        for node in range(n_old, n_old + k):
+            tour = np.insert(tour, _cheapest_insertion_position(ms, tour, node), node)
+        touched = [keep.index(i) for i in touched_old] + list(range(n_old, n_old + k))
+        _repair_around(ms, tour, touched)
+        order_idx = tour[:-1].tolist()
+
+    prepared = {"addresses": addresses, "coords": coords, "ors_key": ors_key, "sequential": sequential,
+                "matrix": {"durations": m, "degraded": degraded}}
+    return _finalize_and_remember(prepared, order_idx, req.start_time)
+
+@app.post("/plan-fleet", response_model=PlanFleetResponse)
+async def plan_fleet(req: PlanFleetRequest):
+    """Split stops across a fleet and sequence every vehicle's route in one solve.
+
+    All depots and stops share a single ORS matrix; assignment and ordering
+    respect vehicle capacity, shift length and per-stop time windows.
+    """
+    if not req.vehicles:
+        raise HTTPException(status_code=400, detail="At least one vehicle is required")
+    geocoded = await geocode_addresses([v.start_address for v in req.vehicles] + [s.address for s in req.stops])
+    return await run_in_threadpool(_plan_fleet, req, geocoded)
+
+def _plan_fleet(req: PlanFleetRequest, geocoded: Dict[str, Optional[Tuple[float, float]]]) -> Dict[str, Any]:
+    ors_key = ORS_API_KEY or os.environ.get("ORS_API_KEY", "")
+    if not ors_key:
+        logger.warning("ORS_API_KEY not set; route planning will fail")
+        raise HTTPException(status_code=503, detail="ORS API key not set")
+
+    # Matrix nodes: unique depots first, then stops
+    depot_addresses: List[str] = []
+    for v in req.vehicles:
+        if v.start_address not in depot_addresses:
+            depot_addresses.append(v.start_address)
+    addresses = depot_addresses + [s.address for s in req.stops]
+    coords: List[Tuple[float, float]] = []
+    for addr in addresses:
+        c = geocoded.get(addr)
+        if c is None:
+            raise HTTPException(status_code=422, detail=f"Could not geocode '{addr}'")
+        coords.append(c)
+
+    matrix = ors_matrix(ors_key, coords)
+    if matrix is None or "durations" not in matrix:
+        raise HTTPException(status_code=502, detail="Failed to get ORS matrix")
+    T = _as_cost_matrix(matrix["durations"]) / 60.0
+
+    vehicle_depots = [depot_addresses.index(v.start_address) for v in req.vehicles]
+    stops = {len(depot_addresses) + i: s for i, s in enumerate(req.stops)}
+    routes, unassigned = solve_fleet(T, vehicle_depots, req.vehicles, stops)
+    logger.info(f"🚛 Fleet plan: {len(req.stops)} stops over {len(req.vehicles)} vehicles, {len(unassigned)} unassigned")
+
+    plans = []
+    for v, route in zip(req.vehicles, routes):
+        nodes = [depot_addresses.index(v.start_address)] + route
+        plan = _finalize_plan(req.start_time, [addresses[i] for i in nodes],
+                              [coords[i] for i in nodes], ors_key, _matrix_leg_metrics(matrix, nodes))
+        plan["degraded"] = bool(matrix.get("degraded"))
+        plans.append({
+            "vehicle_id": v.vehicle_id,
+            "load": sum(stops[s].demand for s in route),
+            "route": plan,
+        })
+    return {"routes": plans, "unassigned_addresses": [addresses[s] for s in unassigned]}
+
 # Run the app
 @app.post("/submit-training-data")
 def submit_training_data(data: TrainingDataRequest):
@@ -1702,4 +4415,7 @@ def debug_route(addresses: str):
 
 if __name__ == "__main__":
     import uvicorn
+    # Optimizer pool workers re-run a __main__ that has a __file__ as "__mp_main__";
+    # without it they import only route_optimizer instead of this whole server.
+    del __file__
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,511 @@
+# route_optimizer.py (STOP-ORDER OPTIMIZER)
+#
+# The NumPy-only half of route planning: local search, multistart construction,
+# the exact Held-Karp solver and the optimizer process pool. main.py imports it;
+# it lives in its own module so pool workers, which start from a fresh interpreter
+# rather than a fork of the server, import only this file and NumPy instead of the
+# whole API with its OCR and ETA models.
+
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Unroutable cells (None/NaN from ORS) are priced so that no search ever prefers them
+UNROUTABLE_COST = 1e9
+IMPROVEMENT_EPSILON = 1e-9
+
+def _as_cost_matrix(matrix_dist: Any) -> np.ndarray:
+    """Return the matrix as a float64 NumPy array, pricing missing cells as unroutable."""
+    m = np.array(matrix_dist, dtype=float)
+    m[~np.isfinite(m)] = UNROUTABLE_COST
+    return m
+
+def _route_cost(matrix_dist: Any, order: List[int]) -> float:
+    if len(order) < 2:
+        return 0.0
+    m = matrix_dist if isinstance(matrix_dist, np.ndarray) else _as_cost_matrix(matrix_dist)
+    idx = np.asarray(order, dtype=np.intp)
+    return float(m[idx[:-1], idx[1:]].sum())
+
+def _leg_prefix_sums(m: np.ndarray, tour: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Cumulative forward and backward leg costs along the tour.
+
+    fwd[k] - fwd[i] is the cost of travelling tour[i..k] as is, bwd[k] - bwd[i]
+    the cost of the same stops travelled in reverse. With these a reversal is
+    priced in O(1) even when the matrix is asymmetric.
+    """
+    fwd = np.zeros(len(tour))
+    bwd = np.zeros(len(tour))
+    np.cumsum(m[tour[:-1], tour[1:]], out=fwd[1:])
+    np.cumsum(m[tour[1:], tour[:-1]], out=bwd[1:])
+    return fwd, bwd
+
+def _two_opt_deltas(m: np.ndarray, tour: np.ndarray, fwd: np.ndarray, bwd: np.ndarray,
+                    i: Any, k: Any) -> Any:
+    """Cost change of reversing tour[i..k] (1 <= i < k <= n-2); i and k may be arrays."""
+    p, a, b, q = tour[i - 1], tour[i], tour[k], tour[k + 1]
+    return (m[p, b] + m[a, q] - m[p, a] - m[b, q]
+            + (bwd[k] - bwd[i]) - (fwd[k] - fwd[i]))
+
+def _expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.perf_counter() >= deadline
+
+def _two_opt_first_pass(m: np.ndarray, tour: np.ndarray, deadline: Optional[float] = None) -> bool:
+    """One first-improvement sweep; accepted reversals are applied to `tour` in place."""
+    n = len(tour)
+    fwd, bwd = _leg_prefix_sums(m, tour)
+    improved = False
+    for i in range(1, n - 2):
+        if _expired(deadline):
+            break
+        ks = np.arange(i + 1, n - 1)
+        deltas = _two_opt_deltas(m, tour, fwd, bwd, i, ks)
+        hits = np.flatnonzero(deltas < -IMPROVEMENT_EPSILON)
+        if hits.size:
+            k = int(ks[hits[0]])
+            tour[i:k + 1] = tour[i:k + 1][::-1].copy()
+            fwd, bwd = _leg_prefix_sums(m, tour)
+            improved = True
+    return improved
+
+def _two_opt_best_move(m: np.ndarray, tour: np.ndarray) -> bool:
+    """Apply the single best reversal over all (i, k) pairs, if it improves the tour."""
+    n = len(tour)
+    fwd, bwd = _leg_prefix_sums(m, tour)
+    i, k = np.triu_indices(n - 2, k=1)
+    i = i + 1
+    k = k + 1
+    deltas = _two_opt_deltas(m, tour, fwd, bwd, i, k)
+    best = int(np.argmin(deltas))
+    if deltas[best] >= -IMPROVEMENT_EPSILON:
+        return False
+    a, b = int(i[best]), int(k[best])
+    tour[a:b + 1] = tour[a:b + 1][::-1].copy()
+    return True
+
+def two_opt_improvement(matrix_dist: Any, order: List[int], max_iterations: int = 200,
+                        mode: str = "first") -> List[int]:
+    """2-opt local search to improve a given route order.
+    Keeps first and last nodes fixed; improves internal sequence for lower total cost.
+
+    Each candidate reversal is scored from the two replaced edges plus the
+    direction change of the reversed segment, so a sweep costs O(n^2) instead of
+    O(n^3). mode="first" applies every improving reversal as soon as it is found
+    (max_iterations bounds the sweeps); mode="best" applies the best reversal of
+    the whole neighbourhood per iteration.
+    """
+    if len(order) <= 3:
+        return list(order)
+    if mode not in ("first", "best"):
+        raise ValueError(f"Unknown 2-opt mode: {mode}")
+    m = matrix_dist if isinstance(matrix_dist, np.ndarray) else _as_cost_matrix(matrix_dist)
+    tour = np.array(order, dtype=np.intp)
+    step = _two_opt_best_move if mode == "best" else _two_opt_first_pass
+    iterations = 0
+    improved = True
+    while improved and iterations < max_iterations:
+        iterations += 1
+        improved = step(m, tour)
+    return tour.tolist()
+
+def _relocate_chain(m: np.ndarray, tour: np.ndarray, i: int, max_chain: int = 3) -> bool:
+    """Move the best chain starting at position i (1..max_chain stops) to its cheapest spot.
+
+    Removing chain a..b from p->a..b->q and re-inserting it between u->v changes
+    exactly three edges, so every candidate is priced in O(1) and the chain keeps
+    its travel direction (important on one-way streets).
+    """
+    n = len(tour)
+    for length in range(1, max_chain + 1):
+        last = i + length - 1
+        if last > n - 2:
+            break
+        p, a, b, q = tour[i - 1], tour[i], tour[last], tour[last + 1]
+        removal_gain = m[p, a] + m[b, q] - m[p, q]
+        js = np.concatenate((np.arange(0, i - 1), np.arange(last + 1, n - 1)))
+        if js.size == 0:
+            continue
+        u, v = tour[js], tour[js + 1]
+        deltas = m[u, a] + m[b, v] - m[u, v] - removal_gain
+        best = int(np.argmin(deltas))
+        if deltas[best] < -IMPROVEMENT_EPSILON:
+            j = int(js[best])
+            chain = tour[i:last + 1].copy()
+            rest = np.concatenate((tour[:i], tour[last + 1:]))
+            pos = j + 1 if j < i else j + 1 - length
+            tour[:] = np.concatenate((rest[:pos], chain, rest[pos:]))
+            return True
+    return False
+
+def _or_opt_pass(m: np.ndarray, tour: np.ndarray, deadline: Optional[float] = None,
+                 max_chain: int = 3) -> bool:
+    """One Or-opt sweep: relocate chains of 1..max_chain stops without reversing them."""
+    improved = False
+    for i in range(1, len(tour) - 1):
+        if _expired(deadline):
+            break
+        if _relocate_chain(m, tour, i, max_chain):
+            improved = True
+    return improved
+
+def _repair_around(m: np.ndarray, tour: np.ndarray, nodes: Sequence[int], max_chain: int = 3,
+                   max_rounds: int = 3) -> None:
+    """Local repair limited to chains starting at, or just before, the given nodes.
+
+    Each round costs O(len(nodes) * n), which keeps incremental re-plans
+    proportional to the size of the change rather than the route.
+    """
+    for _ in range(max_rounds):
+        improved = False
+        for node in nodes:
+            pos = int(np.flatnonzero(tour == node)[0])
+            for i in (pos - 1, pos):
+                if 1 <= i < len(tour) - 1 and _relocate_chain(m, tour, i, max_chain):
+                    improved = True
+                    break
+        if not improved:
+            return
+
+def _or3opt_pass(m: np.ndarray, tour: np.ndarray, deadline: Optional[float] = None) -> bool:
+    """One segment-exchange (reversal-free 3-opt) sweep.
+
+    Swaps adjacent segments tour[i..j] and tour[j+1..k], i.e. p,S1,S2,q becomes
+    p,S2,S1,q. Both segments keep their direction, so only the three boundary
+    edges change. For each i the whole (j, k) plane is scored at once, which is
+    O(n^2), so the deadline is checked before every i.
+    """
+    n = len(tour)
+    improved = False
+    for i in range(1, n - 2):
+        if _expired(deadline):
+            break
+        js = np.arange(i, n - 2)[:, None]
+        ks = np.arange(i + 1, n - 1)[None, :]
+        p, a = tour[i - 1], tour[i]
+        deltas = (m[p, tour[js + 1]] + m[tour[ks], a] + m[tour[js], tour[ks + 1]]
+                  - m[p, a] - m[tour[js], tour[js + 1]] - m[tour[ks], tour[ks + 1]])
+        deltas = np.where(ks > js, deltas, np.inf)
+        best = int(np.argmin(deltas))
+        jj, kk = np.unravel_index(best, deltas.shape)
+        if deltas[jj, kk] < -IMPROVEMENT_EPSILON:
+            j, k = i + int(jj), i + 1 + int(kk)
+            tour[i:k + 1] = np.concatenate((tour[j + 1:k + 1], tour[i:j + 1]))
+            improved = True
+    return improved
+
+# Pluggable neighbourhoods for local_search: each pass takes (matrix, tour, deadline),
+# applies improving moves to the tour in place and reports whether it changed. A pass
+# stops early once time.perf_counter() reaches the deadline (None means no limit).
+# The first and last positions of the tour are never moved.
+LOCAL_SEARCH_NEIGHBOURHOODS: Dict[str, Callable[[np.ndarray, np.ndarray, Optional[float]], bool]] = {
+    "2opt": _two_opt_first_pass,
+    "or_opt": _or_opt_pass,
+    "or3opt": _or3opt_pass,
+}
+
+def _is_symmetric(m: np.ndarray) -> bool:
+    return bool(np.allclose(m, m.T, rtol=1e-3, atol=1e-6))
+
+def default_neighbourhoods(m: np.ndarray) -> Tuple[str, ...]:
+    """Reversal-free moves for asymmetric (duration) matrices, 2-opt first otherwise."""
+    if _is_symmetric(m):
+        return ("2opt", "or_opt")
+    return ("or_opt", "or3opt")
+
+def local_search(matrix_dist: Any, order: List[int], neighbourhoods: Optional[Sequence[str]] = None,
+                 max_iterations: int = 200, deadline: Optional[float] = None) -> List[int]:
+    """Variable neighbourhood descent over the given neighbourhoods.
+
+    Neighbourhoods are tried in order; whenever one improves the tour the search
+    restarts from the first (cheapest) one. Stops at a local optimum of all of
+    them, after max_iterations passes or once time.perf_counter() passes
+    deadline, which is also checked inside every pass. First and last nodes
+    stay fixed.
+    """
+    if len(order) <= 3:
+        return list(order)
+    m = matrix_dist if isinstance(matrix_dist, np.ndarray) else _as_cost_matrix(matrix_dist)
+    names = tuple(neighbourhoods) if neighbourhoods else default_neighbourhoods(m)
+    unknown = [name for name in names if name not in LOCAL_SEARCH_NEIGHBOURHOODS]
+    if unknown:
+        raise ValueError(f"Unknown neighbourhood(s): {unknown}")
+    tour = np.array(order, dtype=np.intp)
+    level = 0
+    iterations = 0
+    while level < len(names) and iterations < max_iterations:
+        if _expired(deadline):
+            break
+        iterations += 1
+        if LOCAL_SEARCH_NEIGHBOURHOODS[names[level]](m, tour, deadline):
+            level = 0
+        else:
+            level += 1
+    return tour.tolist()
+
+# --- Multistart Construction ---
+MULTISTART_STARTS = int(os.environ.get("MULTISTART_STARTS", "16"))
+# Below this many stops a process pool costs more than it saves
+MULTISTART_PARALLEL_MIN_STOPS = int(os.environ.get("MULTISTART_PARALLEL_MIN_STOPS", "40"))
+MULTISTART_WORKERS = int(os.environ.get("MULTISTART_WORKERS", str(os.cpu_count() or 1)))
+# Randomized nearest neighbour picks uniformly among this many closest stops
+RANDOMIZED_NN_CANDIDATES = 3
+
+def _greedy_nearest_neighbor(m: np.ndarray, start_index: int, end_index: Optional[int] = None,
+                             first_hop: Optional[int] = None,
+                             rng: Optional[random.Random] = None) -> List[int]:
+    """Nearest neighbour on an array; optionally forces the first hop or randomizes picks."""
+    n = len(m)
+    unvisited = np.ones(n, dtype=bool)
+    unvisited[start_index] = False
+    if end_index is not None:
+        unvisited[end_index] = False
+    order = [start_index]
+    current = start_index
+    if first_hop is not None and unvisited[first_hop]:
+        order.append(first_hop)
+        unvisited[first_hop] = False
+        current = first_hop
+    while unvisited.any():
+        candidates = np.flatnonzero(unvisited)
+        costs = m[current, candidates]
+        if rng is None:
+            nxt = int(candidates[np.argmin(costs)])
+        else:
+            top = min(RANDOMIZED_NN_CANDIDATES, len(candidates))
+            closest = np.argpartition(costs, top - 1)[:top]
+            nxt = int(candidates[rng.choice(list(closest))])
+        order.append(nxt)
+        unvisited[nxt] = False
+        current = nxt
+    if end_index is not None and end_index != start_index:
+        order.append(end_index)
+    return order
+
+def cheapest_insertion_order(m: np.ndarray, start_index: int, end_index: Optional[int] = None) -> List[int]:
+    """Open-path cheapest insertion from the start node.
+
+    Each round inserts the unrouted stop whose best position (between two
+    routed stops or at the end of the path) adds the least cost. A fixed end
+    stop is appended once every other stop is routed.
+    """
+    n = len(m)
+    tour = np.array([start_index], dtype=np.intp)
+    remaining = np.array([i for i in range(n) if i not in (start_index, end_index)], dtype=np.intp)
+    while remaining.size:
+        u, v = tour[:-1], tour[1:]
+        # between[r, e]: cost of putting remaining[r] on edge e; append_cost[r]: after the last stop
+        between = m[u][:, remaining].T + m[remaining][:, v] - m[u, v]
+        append_cost = m[tour[-1], remaining]
+        costs = np.column_stack((between, append_cost)) if between.size else append_cost[:, None]
+        r, e = np.unravel_index(int(np.argmin(costs)), costs.shape)
+        tour = np.insert(tour, e + 1, remaining[r])
+        remaining = np.delete(remaining, r)
+    if end_index is not None and end_index != start_index:
+        tour = np.append(tour, end_index)
+    return tour.tolist()
+
+def _construct_start(m: np.ndarray, start_index: int, end_index: Optional[int],
+                     construction: str, seed: Optional[int]) -> List[int]:
+    if construction == "nn":
+        return _greedy_nearest_neighbor(m, start_index, end_index, first_hop=seed)
+    if construction == "random_nn":
+        return _greedy_nearest_neighbor(m, start_index, end_index, rng=random.Random(seed))
+    if construction == "cheapest_insertion":
+        return cheapest_insertion_order(m, start_index, end_index)
+    raise ValueError(f"Unknown construction: {construction}")
+
+def _multistart_plan(m: np.ndarray, start_index: int, end_index: Optional[int],
+                     starts: int) -> List[Tuple[str, Optional[int]]]:
+    """Starting tours to try: plain NN, cheapest insertion, NN forced through the
+    start's nearest neighbours as first hop, then randomized NN for the rest."""
+    plan: List[Tuple[str, Optional[int]]] = [("nn", None), ("cheapest_insertion", None)]
+    others = np.array([i for i in range(len(m)) if i not in (start_index, end_index)], dtype=np.intp)
+    seeded = min(len(others), max(0, (starts - len(plan)) // 2))
+    if seeded:
+        nearest = others[np.argsort(m[start_index, others], kind="stable")[:seeded]]
+        plan.extend(("nn", int(i)) for i in nearest[1:])
+    seed = 1
+    while len(plan) < starts:
+        plan.append(("random_nn", seed))
+        seed += 1
+    return plan[:max(1, starts)]
+
+def _run_multistart_task(m: np.ndarray, start_index: int, end_index: Optional[int],
+                         construction: str, seed: Optional[int]) -> Tuple[float, List[int]]:
+    order = local_search(m, _construct_start(m, start_index, end_index, construction, seed))
+    return _route_cost(m, order), order
+
+def _multistart_worker(shm_name: str, shape: Tuple[int, int], start_index: int, end_index: Optional[int],
+                       construction: str, seed: Optional[int]) -> Tuple[float, List[int]]:
+    """Process-pool entry point: attaches to the shared matrix instead of receiving a copy."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        m = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        result = _run_multistart_task(m, start_index, end_index, construction, seed)
+        del m
+        return result
+    finally:
+        shm.close()
+
+_optimizer_pool: Optional[ProcessPoolExecutor] = None
+_optimizer_pool_lock = threading.Lock()
+
+def _get_optimizer_pool() -> ProcessPoolExecutor:
+    """Lazily create the shared optimizer pool.
+
+    Workers come from a forkserver (spawn where that is unavailable), never from
+    a fork of the server: its other threads may hold locks at fork time. The
+    forkserver preloads this module, so each worker starts with it imported.
+    """
+    global _optimizer_pool
+    with _optimizer_pool_lock:
+        if _optimizer_pool is None:
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                ctx = multiprocessing.get_context("forkserver")
+                ctx.set_forkserver_preload([__name__])
+            else:
+                ctx = multiprocessing.get_context("spawn")
+            _optimizer_pool = ProcessPoolExecutor(max_workers=max(1, MULTISTART_WORKERS), mp_context=ctx)
+            logger.info(f"⚙️ Optimizer process pool started with {MULTISTART_WORKERS} workers")
+        return _optimizer_pool
+
+def _reset_optimizer_pool() -> None:
+    global _optimizer_pool
+    with _optimizer_pool_lock:
+        if _optimizer_pool is not None:
+            _optimizer_pool.shutdown(wait=False, cancel_futures=True)
+        _optimizer_pool = None
+
+def _run_multistart_parallel(m: np.ndarray, start_index: int, end_index: Optional[int],
+                             plan: List[Tuple[str, Optional[int]]]) -> List[Tuple[float, List[int]]]:
+    shm = shared_memory.SharedMemory(create=True, size=m.nbytes)
+    try:
+        np.ndarray(m.shape, dtype=np.float64, buffer=shm.buf)[:] = m
+        pool = _get_optimizer_pool()
+        futures = [pool.submit(_multistart_worker, shm.name, m.shape, start_index, end_index, construction, seed)
+                   for construction, seed in plan]
+        return [f.result() for f in futures]
+    finally:
+        shm.close()
+        shm.unlink()
+
+def _with_open_end(m: np.ndarray) -> np.ndarray:
+    """Append a zero-cost sink node so an open path can be searched with a fixed last node.
+
+    Every stop reaches the sink for free and the sink leads nowhere, so the stop
+    visited just before it is the path's real (free) end.
+    """
+    n = len(m)
+    out = np.full((n + 1, n + 1), UNROUTABLE_COST)
+    out[:n, :n] = m
+    out[:n, n] = 0.0
+    out[n, n] = 0.0
+    return out
+
+def multistart_optimize(matrix: Any, start_index: int = 0, end_index: Optional[int] = None,
+                        starts: Optional[int] = None, parallel: bool = True) -> List[int]:
+    """Improve many starting tours with local search and return the cheapest.
+
+    Large problems fan out over a process pool sharing one copy of the matrix;
+    small ones, parallel=False (e.g. inside a pool worker) or a broken pool run
+    in-process. Without end_index the path may finish at any stop.
+    """
+    m = matrix if isinstance(matrix, np.ndarray) else _as_cost_matrix(matrix)
+    n = len(m)
+    open_end = end_index is None
+    if open_end:
+        m = _with_open_end(m)
+        end_index = n
+    m = np.ascontiguousarray(m, dtype=np.float64)
+    plan = _multistart_plan(m, start_index, end_index, starts or MULTISTART_STARTS)
+    results = None
+    if parallel and n >= MULTISTART_PARALLEL_MIN_STOPS and MULTISTART_WORKERS > 1 and len(plan) > 1:
+        try:
+            results = _run_multistart_parallel(m, start_index, end_index, plan)
+        except BrokenProcessPool as e:
+            logger.warning(f"Optimizer pool broke ({e}); falling back to in-process multistart")
+            _reset_optimizer_pool()
+    if results is None:
+        results = [_run_multistart_task(m, start_index, end_index, construction, seed)
+                   for construction, seed in plan]
+    best_cost, best_order = min(results, key=lambda r: r[0])
+    logger.info(f"🔁 Multistart: {len(plan)} starts, best cost {best_cost:.2f}")
+    return best_order[:-1] if open_end else best_order
+
+# --- Exact Solver ---
+# Routes up to this many stops (start included) are solved exactly
+HELD_KARP_MAX_STOPS = int(os.environ.get("HELD_KARP_MAX_STOPS", "14"))
+
+def held_karp_order(matrix: Any, start_index: int = 0, end_index: Optional[int] = None) -> List[int]:
+    """Exact cheapest open path from start_index through every stop (Held-Karp).
+
+    dp[mask, j] is the cheapest path leaving the start, visiting exactly the
+    stops in mask and ending at j. Masks are processed one popcount layer at a
+    time and every layer is relaxed with array ops, so 14 stops take ~16k x 13
+    cells and a few hundred NumPy calls. Time and memory grow as O(2^n * n), so
+    keep this to small routes.
+    """
+    m = matrix if isinstance(matrix, np.ndarray) else _as_cost_matrix(matrix)
+    n = len(m)
+    if n <= 2:
+        order = [start_index] + [i for i in range(n) if i != start_index]
+        return order
+    others = np.array([i for i in range(n) if i != start_index], dtype=np.intp)
+    k = len(others)
+    sub = m[np.ix_(others, others)]
+    bits = 1 << np.arange(k)
+    masks = np.arange(1 << k)
+    popcount = np.zeros(1 << k, dtype=np.int8)
+    for b in range(k):
+        popcount += ((masks >> b) & 1).astype(np.int8)
+
+    dp = np.full((1 << k, k), np.inf)
+    parent = np.full((1 << k, k), -1, dtype=np.int8)
+    dp[bits, np.arange(k)] = m[start_index, others]
+    for size in range(2, k + 1):
+        layer = masks[popcount == size]
+        for j in range(k):
+            sel = layer[(layer & bits[j]) != 0]
+            # dp[prev, i] + sub[i, j]; i == j is already inf because j is not in prev
+            cand = dp[sel ^ bits[j]] + sub[:, j]
+            best = np.argmin(cand, axis=1)
+            dp[sel, j] = cand[np.arange(len(sel)), best]
+            parent[sel, j] = best
+
+    full = (1 << k) - 1
+    if end_index is not None and end_index != start_index:
+        last = int(np.flatnonzero(others == end_index)[0])
+    else:
+        last = int(np.argmin(dp[full]))
+    path = []
+    mask = full
+    while last != -1:
+        path.append(int(others[last]))
+        prev = int(parent[mask, last])
+        mask ^= int(bits[last])
+        last = prev
+    return [start_index] + path[::-1]
+
+def solve_open_path(matrix: Any, start_index: int, end_index: Optional[int] = None,
+                    parallel: bool = True) -> List[int]:
+    """Exact Held-Karp for small matrices, multistart local search otherwise."""
+    if len(matrix) <= HELD_KARP_MAX_STOPS:
+        return held_karp_order(matrix, start_index, end_index)
+    return multistart_optimize(matrix, start_index, end_index, parallel=parallel)
+
+def _solve_cluster_path(m: np.ndarray, entry: int, exit_index: Optional[int]) -> List[int]:
+    """Pool task: order one cluster from its entry stop to its exit stop."""
+    if len(m) == 1:
+        return [0]
+    return solve_open_path(m, entry, exit_index, parallel=False)
@@ -172,7 +172,24 @@ print("✅ Model training complete!")
 predictions = model.predict(X_test)
 mae = mean_absolute_error(y_test, predictions)
 print(f"\n📊 Step 6: Model Evaluation - Mean Absolute Error (MAE): {mae:.2f} minutes")
-joblib.dump(model, 'eta_prediction_model.pkl')
-joblib.dump(list(X_train.columns), 'model_columns.pkl')
-print("✅ Model and columns saved successfully.")
+
+# --- Step 7: Publish to the Model Registry ---
+# Written to a hidden staging folder first and renamed into place, so the server's
+# registry poller never sees a half-written version.
+registry_dir = os.environ.get('MODEL_REGISTRY_DIR', 'model_registry')
+version = datetime.now().strftime('%Y%m%d-%H%M%S')
+staging_dir = os.path.join(registry_dir, f'.{version}.tmp')
+os.makedirs(staging_dir, exist_ok=True)
+joblib.dump(model, os.path.join(staging_dir, 'model.pkl'))
+joblib.dump(list(X_train.columns), os.path.join(staging_dir, 'model_columns.pkl'))
+with open(os.path.join(staging_dir, 'metrics.json'), 'w') as f:
+    json.dump({
+        'mae_minutes': round(float(mae), 3),
+        'train_samples': len(X_train),
+        'test_samples': len(X_test),
+        'trained_at': datetime.now().isoformat(),
+    }, f, indent=2)
+os.rename(staging_dir, os.path.join(registry_dir, version))
+print(f"✅ Step 7: Published model version {version} to {registry_dir}")
+print("   Running servers pick it up on their next registry poll unless a version is pinned in ACTIVE.")
 print("\n--- Script finished successfully! ---")
\ No newline at end of file